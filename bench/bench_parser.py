@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmark parsing envelopes with the shared parser in ``wsse.xml``.
+
+Compares, for envelopes of a few typical sizes, parsing with lxml's default
+parser (as the entry points used to do), with a new hardened parser created
+for each envelope, and with the per-thread cached parser used by
+``wsse.xml.fromstring()``.
+
+Run with ``python bench/bench_parser.py``.
+
+"""
+from __future__ import print_function
+
+import timeit
+
+from lxml import etree
+
+from wsse.constants import SOAP_NS, WSSE_NS, WSU_NS
+from wsse.xml import fromstring, parser_options
+
+
+# Envelope body sizes (bytes), and how many envelopes to parse at each size.
+SIZES = [(1024, 20000), (16 * 1024, 5000), (256 * 1024, 500)]
+
+ENVELOPE = """<soap:Envelope xmlns:soap="%s" xmlns:wsse="%s" xmlns:wsu="%s">
+  <soap:Header>
+    <wsse:Security mustUnderstand="true">
+      <wsu:Timestamp>
+        <wsu:Created>2015-06-25T21:53:25.246276+00:00</wsu:Created>
+        <wsu:Expires>2015-06-25T21:58:25.246276+00:00</wsu:Expires>
+      </wsu:Timestamp>
+    </wsse:Security>
+  </soap:Header>
+  <soap:Body>
+    <Foo xmlns="http://example.com">%%s</Foo>
+  </soap:Body>
+</soap:Envelope>""" % (SOAP_NS, WSSE_NS, WSU_NS)
+
+
+def envelope(size):
+    """Return an envelope whose body has ``size`` bytes of items."""
+    item = '<Item id="%d">value</Item>\n'
+    items = []
+    while sum(len(i) for i in items) < size:
+        items.append(item % len(items))
+    return (ENVELOPE % ''.join(items)).encode('utf-8')
+
+
+def default(data):
+    return etree.fromstring(data)
+
+
+def new_parser(data):
+    return etree.fromstring(data, etree.XMLParser(**parser_options()))
+
+
+def main():
+    funcs = [
+        ('default parser', default),
+        ('new parser', new_parser),
+        ('cached parser', fromstring),
+    ]
+    for size, number in SIZES:
+        data = envelope(size)
+        for name, func in funcs:
+            seconds = min(
+                timeit.repeat(lambda: func(data), number=number, repeat=3))
+            print('%6d KB  %-15s %8.2f us/envelope' % (
+                size // 1024, name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
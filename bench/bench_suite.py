@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""Benchmark suite for signing, verification, encryption and decryption.
+
+Times ``sign``, ``verify``, ``encrypt`` and ``decrypt`` (using the reusable
+``Signer``, ``Verifier``, ``Encryptor`` and ``Decryptor`` objects), and a
+``WssePlugin.sending``/``received`` round-trip (if Suds is installed), for
+each combination of body size, RSA key size and reference count.
+
+The reference count is the number of child elements in the soap:Body, each of
+which is encrypted into its own EncryptedData (with its own DataReference).
+Signing always references the soap:Body and wsu:Timestamp.
+
+Results are written as JSON (to stdout, or to the ``--output`` file), with
+one entry per measurement giving the best, median and mean seconds per call.
+Pass ``--compare`` with an earlier results file to report measurements that
+got slower by more than ``--threshold``; the exit status is 1 if any did.
+
+Run with ``python bench/bench_suite.py``, ``make bench`` or ``tox -e bench``.
+The default sizes are quick to run; use ``--full`` to also run 10MB and 100MB
+bodies with 4096-bit keys.
+
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+from lxml import etree
+from OpenSSL import crypto
+import xmlsec
+
+import wsse
+from wsse.constants import SOAP_NS, WSSE_NS, WSU_NS
+from wsse.encryption import Decryptor, Encryptor
+from wsse.signing import Signer, Verifier
+from wsse.xml import configure_parser
+
+try:
+    from wsse.suds import WssePlugin
+except ImportError:
+    WssePlugin = None
+
+
+KB = 1024
+MB = 1024 * KB
+
+QUICK = {
+    'sizes': [KB, 64 * KB, MB],
+    'key_sizes': [2048],
+    'references': [1, 8],
+}
+FULL = {
+    'sizes': [KB, 64 * KB, MB, 10 * MB, 100 * MB],
+    'key_sizes': [2048, 4096],
+    'references': [1, 8, 64],
+}
+
+# Aim for each timing run to take at least this long (seconds).
+MIN_TIME = 0.2
+REPEAT = 3
+
+ENVELOPE = """<soap:Envelope xmlns:soap="%s" xmlns:wsse="%s" xmlns:wsu="%s">
+  <soap:Header>
+    <wsse:Security mustUnderstand="true">
+      <wsu:Timestamp>
+        <wsu:Created>2015-06-25T21:53:25.246276+00:00</wsu:Created>
+        <wsu:Expires>2015-06-25T21:58:25.246276+00:00</wsu:Expires>
+      </wsu:Timestamp>
+    </wsse:Security>
+  </soap:Header>
+  <soap:Body>%%s</soap:Body>
+</soap:Envelope>""" % (SOAP_NS, WSSE_NS, WSU_NS)
+
+
+class Context(object):
+    """Stand-in for the Suds plugin context."""
+    envelope = None
+    reply = None
+
+
+def envelope(size, references):
+    """Return an envelope with ``references`` body children of ``size``."""
+    # Base64 text, as typically carried in large bodies.
+    chunk = 'QUJD' * (size // references // 4 + 1)
+    return ENVELOPE % ''.join(
+        '<Part xmlns="http://example.com">%s</Part>' % chunk
+        for i in range(references)
+    )
+
+
+def write_keys(directory, bits):
+    """Write an RSA key and self-signed cert; return their paths."""
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, bits)
+    cert = crypto.X509()
+    cert.get_subject().CN = 'example.com'
+    cert.set_serial_number(1000)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(24 * 60 * 60)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+
+    keyfile = os.path.join(directory, 'key%d.pem' % bits)
+    certfile = os.path.join(directory, 'cert%d.pem' % bits)
+    with open(keyfile, 'wb') as fh:
+        fh.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+    with open(certfile, 'wb') as fh:
+        fh.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+    return keyfile, certfile
+
+
+def operations(keyfile, certfile, env):
+    """Return list of (name, function) to time for given keys and envelope.
+
+    Our cert is also used as "their" cert, so that we can decrypt and verify
+    what we encrypt and sign.
+
+    """
+    signer = Signer.from_files(keyfile, certfile)
+    verifier = Verifier.from_file(certfile)
+    encryptor = Encryptor.from_file(certfile)
+    decryptor = Decryptor.from_file(keyfile)
+
+    signed = signer.sign(env)
+    encrypted = encryptor.encrypt(env)
+    ops = [
+        ('sign', lambda: signer.sign(env)),
+        ('verify', lambda: verifier.verify(signed)),
+        ('encrypt', lambda: encryptor.encrypt(env)),
+        ('decrypt', lambda: decryptor.decrypt(encrypted)),
+    ]
+
+    if WssePlugin is not None:
+        plugin = WssePlugin(keyfile, certfile, certfile)
+        context = Context()
+        context.envelope = env
+        plugin.sending(context)
+        reply = context.envelope
+
+        def sending():
+            context = Context()
+            context.envelope = env
+            plugin.sending(context)
+
+        def received():
+            context = Context()
+            context.reply = reply
+            plugin.received(context)
+
+        ops.extend([
+            ('plugin.sending', sending),
+            ('plugin.received', received),
+        ])
+
+    return ops
+
+
+def measure(func):
+    """Time ``func``; return (number of calls per run, seconds per call)."""
+    number = 1
+    while True:
+        seconds = timeit.timeit(func, number=number)
+        if seconds >= MIN_TIME or number >= 1000:
+            break
+        number = min(1000, number * max(2, int(MIN_TIME / seconds / 2)))
+    times = [seconds / number] + [
+        t / number for t in timeit.repeat(
+            func, number=number, repeat=REPEAT - 1)]
+    return number, sorted(times)
+
+
+def run(config, log):
+    if max(config['sizes']) > 10 * MB:
+        configure_parser(huge_tree=True)
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        for bits in config['key_sizes']:
+            keyfile, certfile = write_keys(directory, bits)
+            for size in config['sizes']:
+                for references in config['references']:
+                    env = envelope(size, references)
+                    for name, func in operations(keyfile, certfile, env):
+                        number, times = measure(func)
+                        result = {
+                            'operation': name,
+                            'size': size,
+                            'key_size': bits,
+                            'references': references,
+                            'number': number,
+                            'best': times[0],
+                            'median': times[len(times) // 2],
+                            'mean': sum(times) / len(times),
+                        }
+                        log('%-16s %9d B  RSA-%d  %3d refs  %10.3f ms' % (
+                            name, size, bits, references,
+                            result['best'] * 1000))
+                        results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return list of messages for results slower than ``baseline``."""
+    def key(result):
+        return (result['operation'], result['size'], result['key_size'],
+                result['references'])
+
+    before = dict((key(result), result) for result in baseline['results'])
+    slower = []
+    for result in results:
+        old = before.get(key(result))
+        if old is not None and result['best'] > old['best'] * threshold:
+            slower.append('%s %d B RSA-%d %d refs: %.3f ms -> %.3f ms' % (
+                key(result) + (old['best'] * 1000, result['best'] * 1000)))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--full', action='store_true',
+        help='include 10MB and 100MB bodies and 4096-bit keys')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument(
+        '--compare', help='compare with results in this JSON file')
+    parser.add_argument(
+        '--threshold', type=float, default=1.2,
+        help='ratio above which a result counts as slower (default 1.2)')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    results = run(FULL if args.full else QUICK, log)
+    output = {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'wsse': wsse.__version__,
+            'lxml': etree.__version__,
+            'xmlsec': getattr(xmlsec, '__version__', None),
+        },
+        'results': results,
+    }
+    data = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(data + '\n')
+    else:
+        print(data)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            slower = compare(results, json.load(fh), args.threshold)
+        for message in slower:
+            log('SLOWER: ' + message)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
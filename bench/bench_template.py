@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Benchmark building the ds:Signature skeleton for each signed message.
+
+Compares building the skeleton from scratch via ``xmlsec.template`` calls (as
+``sign()`` used to do for every message) with copying the templates cached on
+a ``wsse.signing.Signer``.
+
+Run with ``python bench/bench_template.py``.
+
+"""
+from __future__ import print_function
+
+import copy
+import timeit
+
+from lxml import etree
+import xmlsec
+
+from wsse.constants import DS_NS
+from wsse.signing import _signature_template
+from wsse.xml import ns
+
+
+NUMBER = 20000
+
+
+def build():
+    """Build a Signature skeleton with two references from scratch."""
+    signature = xmlsec.template.create(
+        etree.Element('Envelope'),
+        xmlsec.Transform.EXCL_C14N,
+        xmlsec.Transform.RSA_SHA1,
+    )
+    key_info = xmlsec.template.ensure_key_info(signature)
+    x509_data = xmlsec.template.add_x509_data(key_info)
+    x509_data.append(etree.Element(ns(DS_NS, 'X509IssuerSerial')))
+    x509_data.append(etree.Element(ns(DS_NS, 'X509Certificate')))
+    for uri in ['#body', '#timestamp']:
+        ref = xmlsec.template.add_reference(
+            signature, xmlsec.Transform.SHA1, uri=uri)
+        xmlsec.template.add_transform(ref, xmlsec.Transform.EXCL_C14N)
+    return signature
+
+
+def stamp(template=_signature_template(
+        2, xmlsec.Transform.RSA_SHA1, xmlsec.Transform.SHA1)):
+    """Copy a Signature skeleton with two references from cached template."""
+    signature = copy.deepcopy(template)
+    refs = signature.iterfind(
+        '%s/%s' % (ns(DS_NS, 'SignedInfo'), ns(DS_NS, 'Reference')))
+    for ref, uri in zip(refs, ['#body', '#timestamp']):
+        ref.set('URI', uri)
+    return signature
+
+
+def main():
+    for name, func in [('build', build), ('copy template', stamp)]:
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+        print('%-15s %8.2f us/message' % (name, seconds / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
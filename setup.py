@@ -23,9 +23,11 @@ setup(
     url='https://github.com/orcasgit/py-wsse/',
     packages=find_packages(),
     install_requires=[
-        'xmlsec>=0.6.0,<1',
+        'xmlsec>=1.3.7,<2',
         'pyOpenSSL>=0.15.1',
+        'cryptography>=1.0',
         'lxml>=3.4.4',
+        'futures>=3.0.3; python_version < "3.2"',
     ],
     extras_require={'suds': ['suds-jurko>=0.6']},
     classifiers=[
@@ -1,3 +1,5 @@
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
 from OpenSSL import crypto
 import pytest
 
@@ -56,6 +58,37 @@ def key_path(tmpdir, key):
 @pytest.fixture
 def cert_path(tmpdir, key):
     """Create X.509 cert with ``key``, write to PEM, return path."""
+    return write_cert(str(tmpdir / 'cert.pem'), key)
+
+
+@pytest.fixture
+def ec_key():
+    """Create and return EC (P-256) private key object."""
+    return crypto.PKey.from_cryptography_key(
+        ec.generate_private_key(ec.SECP256R1(), default_backend()))
+
+
+@pytest.fixture
+def ec_key_path(tmpdir, ec_key):
+    """Write EC private key to PEM file and return path."""
+    key_path = str(tmpdir / 'ec_key.pem')
+    with open(key_path, 'wb') as fh:
+        fh.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, ec_key))
+    return key_path
+
+
+@pytest.fixture
+def ec_cert_path(tmpdir, ec_key):
+    """Create X.509 cert with ``ec_key``, write to PEM, return path."""
+    return write_cert(str(tmpdir / 'ec_cert.pem'), ec_key)
+
+
+def write_cert(cert_path, key):
+    """Create X.509 cert with ``key``, write to PEM at ``cert_path``.
+
+    Return ``cert_path``.
+
+    """
     cert = crypto.X509()
     cert.get_subject().C = "US"
     cert.get_subject().ST = "Washington"
@@ -70,9 +103,16 @@ def cert_path(tmpdir, key):
     cert.set_pubkey(key)
     cert.sign(key, 'sha1')
 
-    cert_path = str(tmpdir / 'cert.pem')
-
     with open(cert_path, 'wb') as fh:
         fh.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
 
     return cert_path
+
+
+class Clock(object):
+    """Settable stand-in for ``time.time``."""
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,96 @@
+import os
+
+from OpenSSL import crypto
+import pytest
+import xmlsec
+
+# Not available before Python 3.4.
+asyncio = pytest.importorskip('asyncio')
+
+from wsse import encryption, signing  # noqa
+from wsse.aio import WsseExecutor  # noqa
+from wsse.exceptions import SignatureVerificationFailed  # noqa
+
+from .conftest import write_cert  # noqa
+
+
+@pytest.fixture
+def loop(request):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    def close():
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    request.addfinalizer(close)
+    return loop
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_protect_and_unprotect(loop, envelope, key_path, cert_path,
+                               processes):
+    executor = WsseExecutor(
+        key_path, cert_path, cert_path, workers=2, processes=processes)
+    envelopes = [envelope.replace('Text', 'Text %s' % i) for i in range(4)]
+
+    protected = loop.run_until_complete(
+        asyncio.gather(*[executor.protect(e) for e in envelopes]))
+    unprotected = loop.run_until_complete(
+        asyncio.gather(*[executor.unprotect(e) for e in protected]))
+    executor.shutdown()
+
+    for i, reply in enumerate(unprotected):
+        assert ('>Text %s<' % i).encode('utf-8') in reply
+
+
+def test_methods(loop, envelope, key_path, cert_path):
+    executor = WsseExecutor(
+        key_path, cert_path, cert_path, workers=1, processes=True,
+        signature_method=xmlsec.Transform.RSA_SHA256,
+        data_method=xmlsec.Transform.AES128,
+    )
+    protected = loop.run_until_complete(executor.protect(envelope))
+    reply = loop.run_until_complete(executor.unprotect(protected))
+    executor.shutdown()
+
+    assert xmlsec.Transform.AES128.href.encode('utf-8') in protected
+    assert xmlsec.Transform.RSA_SHA256.href.encode('utf-8') in reply
+    assert b'>Text<' in reply
+
+
+def test_verify_failure(loop, envelope, key_path, cert_path):
+    executor = WsseExecutor(key_path, cert_path, cert_path, workers=1)
+    signed = loop.run_until_complete(executor.sign(envelope))
+
+    with pytest.raises(SignatureVerificationFailed):
+        loop.run_until_complete(
+            executor.verify(signed.replace(b'>Text<', b'>Evil<')))
+    executor.shutdown()
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_key_rotation(loop, envelope, tmpdir, key_path, cert_path, processes):
+    executor = WsseExecutor(
+        key_path, cert_path, cert_path, workers=1, processes=processes)
+    protected = loop.run_until_complete(executor.protect(envelope))
+    loop.run_until_complete(executor.unprotect(protected))
+
+    # Rotate the key and cert (here, ours and theirs are the same).
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 1024)
+    with open(str(tmpdir / 'new_key.pem'), 'wb') as fh:
+        fh.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+    os.rename(str(tmpdir / 'new_key.pem'), key_path)
+    os.rename(write_cert(str(tmpdir / 'new_cert.pem'), key), cert_path)
+
+    # The long-lived executor signs and encrypts with the new ones...
+    protected = loop.run_until_complete(executor.protect(envelope))
+    signing.verify(encryption.decrypt(protected, key_path), cert_path)
+    # ...and decrypts and verifies with them.
+    protected = encryption.encrypt(
+        signing.sign(envelope, key_path, cert_path), cert_path)
+    reply = loop.run_until_complete(executor.unprotect(protected))
+    executor.shutdown()
+
+    assert b'>Text<' in reply
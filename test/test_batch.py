@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import os
+
+from lxml import etree
+from OpenSSL import crypto
+import pytest
+import xmlsec
+
+from wsse import batch, encryption, signing
+from wsse.exceptions import SignatureVerificationFailed
+
+from .conftest import write_cert
+
+
+@pytest.fixture
+def envelopes(envelope):
+    """A list of distinguishable envelopes."""
+    return [envelope.replace('Text', 'Text %s' % i) for i in range(10)]
+
+
+def body_text(envelope):
+    return etree.fromstring(envelope).find('.//{http://example.com}Foo').text
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_sign_many(envelopes, key_path, cert_path, processes):
+    signed = list(batch.sign_many(
+        iter(envelopes), key_path, cert_path, workers=2, processes=processes))
+
+    assert [body_text(s) for s in signed] == [
+        'Text %s' % i for i in range(10)]
+    for s in signed:
+        signing.verify(s, cert_path)
+
+
+def test_encrypt_many(envelopes, key_path, cert_path):
+    encrypted = list(
+        batch.encrypt_many(envelopes, cert_path, workers=3, window=2))
+
+    assert [body_text(encryption.decrypt(e, key_path)) for e in encrypted] == [
+        'Text %s' % i for i in range(10)]
+
+
+def test_protect_many(envelopes, key_path, cert_path):
+    decryptor = encryption.Decryptor.from_file(key_path)
+    verifier = signing.Verifier.from_file(cert_path)
+
+    for i, protected in enumerate(batch.protect_many(
+            envelopes, key_path, cert_path, cert_path)):
+        decrypted = decryptor.decrypt(protected)
+        verifier.verify(decrypted)
+        assert body_text(decrypted) == 'Text %s' % i
+
+
+def algorithms(envelope):
+    """Return Algorithm URIs of all methods used in given envelope."""
+    return set(etree.fromstring(envelope).xpath(
+        '//*[substring(local-name(), string-length(local-name()) - 5)'
+        ' = "Method"]/@Algorithm'))
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_protect_many_methods(envelopes, key_path, cert_path, processes):
+    protected = list(batch.protect_many(
+        envelopes[:2], key_path, cert_path, cert_path,
+        signature_method=xmlsec.Transform.RSA_SHA256,
+        digest_method=xmlsec.Transform.SHA256,
+        data_method=xmlsec.Transform.AES128,
+        key_transport=xmlsec.Transform.RSA_PKCS1,
+        workers=2, processes=processes,
+    ))
+
+    for p in protected:
+        assert algorithms(p) >= set([
+            xmlsec.Transform.AES128.href, xmlsec.Transform.RSA_PKCS1.href])
+        decrypted = encryption.decrypt(p, key_path)
+        assert algorithms(decrypted) >= set([
+            xmlsec.Transform.RSA_SHA256.href, xmlsec.Transform.SHA256.href])
+        signing.verify(decrypted, cert_path)
+
+
+def test_methods_cached_separately(envelope, key_path, cert_path):
+    signed = [
+        list(batch.sign_many(
+            [envelope], key_path, cert_path, workers=1, **kwargs))[0]
+        for kwargs in [{}, {'digest_method': xmlsec.Transform.SHA256}]
+    ]
+    encrypted = [
+        list(batch.encrypt_many(
+            [envelope], cert_path, workers=1, **kwargs))[0]
+        for kwargs in [{}, {'data_method': xmlsec.Transform.AES256}]
+    ]
+
+    assert xmlsec.Transform.SHA1.href in algorithms(signed[0])
+    assert xmlsec.Transform.SHA256.href in algorithms(signed[1])
+    assert xmlsec.Transform.DES3.href in algorithms(encrypted[0])
+    assert xmlsec.Transform.AES256.href in algorithms(encrypted[1])
+
+
+def test_cache_reloads_and_is_bounded(envelope, tmpdir, key_path, cert_path,
+                                      monkeypatch):
+    monkeypatch.setattr(batch, 'CACHE_SIZE', 2)
+    monkeypatch.setattr(batch, '_cache', OrderedDict())
+    signed = batch._sign(key_path, cert_path, (), envelope)
+    batch._verify(cert_path, signed)
+
+    # Replace the cert with one for a different key: reloaded.
+    other_key = crypto.PKey()
+    other_key.generate_key(crypto.TYPE_RSA, 1024)
+    os.rename(write_cert(str(tmpdir / 'new.pem'), other_key), cert_path)
+    with pytest.raises(SignatureVerificationFailed):
+        batch._verify(cert_path, signed)
+
+    batch._encrypt(cert_path, (), envelope)
+    assert len(batch._cache) == 2
@@ -0,0 +1,336 @@
+from collections import OrderedDict
+import os
+
+from lxml import etree
+import pytest
+import xmlsec
+
+from wsse.constants import ENC_NS, SOAP_NS, WSSE_NS
+from wsse import encryption, signing
+from wsse.tracing import Tracer
+from wsse.xml import ID_ATTR
+
+from .conftest import write_cert
+
+
+namespaces = {
+    'soap': SOAP_NS,
+    'wsse': WSSE_NS,
+    'xenc': ENC_NS,
+}
+
+
+def xp(node, xpath):
+    """Utility to do xpath search with namespaces."""
+    return node.xpath(xpath, namespaces=namespaces)
+
+
+def test_encrypt_and_decrypt(envelope, cert_path, key_path):
+    encrypted = encryption.encrypt(envelope, cert_path)
+    doc = etree.fromstring(encrypted)
+
+    assert xp(doc, '/soap:Envelope/soap:Body/xenc:EncryptedData')
+    assert b'Text' not in encrypted
+
+    decrypted = encryption.decrypt(encrypted, key_path)
+    doc = etree.fromstring(decrypted)
+
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+
+
+def multi_envelope(envelope):
+    """Add a second Body child and a header element to given envelope."""
+    return envelope.replace(
+        '</soap:Body>',
+        '<Bar xmlns="http://example.com">More</Bar></soap:Body>',
+    ).replace(
+        '</soap:Header>',
+        '<Baz xmlns="http://example.com">Secret</Baz></soap:Header>',
+    )
+
+
+def test_encrypt_all_body_children(envelope, cert_path, key_path):
+    encrypted = encryption.encrypt(multi_envelope(envelope), cert_path)
+    doc = etree.fromstring(encrypted)
+
+    blocks = xp(doc, '/soap:Envelope/soap:Body/xenc:EncryptedData')
+    assert len(blocks) == 2
+    assert b'Text' not in encrypted
+    assert b'More' not in encrypted
+    # One EncryptedKey, referencing both blocks.
+    enc_keys = xp(doc, '//xenc:EncryptedKey')
+    assert len(enc_keys) == 1
+    uris = xp(enc_keys[0], 'xenc:ReferenceList/xenc:DataReference/@URI')
+    assert uris == ['#' + block.get(ID_ATTR) for block in blocks]
+
+    doc = etree.fromstring(encryption.decrypt(encrypted, key_path))
+
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+    assert doc.find('.//{http://example.com}Bar').text == 'More'
+
+
+def test_encrypt_targets(envelope, cert_path, key_path):
+    encrypted = encryption.encrypt(
+        multi_envelope(envelope),
+        cert_path,
+        targets=['/soap:Envelope/soap:Header/*[local-name()="Baz"]',
+                 '/soap:Envelope/soap:Body/*[1]'],
+    )
+    doc = etree.fromstring(encrypted)
+
+    assert b'Secret' not in encrypted
+    assert b'Text' not in encrypted
+    assert b'More' in encrypted
+    assert len(xp(doc, '//xenc:EncryptedData')) == 2
+    assert len(xp(doc, '//xenc:DataReference')) == 2
+
+    doc = etree.fromstring(encryption.decrypt(encrypted, key_path))
+
+    assert doc.find('.//{http://example.com}Baz').text == 'Secret'
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+
+
+def test_encrypt_tree_element_targets(envelope, cert_path, key_path):
+    doc = etree.fromstring(multi_envelope(envelope))
+    target = doc.find('.//{http://example.com}Bar')
+    encryption.encrypt_tree(doc, cert_path, targets=[target])
+
+    assert doc.find('.//{http://example.com}Bar') is None
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+
+    encryption.decrypt_tree(doc, key_path)
+
+    assert doc.find('.//{http://example.com}Bar').text == 'More'
+
+
+def test_decrypt_duplicate_unreferenced_id(envelope, cert_path, key_path):
+    # Payload elements may share an Id, as long as nothing references it.
+    envelope = envelope.replace(
+        'Text</Foo>', 'Text</Foo><Line Id="1"/><Line Id="1"/>')
+    encrypted = encryption.encrypt(
+        envelope, cert_path, targets=['//*[local-name()="Foo"]'])
+
+    decrypted = encryption.decrypt(encrypted, key_path)
+    assert b'>Text<' in decrypted
+    assert decrypted.count(b'<Line Id="1"/>') == 2
+
+
+@pytest.mark.parametrize('targets', [
+    ['//soap:Nothing'],
+    ['//soap:Body', '//soap:Body/*'],
+    ['//soap:Body/text()'],
+])
+def test_encrypt_bad_targets(envelope, cert_path, targets):
+    with pytest.raises(ValueError):
+        encryption.encrypt(envelope, cert_path, targets=targets)
+
+
+def test_encrypt_empty_body(envelope, cert_path):
+    envelope = envelope.replace(
+        '<Foo xmlns="http://example.com">Text</Foo>', 'Text')
+
+    with pytest.raises(ValueError):
+        encryption.encrypt(envelope, cert_path)
+
+
+def test_encrypt_duplicate_targets(envelope, cert_path, key_path):
+    encrypted = encryption.encrypt(
+        envelope, cert_path, targets=['//soap:Body/*', '//soap:Body/*'])
+
+    assert encrypted.count(b'<xenc:EncryptedData') == 1
+    assert b'>Text<' in encryption.decrypt(encrypted, key_path)
+
+
+def test_encrypt_body_with_comment(envelope, cert_path, key_path):
+    envelope = envelope.replace(
+        '<Foo xmlns', '<!-- comment --><Foo xmlns')
+
+    encrypted = encryption.encrypt(envelope, cert_path)
+
+    assert b'>Text<' not in encrypted
+    assert b'>Text<' in encryption.decrypt(encrypted, key_path)
+
+
+def test_decrypt_unwraps_each_key_once(envelope, cert_path, key_path,
+                                       monkeypatch):
+    # Two EncryptedKeys: one for the Body children, one for the header.
+    doc = etree.fromstring(multi_envelope(envelope))
+    encryptor = encryption.Encryptor.from_file(cert_path)
+    encryptor.encrypt_tree(doc)
+    encryptor.encrypt_tree(
+        doc, targets=['/soap:Envelope/soap:Header/*[local-name()="Baz"]'])
+    assert len(xp(doc, '//xenc:EncryptedKey')) == 2
+
+    timings = []
+    decryptor = encryption.Decryptor.from_file(
+        key_path,
+        tracer=Tracer(
+            on_element=lambda name, id, seconds: timings.append(
+                (name, id, seconds))),
+    )
+    unwrap = decryptor._unwrap
+    unwrapped = []
+
+    def counting_unwrap(enc_key):
+        unwrapped.append(enc_key)
+        return unwrap(enc_key)
+
+    monkeypatch.setattr(decryptor, '_unwrap', counting_unwrap)
+    decryptor.decrypt_tree(doc)
+
+    assert len(unwrapped) == 2
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+    assert doc.find('.//{http://example.com}Bar').text == 'More'
+    assert doc.find('.//{http://example.com}Baz').text == 'Secret'
+    assert [name for name, _, _ in timings] == [
+        'decrypt.unwrap', 'decrypt.data',
+        'decrypt.unwrap', 'decrypt.data', 'decrypt.data']
+    # Each block is reported with the ID it's referenced by.
+    assert all(id for name, id, _ in timings if name == 'decrypt.data')
+    assert all(seconds >= 0 for _, _, seconds in timings)
+
+
+@pytest.mark.parametrize('data_method,key_transport', [
+    (xmlsec.Transform.AES128, xmlsec.Transform.RSA_OAEP),
+    (xmlsec.Transform.AES256, xmlsec.Transform.RSA_PKCS1),
+] + [
+    (getattr(xmlsec.Transform, name), xmlsec.Transform.RSA_OAEP)
+    for name in ('AES128_GCM', 'AES256_GCM')
+    if hasattr(xmlsec.Transform, name)
+])
+def test_encrypt_and_decrypt_algorithms(envelope, cert_path, key_path,
+                                        data_method, key_transport):
+    encrypted = encryption.encrypt(
+        envelope,
+        cert_path,
+        data_method=data_method,
+        key_transport=key_transport,
+    )
+    doc = etree.fromstring(encrypted)
+
+    method = 'xenc:EncryptionMethod/@Algorithm'
+    assert xp(doc, '//xenc:EncryptedData/' + method) == [data_method.href]
+    assert xp(doc, '//xenc:EncryptedKey/' + method) == [key_transport.href]
+
+    decrypted = encryption.decrypt(encrypted, key_path)
+    doc = etree.fromstring(decrypted)
+
+    assert doc.find('.//{http://example.com}Foo').text == 'Text'
+
+
+def test_unsupported_data_method(cert_path):
+    with pytest.raises(ValueError):
+        encryption.Encryptor.from_file(
+            cert_path, data_method=xmlsec.Transform.RSA_OAEP)
+
+
+def test_reuse_objects(envelope, cert_path, key_path):
+    with open(key_path, 'rb') as fh:
+        key_data = fh.read()
+    signer = signing.Signer.from_files(key_path, cert_path)
+    verifier = signing.Verifier.from_file(cert_path)
+    encryptor = encryption.Encryptor.from_file(cert_path)
+    decryptor = encryption.Decryptor.from_memory(key_data)
+
+    for i in range(2):
+        encrypted = encryptor.encrypt(signer.sign(envelope))
+        verifier.verify(decryptor.decrypt(encrypted))
+
+
+def cipher_value(encrypted):
+    doc = etree.fromstring(encrypted)
+    return xp(doc, '//xenc:EncryptedKey//xenc:CipherValue')[0].text
+
+
+def test_key_reuse_count(envelope, cert_path, key_path):
+    encryptor = encryption.Encryptor.from_file(cert_path, key_reuse_count=2)
+    decryptor = encryption.Decryptor.from_file(key_path, key_cache_size=10)
+
+    encrypted = [encryptor.encrypt(envelope) for i in range(3)]
+
+    assert cipher_value(encrypted[0]) == cipher_value(encrypted[1])
+    assert cipher_value(encrypted[1]) != cipher_value(encrypted[2])
+    for e in encrypted:
+        decrypted = decryptor.decrypt(e)
+        assert b'>Text<' in decrypted
+    assert len(decryptor.key_cache) == 2
+
+
+@pytest.mark.parametrize('count', [0, -1])
+def test_key_reuse_count_invalid(cert_path, count):
+    with pytest.raises(ValueError):
+        encryption.Encryptor.from_file(cert_path, key_reuse_count=count)
+
+
+def test_key_reuse_seconds(envelope, cert_path, key_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(encryption.time, 'time', lambda: now[0])
+    encryptor = encryption.Encryptor.from_file(
+        cert_path, key_reuse_seconds=60)
+
+    first = encryptor.encrypt(envelope)
+    now[0] += 59
+    second = encryptor.encrypt(envelope)
+    now[0] += 1
+    third = encryptor.encrypt(envelope)
+
+    assert cipher_value(first) == cipher_value(second)
+    assert cipher_value(second) != cipher_value(third)
+
+
+def test_key_cache_size(envelope, cert_path, key_path):
+    encryptor = encryption.Encryptor.from_file(cert_path)
+    decryptor = encryption.Decryptor.from_file(key_path, key_cache_size=1)
+
+    for i in range(3):
+        decryptor.decrypt(encryptor.encrypt(envelope))
+
+    assert len(decryptor.key_cache) == 1
+
+
+def test_create_binary_security_token_cached(tmpdir, ec_key, cert_path):
+    first = encryption.create_binary_security_token(cert_path)
+    second = encryption.create_binary_security_token(cert_path)
+
+    assert first is not second
+    assert first.text == second.text
+
+    # Replace the cert file with a different cert.
+    os.rename(write_cert(str(tmpdir / 'new.pem'), ec_key), cert_path)
+    third = encryption.create_binary_security_token(cert_path)
+
+    assert third.text != first.text
+
+
+def test_encrypt_loads_cert_once(envelope, cert_path, key, tmpdir,
+                                 monkeypatch):
+    monkeypatch.setattr(encryption, 'ENCRYPTOR_CACHE_SIZE', 2)
+    monkeypatch.setattr(encryption, '_encryptors', OrderedDict())
+    loads = []
+    tracer = Tracer(on_duration=lambda name, seconds: loads.append(name)
+                    if name == 'encrypt.load_key' else None)
+
+    for i in range(2):
+        encryption.encrypt(envelope, cert_path, tracer=tracer)
+    assert len(loads) == 1
+
+    # Other tracers share the cached encryptor, but still get the timings.
+    durations = []
+    for i in range(2):
+        encryption.encrypt(envelope, cert_path, tracer=Tracer(
+            on_duration=lambda name, seconds: durations.append(name)))
+    encryption.encrypt(envelope, cert_path)
+    assert len(loads) == 1
+    assert len(encryption._encryptors) == 1
+    assert durations.count('encrypt.data') == 2
+
+    # Reloaded when the file changes.
+    os.rename(write_cert(str(tmpdir / 'new.pem'), key), cert_path)
+    encryption.encrypt(envelope, cert_path, tracer=tracer)
+    assert len(loads) == 2
+
+    # The cache is bounded.
+    for data_method in (xmlsec.Transform.AES128, xmlsec.Transform.AES256):
+        encryption.encrypt(
+            envelope, cert_path, data_method=data_method, tracer=tracer)
+    assert len(encryption._encryptors) == 2
@@ -0,0 +1,157 @@
+from lxml import etree
+import pytest
+
+from wsse import signing
+from wsse.exceptions import (
+    ExpiredTimestamp,
+    FutureTimestamp,
+    InvalidTimestamp,
+    ReplayedMessage,
+    SignatureVerificationFailed,
+)
+from wsse.freshness import FreshnessPolicy, ReplayCache, parse_datetime
+
+from .conftest import Clock
+
+
+# Created and Expires times of the ``envelope`` fixture's wsu:Timestamp.
+CREATED = parse_datetime('2015-06-25T21:53:25.246276+00:00')
+EXPIRES = parse_datetime('2015-06-25T21:58:25.246276+00:00')
+
+
+def test_parse_datetime():
+    assert parse_datetime('2015-06-25T21:53:25Z') == 1435269205
+    assert parse_datetime('2015-06-25T21:53:25') == 1435269205
+    assert parse_datetime('2015-06-25T23:53:25+02:00') == 1435269205
+    assert parse_datetime('2015-06-25T20:53:25.5-01:00') == 1435269205.5
+
+    for value in ['2015-06-25', '2015-13-25T21:53:25Z', 'yesterday']:
+        with pytest.raises(ValueError):
+            parse_datetime(value)
+
+
+def test_verify_fresh(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+    policy = FreshnessPolicy(clock=Clock(CREATED + 60))
+
+    # no exception raised
+    signing.verify(signed, cert_path, freshness=policy)
+
+
+@pytest.mark.parametrize('now,exception', [
+    (EXPIRES + 301, ExpiredTimestamp),
+    (CREATED - 301, FutureTimestamp),
+])
+def test_verify_stale(envelope, cert_path, key_path, now, exception):
+    signed = signing.sign(envelope, key_path, cert_path)
+    policy = FreshnessPolicy(clock=Clock(now))
+
+    with pytest.raises(exception):
+        signing.verify(signed, cert_path, freshness=policy)
+    assert issubclass(exception, SignatureVerificationFailed)
+
+
+def test_verify_max_age(envelope, cert_path, key_path):
+    policy = FreshnessPolicy(max_age=10, max_skew=0, clock=Clock(CREATED + 11))
+    doc = etree.fromstring(envelope)
+    doc.find('.//{*}Expires').getparent().remove(doc.find('.//{*}Expires'))
+
+    with pytest.raises(ExpiredTimestamp):
+        policy.check(doc)
+
+    policy.require_expires = True
+    with pytest.raises(InvalidTimestamp):
+        policy.check(doc)
+
+
+@pytest.mark.parametrize('edit', [
+    lambda ts: ts.getparent().remove(ts),
+    lambda ts: setattr(ts[0], 'text', 'yesterday'),
+])
+def test_invalid_timestamp(envelope, edit):
+    policy = FreshnessPolicy(clock=Clock(CREATED))
+    doc = etree.fromstring(envelope)
+    edit(doc.find('.//{*}Timestamp'))
+
+    with pytest.raises(InvalidTimestamp):
+        policy.check(doc)
+    assert policy.counts['invalid'] == 1
+
+
+@pytest.mark.parametrize('position', [0, -1])
+def test_injected_timestamp(envelope, cert_path, key_path, position):
+    signed = etree.fromstring(signing.sign(envelope, key_path, cert_path))
+    # A stale message, with a fresh (unsigned) wsu:Timestamp added.
+    policy = FreshnessPolicy(clock=Clock(EXPIRES + 7200))
+    timestamp = signed.find('.//{*}Timestamp')
+    fresh = etree.fromstring(etree.tostring(timestamp))
+    del fresh.attrib[fresh.keys()[0]]
+    fresh[0].text = fresh[1].text = '2015-06-25T23:58:25Z'
+    security = timestamp.getparent()
+    security.insert(position % (len(security) + 1), fresh)
+
+    with pytest.raises(InvalidTimestamp):
+        signing.verify(etree.tostring(signed), cert_path, freshness=policy)
+
+
+def test_unsigned_timestamp(envelope):
+    policy = FreshnessPolicy(clock=Clock(CREATED))
+    doc = etree.fromstring(envelope)
+
+    with pytest.raises(InvalidTimestamp):
+        policy.check(doc, signed=[doc[1]])
+    token = policy.check(doc)
+    with pytest.raises(InvalidTimestamp):
+        policy.accept(token, signed=[doc[1]])
+    policy.accept(token, signed=[doc.find('.//{*}Timestamp')])
+
+
+def test_verify_replayed(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+    clock = Clock(CREATED)
+    policy = FreshnessPolicy(
+        replay_cache=ReplayCache(clock=clock), clock=clock)
+
+    signing.verify(signed, cert_path, freshness=policy)
+    with pytest.raises(ReplayedMessage):
+        signing.verify(signed, cert_path, freshness=policy)
+
+    # Once the message would have expired anyway, it's forgotten.
+    clock.now = EXPIRES + 301
+    with pytest.raises(ExpiredTimestamp):
+        signing.verify(signed, cert_path, freshness=policy)
+    assert policy.counts == {
+        'checked': 3, 'invalid': 0, 'expired': 1, 'future': 0, 'replayed': 1}
+
+
+def test_verify_failed_not_remembered(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+    tampered = signed.replace(b'Text', b'Txet')
+    clock = Clock(CREATED)
+    policy = FreshnessPolicy(
+        replay_cache=ReplayCache(clock=clock), clock=clock)
+
+    with pytest.raises(SignatureVerificationFailed):
+        signing.verify(tampered, cert_path, freshness=policy)
+    # The forged copy didn't get the genuine message marked as seen.
+    signing.verify(signed, cert_path, freshness=policy)
+    with pytest.raises(ReplayedMessage):
+        signing.verify(signed, cert_path, freshness=policy)
+
+
+def test_replay_cache():
+    clock = Clock(100)
+    cache = ReplayCache(max_size=2, clock=clock)
+
+    assert cache.add('a', 110)
+    assert not cache.add('a', 120)
+    assert cache.add('b', 120)
+    assert cache.add('c', 130)
+    # Oldest entry discarded to make room.
+    assert 'a' not in cache
+    assert len(cache) == 2
+
+    clock.now = 125
+    assert 'b' not in cache
+    assert cache.add('b', 140)
+    assert len(cache) == 2
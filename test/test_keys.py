@@ -0,0 +1,221 @@
+import os
+import shutil
+
+from lxml import etree
+from OpenSSL import crypto
+import pytest
+import xmlsec
+
+from wsse.exceptions import SignatureVerificationFailed
+from wsse.keys import CertCache, KeySource, Reloader, to_pem
+from wsse import encryption, signing
+from wsse.zeep import ZeepWsse
+
+from .conftest import Clock, write_cert
+
+
+def read(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+def new_key_files(directory, name):
+    """Write a new private key and cert; return their paths."""
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 1024)
+    key_path = os.path.join(directory, name + '_key.pem')
+    with open(key_path, 'wb') as fh:
+        fh.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+    return key_path, write_cert(
+        os.path.join(directory, name + '_cert.pem'), key)
+
+
+def test_to_pem(cert_path, key_path):
+    cert = crypto.load_certificate(crypto.FILETYPE_PEM, read(cert_path))
+    key = crypto.load_privatekey(crypto.FILETYPE_PEM, read(key_path))
+
+    assert to_pem(read(cert_path)) == read(cert_path)
+    assert to_pem(
+        crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
+    ) == read(cert_path)
+    assert to_pem(
+        crypto.dump_privatekey(crypto.FILETYPE_ASN1, key)
+    ) == crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+
+def test_from_memory(envelope, cert_path, key_path):
+    signer = Reloader(
+        signing.Signer.from_memory,
+        KeySource.from_memory(read(key_path)),
+        KeySource.from_memory(read(cert_path)),
+    )
+
+    signing.verify(signer.get().sign(envelope), cert_path)
+    assert signer.get() is signer.get()
+
+
+def test_callable_polled(cert_path):
+    loads = []
+    created = []
+
+    def load():
+        loads.append(1)
+        return read(cert_path)
+
+    clock = Clock()
+    source = KeySource(load, poll_seconds=10, clock=clock)
+    reloader = Reloader(lambda data: created.append(data) or data, source)
+
+    clock.now = 5
+    reloader.get()
+    assert (len(loads), len(created)) == (1, 1)
+
+    # Polled again, but the data (fingerprint) hasn't changed.
+    clock.now = 10
+    reloader.get()
+    assert (len(loads), len(created)) == (2, 1)
+
+
+def test_file_rotation(envelope, tmpdir):
+    directory = str(tmpdir)
+    key_path, cert_path = new_key_files(directory, 'old')
+    new_key_path, new_cert_path = new_key_files(directory, 'new')
+    clock = Clock()
+    signer = Reloader(
+        signing.Signer.from_memory,
+        KeySource.from_file(key_path, poll_seconds=1, clock=clock),
+        KeySource.from_file(cert_path, poll_seconds=1, clock=clock),
+    )
+    old = signer.get()
+
+    shutil.copy(new_key_path, key_path)
+    shutil.copy(new_cert_path, cert_path)
+    # Make sure the modification times change, however coarse they are.
+    os.utime(key_path, (1, 1))
+    os.utime(cert_path, (1, 1))
+    # Not yet due to poll.
+    assert signer.get() is old
+
+    clock.now = 1
+    signed = signer.get().sign(envelope)
+    signing.verify(signed, new_cert_path)
+    with pytest.raises(SignatureVerificationFailed):
+        signing.verify(old.sign(envelope), new_cert_path)
+
+
+def test_shared_source(cert_path, key_path):
+    data = [read(cert_path)]
+    clock = Clock()
+    source = KeySource(lambda: data[0], poll_seconds=10, clock=clock)
+    first = Reloader(lambda data: data, source)
+    second = Reloader(lambda data: data, source)
+
+    data[0] = read(key_path)
+    clock.now = 10
+    assert first.get() == to_pem(read(key_path))
+    # The source isn't due to be polled again, but has changed.
+    assert second.get() == to_pem(read(key_path))
+
+
+def test_failed_reload(envelope, cert_path, key_path):
+    data = [read(cert_path)]
+    clock = Clock()
+    verifier = Reloader(
+        signing.Verifier.from_memory,
+        KeySource(lambda: data[0], poll_seconds=1, clock=clock),
+    )
+    old = verifier.get()
+
+    data[0] = b'-----BEGIN CERTIFICATE-----\ngarbage'
+    clock.now = 1
+    assert verifier.get() is old
+    assert verifier.error is not None
+
+    # Fixed again (as it was, so the current verifier is still good).
+    data[0] = read(cert_path)
+    clock.now = 2
+    assert verifier.get() is old
+    assert verifier.error is None
+
+
+def test_plugin_with_sources(envelope, cert_path, key_path):
+    wsse = ZeepWsse(
+        keyfile=KeySource.from_memory(read(key_path)),
+        certfile=KeySource.from_file(cert_path),
+        their_certfile=cert_path,
+    )
+    doc, _ = wsse.apply(etree.fromstring(envelope), {})
+    wsse.verify(etree.fromstring(etree.tostring(doc)))
+
+
+def test_cert_cache(envelope, cert_path, key_path, tmpdir):
+    clock = Clock()
+    cache = CertCache(max_size=2, ttl=10, clock=clock)
+    other_cert_path = new_key_files(str(tmpdir), 'other')[1]
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    signing.verify(signed, cert_path, cert_cache=cache)
+    signing.verify(signed, cert_path, cert_cache=cache)
+    assert cache.counts == {
+        'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0}
+    cache.clear()
+    assert cache.verifier(cert_path) is cache.verifier(cert_path)
+
+    # Different options, so a different verifier.
+    verifier = cache.verifier(
+        cert_path, signature_methods=[xmlsec.Transform.RSA_SHA1])
+    assert verifier is not cache.verifier(cert_path)
+    assert len(cache) == 2
+
+    # Least recently used (the one with options) evicted to make room.
+    cache.encryptor(other_cert_path)
+    assert cache.counts['evictions'] == 1
+    assert cache.verifier(
+        cert_path, signature_methods=[xmlsec.Transform.RSA_SHA1]
+    ) is not verifier
+
+    clock.now = 10
+    cache.encryptor(other_cert_path)
+    assert cache.counts['expirations'] == 1
+
+
+def test_cert_cache_sources(envelope, cert_path):
+    cache = CertCache()
+    # Same data (PEM or DER) gives the same cached encryptor.
+    pem = KeySource.from_memory(read(cert_path))
+    der = KeySource.from_memory(crypto.dump_certificate(
+        crypto.FILETYPE_ASN1,
+        crypto.load_certificate(crypto.FILETYPE_PEM, read(cert_path))))
+
+    encryptor = cache.encryptor(pem)
+    assert cache.encryptor(KeySource.from_memory(read(cert_path))) is (
+        encryptor)
+    assert cache.encryptor(der) is not encryptor
+    assert encryption.encrypt(envelope, pem, cert_cache=cache)
+
+
+def test_cert_cache_file_changed(cert_path, tmpdir):
+    cache = CertCache()
+    verifier = cache.verifier(cert_path)
+    shutil.copy(new_key_files(str(tmpdir), 'new')[1], cert_path)
+    os.utime(cert_path, (1, 1))
+
+    assert cache.verifier(cert_path) is not verifier
+    assert cache.counts['expirations'] == 1
+
+
+def test_plugin_with_cert_cache(envelope, cert_path, key_path):
+    cache = CertCache()
+    for i in range(2):
+        wsse = ZeepWsse(
+            keyfile=key_path,
+            certfile=cert_path,
+            their_certfile=cert_path,
+            cert_cache=cache,
+        )
+        doc, _ = wsse.apply(etree.fromstring(envelope), {})
+        wsse.verify(etree.fromstring(etree.tostring(doc)))
+
+    # One encryptor and one verifier, shared by both.
+    assert len(cache) == 2
+    assert cache.counts['misses'] == 2
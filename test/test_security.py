@@ -0,0 +1,71 @@
+from lxml import etree
+import pytest
+
+from wsse.constants import SOAP_NS, WSSE_NS, WSU_NS
+from wsse.exceptions import MissingElement
+from wsse.freshness import FreshnessPolicy, parse_datetime
+from wsse import signing
+from wsse.security import SecurityHeader, add_security_header, format_datetime
+
+
+namespaces = {
+    'soap': SOAP_NS,
+    'wsse': WSSE_NS,
+    'wsu': WSU_NS,
+}
+
+BARE = """
+    <soap:Envelope xmlns:soap="%s">
+      <soap:Body>
+        <Foo xmlns="http://example.com">Text</Foo>
+      </soap:Body>
+    </soap:Envelope>
+""" % SOAP_NS
+
+NOW = parse_datetime('2015-06-25T21:53:25.246Z')
+
+
+def xp(node, xpath):
+    """Utility to do xpath search with namespaces."""
+    return node.xpath(xpath, namespaces=namespaces)
+
+
+def test_format_datetime():
+    assert format_datetime(NOW) == '2015-06-25T21:53:25.246Z'
+    assert format_datetime(0) == '1970-01-01T00:00:00.000Z'
+
+
+def test_add_to_bare_envelope():
+    doc = SecurityHeader(ttl=60, clock=lambda: NOW).apply(
+        etree.fromstring(BARE))
+
+    [security] = xp(doc, '/soap:Envelope/soap:Header/wsse:Security')
+    assert security.get('{%s}mustUnderstand' % SOAP_NS) == '1'
+    assert xp(security, 'wsu:Timestamp/wsu:Created/text()') == [
+        '2015-06-25T21:53:25.246Z']
+    assert xp(security, 'wsu:Timestamp/wsu:Expires/text()') == [
+        '2015-06-25T21:54:25.246Z']
+
+
+def test_add_to_existing_security(envelope):
+    doc = SecurityHeader(ttl=None, must_understand=False).apply(
+        etree.fromstring(envelope))
+
+    assert len(xp(doc, '//wsse:Security')) == 1
+    [timestamp] = xp(doc, '//wsse:Security/wsu:Timestamp')
+    # The old timestamp (from 2015) has been replaced, with no Expires.
+    assert not timestamp.findtext('{%s}Created' % WSU_NS).startswith('2015')
+    assert xp(timestamp, 'wsu:Expires') == []
+
+
+def test_sign_and_verify(cert_path, key_path):
+    doc = add_security_header(etree.fromstring(BARE))
+    signed = etree.tostring(signing.sign_tree(doc, key_path, cert_path))
+
+    # no exception raised
+    signing.verify(signed, cert_path, freshness=FreshnessPolicy())
+
+
+def test_not_envelope():
+    with pytest.raises(MissingElement):
+        add_security_header(etree.fromstring('<foo/>'))
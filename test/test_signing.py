@@ -1,6 +1,11 @@
+import copy
+
 from lxml import etree
+import pytest
+import xmlsec
 
 from wsse.constants import SOAP_NS, WSSE_NS, DS_NS
+from wsse.exceptions import DuplicateId, SignatureVerificationFailed
 from wsse import signing
 
 
@@ -36,3 +41,117 @@ def test_sign_and_verify(envelope, cert_path, key_path):
 
     # no SignatureValidationFailed exception raised
     signing.verify(signed, cert_path)
+
+
+def test_signer_reuse(envelope, cert_path, key_path):
+    with open(key_path, 'rb') as fh:
+        key_data = fh.read()
+    with open(cert_path, 'rb') as fh:
+        cert_data = fh.read()
+    signer = signing.Signer.from_memory(key_data, cert_data)
+
+    for i in range(2):
+        signing.verify(signer.sign(envelope), cert_path)
+
+
+def test_sign_and_verify_tree(envelope, cert_path, key_path):
+    doc = etree.fromstring(envelope)
+
+    assert signing.sign_tree(doc, key_path, cert_path) is doc
+
+    signing.verify_tree(doc, cert_path)
+
+
+def test_verify_duplicate_id(envelope, cert_path, key_path):
+    doc = signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+    body = xp(doc, '/soap:Envelope/soap:Body')[0]
+    # Attempt to wrap the signed body, substituting a different one.
+    xp(doc, '/soap:Envelope/soap:Header')[0].append(copy.deepcopy(body))
+
+    with pytest.raises(DuplicateId):
+        signing.verify_tree(doc, cert_path)
+
+
+def test_verify_duplicate_unreferenced_id(envelope, cert_path, key_path):
+    # Payload elements may share an Id, as long as nothing references it.
+    envelope = envelope.replace(
+        'Text</Foo>', 'Text</Foo><Line Id="1"/><Line Id="1"/>')
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    signing.verify(signed, cert_path)
+
+
+def test_verify_plain_id(envelope, cert_path, key_path):
+    # Sign a soap:Body referenced by a plain (not wsu:) Id attribute, as
+    # some other WSSE implementations do.
+    doc = etree.fromstring(envelope)
+    body = xp(doc, '/soap:Envelope/soap:Body')[0]
+    body.set('Id', 'body')
+    signature = signing._signature_template(
+        1, xmlsec.Transform.RSA_SHA1, xmlsec.Transform.SHA1)
+    xp(doc, '//wsse:Security')[0].insert(0, signature)
+    xp(signature, 'ds:SignedInfo/ds:Reference')[0].set('URI', '#body')
+    ctx = xmlsec.SignatureContext()
+    ctx.key = signing.Signer.from_files(key_path, cert_path).key
+    ctx.register_id(body, 'Id')
+    ctx.sign(signature)
+
+    # no exception raised
+    signing.verify(etree.tostring(doc), cert_path)
+
+    body.set('Id', 'tampered')
+    xp(signature, 'ds:SignedInfo/ds:Reference')[0].set('URI', '#tampered')
+    with pytest.raises(SignatureVerificationFailed):
+        signing.verify(etree.tostring(doc), cert_path)
+
+
+@pytest.mark.parametrize('signature_method,digest_method', [
+    (xmlsec.Transform.RSA_SHA256, xmlsec.Transform.SHA256),
+    (xmlsec.Transform.RSA_SHA512, xmlsec.Transform.SHA512),
+])
+def test_sign_and_verify_algorithms(envelope, cert_path, key_path,
+                                    signature_method, digest_method):
+    signed = signing.sign(
+        envelope,
+        key_path,
+        cert_path,
+        signature_method=signature_method,
+        digest_method=digest_method,
+    )
+    doc = etree.fromstring(signed)
+
+    assert xp(doc, '//ds:SignatureMethod/@Algorithm') == [
+        signature_method.href]
+    assert xp(doc, '//ds:DigestMethod/@Algorithm') == [
+        digest_method.href] * 2
+
+    signing.verify(
+        signed,
+        cert_path,
+        signature_methods=[signature_method],
+        digest_methods=[digest_method],
+    )
+
+
+def test_sign_and_verify_ecdsa(envelope, ec_cert_path, ec_key_path):
+    signed = signing.sign(
+        envelope,
+        ec_key_path,
+        ec_cert_path,
+        signature_method=xmlsec.Transform.ECDSA_SHA256,
+        digest_method=xmlsec.Transform.SHA256,
+    )
+
+    signing.verify(signed, ec_cert_path)
+
+
+def test_verify_rejects_algorithm(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    with pytest.raises(SignatureVerificationFailed):
+        signing.verify(
+            signed,
+            cert_path,
+            signature_methods=[xmlsec.Transform.RSA_SHA256],
+            digest_methods=[xmlsec.Transform.SHA256],
+        )
@@ -0,0 +1,246 @@
+import io
+
+from lxml import etree
+import pytest
+import xmlsec
+
+from wsse.constants import DS_NS, SOAP_NS, WSSE_NS
+from wsse.exceptions import DuplicateId, SignatureVerificationFailed
+from wsse import signing, streaming
+
+
+namespaces = {
+    'soap': SOAP_NS,
+    'wsse': WSSE_NS,
+    'ds': DS_NS,
+}
+
+
+def xp(node, xpath):
+    """Utility to do xpath search with namespaces."""
+    return node.xpath(xpath, namespaces=namespaces)
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_verify(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    # no SignatureValidationFailed exception raised
+    streaming.verify(signed, cert_path)
+    streaming.verify(io.BytesIO(signed), cert_path)
+    streaming.verify(chunks(signed, 7), cert_path)
+
+
+def test_verify_feed(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+    verifier = streaming.StreamingVerifier.from_file(cert_path)
+
+    for i in range(2):
+        parser = verifier.parser()
+        for chunk in chunks(signed, 100):
+            parser.feed(chunk)
+        parser.close()
+
+
+def test_verify_tampered(envelope, cert_path, key_path):
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    with pytest.raises(SignatureVerificationFailed):
+        streaming.verify(signed.replace(b'Text', b'Txet'), cert_path)
+
+
+def test_verify_bad_signature_value(envelope, cert_path, key_path):
+    doc = signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+    value = xp(doc, '//ds:SignatureValue')[0]
+    value.text = value.text[4:] + value.text[:4]
+
+    with pytest.raises(SignatureVerificationFailed):
+        streaming.verify(etree.tostring(doc), cert_path)
+
+
+def test_verify_unsigned(envelope, cert_path):
+    with pytest.raises(SignatureVerificationFailed):
+        streaming.verify(envelope.encode('utf-8'), cert_path)
+
+
+def test_verify_referenced_before_signature(envelope, cert_path, key_path):
+    # The signed Timestamp comes before the Signature, so must be buffered.
+    doc = signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+    security = xp(doc, '//wsse:Security')[0]
+    security.append(xp(security, 'ds:Signature')[0])
+
+    streaming.verify(chunks(etree.tostring(doc), 50), cert_path)
+
+
+@pytest.mark.parametrize('before_signature', [False, True])
+def test_verify_duplicate_id(envelope, cert_path, key_path,
+                             before_signature):
+    doc = signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+    body = xp(doc, '/soap:Envelope/soap:Body')[0]
+    header = xp(doc, '/soap:Envelope/soap:Header')[0]
+    copy = etree.fromstring(etree.tostring(body))
+    if before_signature:
+        header.insert(0, copy)
+    else:
+        header.append(copy)
+
+    with pytest.raises(DuplicateId):
+        streaming.verify(etree.tostring(doc), cert_path)
+
+
+@pytest.mark.parametrize('move_signature', [False, True])
+def test_verify_duplicate_unreferenced_id(envelope, cert_path, key_path,
+                                          move_signature):
+    # Payload elements may share an Id, as long as nothing references it.
+    envelope = envelope.replace(
+        'Text</Foo>', 'Text</Foo><Line Id="1"/><Line Id="1"/>')
+    doc = signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+    if move_signature:
+        # Put the duplicates (and the signed body) before the Signature.
+        doc.insert(0, xp(doc, '/soap:Envelope/soap:Body')[0])
+
+    streaming.verify(etree.tostring(doc), cert_path)
+
+
+def test_verify_large_body(envelope, cert_path, key_path):
+    payload = 'QUJD' * 250000
+    signed = signing.sign(
+        envelope.replace('Text', payload), key_path, cert_path)
+
+    streaming.verify(io.BytesIO(signed), cert_path)
+
+
+@pytest.mark.parametrize('signature_method,digest_method', [
+    (xmlsec.Transform.RSA_SHA256, xmlsec.Transform.SHA256),
+    (xmlsec.Transform.RSA_SHA512, xmlsec.Transform.SHA512),
+])
+def test_verify_algorithms(envelope, cert_path, key_path,
+                           signature_method, digest_method):
+    signed = signing.sign(
+        envelope,
+        key_path,
+        cert_path,
+        signature_method=signature_method,
+        digest_method=digest_method,
+    )
+
+    streaming.verify(signed, cert_path)
+    with pytest.raises(SignatureVerificationFailed):
+        streaming.verify(
+            signed,
+            cert_path,
+            signature_methods=[xmlsec.Transform.RSA_SHA1],
+        )
+
+
+def test_verify_ecdsa(envelope, ec_cert_path, ec_key_path):
+    signed = signing.sign(
+        envelope,
+        ec_key_path,
+        ec_cert_path,
+        signature_method=xmlsec.Transform.ECDSA_SHA256,
+        digest_method=xmlsec.Transform.SHA256,
+    )
+
+    streaming.verify(signed, ec_cert_path)
+
+
+class CanonicalizingTarget(object):
+    """Parser target canonicalizing the first element with given name."""
+    def __init__(self, local_name):
+        self.local_name = local_name
+        self.scopes = [streaming._Scope()]
+        self.canonicalizer = None
+        self.output = []
+
+    def start(self, tag, attrib, nsmap=None):
+        scope = self.scopes[-1].child(nsmap)
+        self.scopes.append(scope)
+        if (self.canonicalizer is None and
+                etree.QName(tag).localname == self.local_name):
+            self.canonicalizer = streaming._Canonicalizer(self.output.append)
+        self.handle(('start', streaming._element(scope, tag, attrib)))
+
+    def end(self, tag):
+        self.scopes.pop()
+        self.handle(('end',))
+
+    def data(self, data):
+        self.handle(('data', data))
+
+    def pi(self, target, data):
+        self.handle(('pi', target, data))
+
+    def handle(self, event):
+        if self.canonicalizer is not None and not self.canonicalizer.done:
+            self.canonicalizer.handle(event)
+
+    def close(self):
+        return b''.join(self.output)
+
+
+@pytest.mark.parametrize('xml', [
+    b'<r xmlns="http://d" xmlns:a="http://a" xmlns:b="http://b">'
+    b'<a:x b:z="1" y="2&amp;&#9;&#10;"><b:q>t&lt;&gt;&#13;</b:q>'
+    b'<n xmlns="">e</n><?p d?><!--c--><m xml:lang="en" a:k="v"/></a:x></r>',
+    b'<a:r xmlns:a="http://a"><a:s xmlns:a="http://b">'
+    b'<x xmlns="http://c">1</x></a:s></a:r>',
+])
+def test_canonicalizer(xml):
+    # Canonicalize each element, in small chunks, and compare with libxml2.
+    for element in etree.fromstring(xml).iter(etree.Element):
+        expected = etree.tostring(
+            element, method='c14n', exclusive=True, with_comments=False)
+        parser = etree.XMLParser(
+            target=CanonicalizingTarget(etree.QName(element).localname))
+        for chunk in chunks(xml, 5):
+            parser.feed(chunk)
+
+        assert parser.close() == expected
+
+
+def test_verify_ampersand_attribute(envelope, cert_path, key_path):
+    signed = signing.sign(
+        envelope.replace('<Foo ', '<Foo b="x&amp;y&#38;#38;" '),
+        key_path,
+        cert_path,
+    )
+
+    signing.verify(signed, cert_path)
+    streaming.verify(signed, cert_path)
+
+
+def test_verify_namespace_with_two_prefixes(envelope, cert_path, key_path):
+    signed = signing.sign(
+        envelope.replace(
+            '<Foo xmlns="http://example.com">Text</Foo>',
+            '<a:Foo xmlns:a="http://example.com" xmlns:b="http://example.com"'
+            '>Text</a:Foo>',
+        ),
+        key_path,
+        cert_path,
+    )
+
+    signing.verify(signed, cert_path)
+    with pytest.raises(SignatureVerificationFailed) as excinfo:
+        streaming.verify(signed, cert_path)
+    assert 'Unsupported' in str(excinfo.value)
+
+
+def test_verify_namespace_prefix_rebound(envelope, cert_path, key_path):
+    # Two prefixes for one namespace, until one of them is rebound.
+    signed = signing.sign(
+        envelope.replace(
+            '<Foo xmlns="http://example.com">Text</Foo>',
+            '<w xmlns:b="http://X" xmlns:a="http://X">'
+            '<a:y xmlns:a="http://Y"><b:z>1</b:z></a:y></w>',
+        ),
+        key_path,
+        cert_path,
+    )
+
+    signing.verify(signed, cert_path)
+    streaming.verify(signed, cert_path)
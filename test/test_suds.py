@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+import pytest
+
+pytest.importorskip('suds')
+
+from wsse.exceptions import ReplayedMessage  # noqa
+from wsse import signing  # noqa
+from wsse.freshness import FreshnessPolicy, ReplayCache, parse_datetime  # noqa
+from wsse.suds import WssePlugin  # noqa
+from wsse.tracing import Tracer  # noqa
+
+
+class Context(object):
+    """Stand-in for a suds plugin context."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_sending_and_received(envelope, cert_path, key_path):
+    plugin = WssePlugin(
+        keyfile=key_path, certfile=cert_path, their_certfile=cert_path)
+    context = Context(envelope=envelope.encode('utf-8'))
+
+    plugin.sending(context)
+
+    assert b'EncryptedData' in context.envelope
+    assert b'>Text<' not in context.envelope
+
+    context = Context(reply=context.envelope)
+    plugin.received(context)
+
+    assert b'>Text<' in context.reply
+
+
+def test_tracer(envelope, cert_path, key_path):
+    durations = []
+    plugin = WssePlugin(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        tracer=Tracer(on_duration=lambda name, s: durations.append(name)),
+    )
+    context = Context(envelope=envelope.encode('utf-8'))
+    plugin.sending(context)
+    plugin.received(Context(reply=context.envelope))
+
+    for name in ['sending.parse', 'sign.xmlsec', 'encrypt.data',
+                 'sending.serialize', 'received.parse', 'decrypt.unwrap',
+                 'verify.xmlsec', 'received.serialize']:
+        assert name in durations
+
+
+def test_freshness(envelope, cert_path, key_path):
+    def clock():
+        return parse_datetime('2015-06-25T21:54:00Z')
+
+    policy = FreshnessPolicy(
+        replay_cache=ReplayCache(clock=clock), clock=clock)
+    plugin = WssePlugin(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        freshness=policy,
+    )
+    context = Context(envelope=envelope.encode('utf-8'))
+    plugin.sending(context)
+    reply = context.envelope
+
+    plugin.received(Context(reply=reply))
+    with pytest.raises(ReplayedMessage):
+        plugin.received(Context(reply=reply))
+
+
+def test_timestamp_ttl(cert_path, key_path):
+    plugin = WssePlugin(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        timestamp_ttl=60,
+        freshness=FreshnessPolicy(),
+    )
+    context = Context(envelope=(
+        '<soap:Envelope '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><Foo xmlns="http://example.com">Text</Foo></soap:Body>'
+        '</soap:Envelope>'
+    ).encode('utf-8'))
+    plugin.sending(context)
+    context = Context(reply=context.envelope)
+    plugin.received(context)
+
+    assert b'>Text<' in context.reply
+
+
+def test_preloaded(envelope, cert_path, key_path, tmpdir):
+    plugin = WssePlugin(
+        keyfile=key_path, certfile=cert_path, their_certfile=cert_path)
+    # The files are no longer needed once the plugin is created.
+    tmpdir.remove()
+    context = Context(envelope=envelope.encode('utf-8'))
+    plugin.sending(context)
+    plugin.received(Context(reply=context.envelope))
+
+
+def test_concurrent(envelope, cert_path, key_path):
+    # One plugin shared by many threads, as with a shared Suds client.
+    plugin = WssePlugin(
+        keyfile=key_path, certfile=cert_path, their_certfile=cert_path)
+
+    def round_trip(i):
+        context = Context(
+            envelope=envelope.replace('Text', 'Text %d' % i).encode('utf-8'))
+        plugin.sending(context)
+        sent = context.envelope
+        context = Context(reply=sent)
+        plugin.received(context)
+        # Also verify the decrypted reply independently of the plugin.
+        signing.verify(context.reply, cert_path)
+        return etree.fromstring(context.reply).findtext(
+            './/{http://example.com}Foo')
+
+    with ThreadPoolExecutor(8) as executor:
+        texts = list(executor.map(round_trip, range(200)))
+
+    assert texts == ['Text %d' % i for i in range(200)]
@@ -0,0 +1,81 @@
+from wsse import encryption, signing
+from wsse.tracing import NULL_TRACER, Tracer
+from wsse.xml import fromstring
+
+
+class RecordingTracer(Tracer):
+    """Tracer recording all durations and counts."""
+    def __init__(self):
+        self.durations = []
+        self.counts = {}
+
+    def duration(self, name, seconds):
+        assert seconds >= 0
+        self.durations.append(name)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+
+def test_sign_and_verify(envelope, cert_path, key_path):
+    tracer = RecordingTracer()
+    signed = signing.sign(envelope, key_path, cert_path, tracer=tracer)
+    signing.verify(signed, cert_path, tracer=tracer)
+
+    assert tracer.durations == [
+        'sign.load_key', 'sign.parse', 'sign.template', 'sign.xmlsec',
+        'sign.key_info', 'sign.serialize',
+        # The envelope's structure is checked before loading the key.
+        'verify.parse', 'verify.index', 'verify.load_key', 'verify.xmlsec',
+    ]
+    assert tracer.counts == {
+        'sign.bytes_in': len(envelope),
+        'sign.bytes_out': len(signed),
+        'sign.references': 2,
+        'verify.bytes_in': len(signed),
+        'verify.references': 2,
+    }
+
+
+def test_encrypt_and_decrypt(envelope, cert_path, key_path):
+    tracer = RecordingTracer()
+    encrypted = encryption.encrypt(envelope, cert_path, tracer=tracer)
+    decrypted = encryption.decrypt(encrypted, key_path, tracer=tracer)
+
+    assert tracer.durations == [
+        'encrypt.load_key', 'encrypt.parse', 'encrypt.session_key',
+        'encrypt.data', 'encrypt.serialize',
+        'decrypt.parse', 'decrypt.index', 'decrypt.load_key',
+        'decrypt.unwrap', 'decrypt.data', 'decrypt.serialize',
+    ]
+    assert tracer.counts == {
+        'encrypt.bytes_in': len(envelope),
+        'encrypt.bytes_out': len(encrypted),
+        'encrypt.references': 1,
+        'decrypt.bytes_in': len(encrypted),
+        'decrypt.bytes_out': len(decrypted),
+        'decrypt.references': 1,
+    }
+
+
+def test_callbacks(envelope, cert_path):
+    durations = []
+    counts = []
+    tracer = Tracer(
+        on_duration=lambda name, seconds: durations.append(name),
+        on_count=lambda name, value: counts.append(name),
+    )
+    encryptor = encryption.Encryptor.from_file(cert_path, tracer=tracer)
+    encryptor.encrypt_tree(fromstring(envelope))
+
+    assert durations == [
+        'encrypt.load_key', 'encrypt.session_key', 'encrypt.data']
+    assert counts == ['encrypt.references']
+
+
+def test_null_tracer():
+    with NULL_TRACER.stage('anything'):
+        pass
+    NULL_TRACER.duration('anything', 1.0)
+    NULL_TRACER.element('anything', 'id', 1.0)
+    NULL_TRACER.count('anything', 1)
@@ -0,0 +1,186 @@
+import datetime
+import os
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from lxml import etree
+import pytest
+
+from wsse.constants import NAMESPACES, WSSE_NS, WSU_NS
+from wsse.exceptions import (
+    MissingElement, UnresolvedReference, UntrustedCertificate)
+from wsse import signing
+from wsse.trust import TrustedVerifier, TrustStore
+from wsse.xml import ns
+from wsse.zeep import ZeepWsse
+
+from .conftest import Clock
+
+
+def xp(node, xpath):
+    """Utility to do xpath search with namespaces."""
+    return node.xpath(xpath, namespaces=NAMESPACES)
+
+
+def make_cert(directory, name, issuer=None, ca=False):
+    """Write a new private key and cert, issued by ``issuer`` if given.
+
+    ``issuer`` is the (key, cert) of the issuing CA; without one, the cert is
+    self-signed. Return ``(key, cert, key_path, cert_path)``.
+
+    """
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    issuer_key, issuer_cert = issuer or (key, None)
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(
+        subject
+    ).issuer_name(
+        subject if issuer_cert is None else issuer_cert.subject
+    ).public_key(
+        key.public_key()
+    ).serial_number(
+        x509.random_serial_number()
+    ).not_valid_before(
+        now - datetime.timedelta(days=1)
+    ).not_valid_after(
+        now + datetime.timedelta(days=30)
+    ).add_extension(
+        x509.BasicConstraints(ca=ca, path_length=None), critical=True
+    ).sign(issuer_key, hashes.SHA256(), default_backend())
+
+    key_path = os.path.join(directory, name + '_key.pem')
+    with open(key_path, 'wb') as fh:
+        fh.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    cert_path = os.path.join(directory, name + '_cert.pem')
+    with open(cert_path, 'wb') as fh:
+        fh.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key, cert, key_path, cert_path
+
+
+@pytest.fixture
+def ca(tmpdir):
+    return make_cert(str(tmpdir), 'ca', ca=True)
+
+
+@pytest.fixture
+def partner(tmpdir, ca):
+    return make_cert(str(tmpdir), 'partner', issuer=ca[:2])
+
+
+def test_verify_trusted(envelope, ca, partner):
+    trust_store = TrustStore.from_files([ca[3]])
+    signed = signing.sign(envelope, partner[2], partner[3])
+
+    signing.verify(signed, None, trust_store=trust_store)
+    signing.verify(signed, None, trust_store=trust_store)
+
+    # The chain was checked only once.
+    assert trust_store.counts == {
+        'hits': 1,
+        'misses': 1,
+        'evictions': 0,
+        'expirations': 0,
+        'rejections': 0,
+    }
+
+
+def test_verify_untrusted(envelope, ca, cert_path, key_path):
+    trust_store = TrustStore.from_files([ca[3]])
+    # Self-signed, not issued by the CA.
+    signed = signing.sign(envelope, key_path, cert_path)
+
+    with pytest.raises(UntrustedCertificate):
+        signing.verify(signed, None, trust_store=trust_store)
+    assert trust_store.counts['rejections'] == 1
+    assert len(trust_store) == 0
+
+
+def test_intermediate_ca(envelope, tmpdir, ca):
+    intermediate = make_cert(
+        str(tmpdir), 'intermediate', issuer=ca[:2], ca=True)
+    partner = make_cert(str(tmpdir), 'partner', issuer=intermediate[:2])
+    # Both CA certs in one bundle.
+    bundle = str(tmpdir / 'bundle.pem')
+    with open(bundle, 'wb') as fh:
+        for path in (ca[3], intermediate[3]):
+            with open(path, 'rb') as cert_fh:
+                fh.write(cert_fh.read())
+
+    signed = signing.sign(envelope, partner[2], partner[3])
+
+    signing.verify(signed, None, trust_store=TrustStore.from_files([bundle]))
+    with pytest.raises(UntrustedCertificate):
+        signing.verify(
+            signed, None, trust_store=TrustStore.from_files([ca[3]]))
+
+
+def test_expiration(envelope, ca, partner):
+    clock = Clock()
+    trust_store = TrustStore.from_files([ca[3]], ttl=60, clock=clock)
+    signed = signing.sign(envelope, partner[2], partner[3])
+
+    signing.verify(signed, None, trust_store=trust_store)
+    clock.now = 60
+    signing.verify(signed, None, trust_store=trust_store)
+    assert trust_store.counts['expirations'] == 1
+    assert trust_store.counts['misses'] == 2
+
+
+def test_eviction(envelope, tmpdir, ca, partner):
+    other = make_cert(str(tmpdir), 'other', issuer=ca[:2])
+    trust_store = TrustStore.from_files([ca[3]], max_size=1)
+
+    for signer in (partner, other, partner):
+        signing.verify(
+            signing.sign(envelope, signer[2], signer[3]),
+            None,
+            trust_store=trust_store,
+        )
+    assert trust_store.counts['evictions'] == 2
+    assert len(trust_store) == 1
+
+
+def test_binary_security_token(envelope, ca, partner):
+    doc = etree.fromstring(signing.sign(envelope, partner[2], partner[3]))
+    # Move the cert into a BinarySecurityToken, and refer to that instead.
+    [security] = xp(doc, '//wsse:Security')
+    [reference] = xp(security, 'ds:Signature/ds:KeyInfo/*')
+    [cert] = xp(reference, 'ds:X509Data/ds:X509Certificate')
+    token = etree.SubElement(security, ns(WSSE_NS, 'BinarySecurityToken'))
+    token.set(ns(WSU_NS, 'Id'), 'token')
+    token.text = cert.text
+    reference.remove(reference[0])
+    etree.SubElement(reference, ns(WSSE_NS, 'Reference')).set('URI', '#token')
+    trust_store = TrustStore.from_files([ca[3]])
+
+    signing.verify(etree.tostring(doc), None, trust_store=trust_store)
+
+    reference[0].set('URI', '#missing')
+    with pytest.raises(UnresolvedReference):
+        signing.verify(etree.tostring(doc), None, trust_store=trust_store)
+
+    reference.remove(reference[0])
+    with pytest.raises(MissingElement):
+        signing.verify(etree.tostring(doc), None, trust_store=trust_store)
+
+
+def test_plugin_with_trust_store(envelope, ca, partner, monkeypatch):
+    # Their cert is loaded only to encrypt, not into a Verifier.
+    monkeypatch.setattr(signing.Verifier, 'from_memory', None)
+    wsse = ZeepWsse(
+        keyfile=partner[2],
+        certfile=partner[3],
+        their_certfile=partner[3],
+        trust_store=TrustStore.from_files([ca[3]]),
+    )
+    assert isinstance(wsse.verifier, TrustedVerifier)
+    doc, _ = wsse.apply(etree.fromstring(envelope), {})
+    wsse.verify(etree.fromstring(etree.tostring(doc)))
@@ -0,0 +1,166 @@
+from lxml import etree
+import pytest
+
+from wsse.constants import DS_NS, ENC_NS, SOAP_NS, WSSE_NS
+from wsse.exceptions import (
+    DuplicateId,
+    InvalidEnvelope,
+    LimitExceeded,
+    MissingElement,
+    UnresolvedReference,
+)
+from wsse import encryption, signing, validation
+from wsse.xml import ID_ATTR
+
+
+namespaces = {
+    'soap': SOAP_NS,
+    'wsse': WSSE_NS,
+    'ds': DS_NS,
+    'xenc': ENC_NS,
+}
+
+# No key is ever loaded from here, as the envelopes are rejected first.
+MISSING_PATH = '/nonexistent/key.pem'
+
+
+def xp(node, xpath):
+    """Utility to do xpath search with namespaces."""
+    return node.xpath(xpath, namespaces=namespaces)
+
+
+def remove(node):
+    node.getparent().remove(node)
+
+
+@pytest.fixture
+def signed(envelope, cert_path, key_path):
+    """Signed envelope, parsed."""
+    return signing.sign_tree(etree.fromstring(envelope), key_path, cert_path)
+
+
+@pytest.fixture
+def encrypted(envelope, cert_path):
+    """Encrypted envelope, parsed."""
+    return encryption.encrypt_tree(etree.fromstring(envelope), cert_path)
+
+
+def test_check_signed(signed):
+    signature, targets = validation.check_signed(signed)
+
+    assert signature is xp(signed, '//ds:Signature')[0]
+    assert [etree.QName(t).localname for t in targets] == ['Body', 'Timestamp']
+
+
+@pytest.mark.parametrize('xpath,exception', [
+    ('/soap:Envelope/soap:Header', MissingElement),
+    ('//wsse:Security', MissingElement),
+    ('//ds:Signature', MissingElement),
+    ('//ds:SignatureValue', MissingElement),
+    ('//ds:Reference', MissingElement),
+    ('/soap:Envelope/soap:Body', UnresolvedReference),
+])
+def test_verify_malformed(signed, xpath, exception):
+    for node in xp(signed, xpath):
+        remove(node)
+
+    with pytest.raises(exception):
+        signing.verify(etree.tostring(signed), MISSING_PATH)
+
+
+def test_verify_not_envelope():
+    with pytest.raises(MissingElement):
+        signing.verify(b'<foo/>', MISSING_PATH)
+
+
+def test_verify_external_reference(signed):
+    xp(signed, '//ds:Reference')[0].set('URI', 'http://example.com/')
+
+    with pytest.raises(UnresolvedReference):
+        signing.verify_tree(signed, MISSING_PATH)
+
+
+def test_verify_limits(signed, cert_path):
+    verifier = signing.Verifier.from_file(
+        cert_path, limits={'max_references': 1})
+
+    with pytest.raises(LimitExceeded):
+        verifier.verify_tree(signed)
+
+    with pytest.raises(LimitExceeded):
+        signing.verify_tree(signed, MISSING_PATH, limits={'max_depth': 3})
+
+    # no exception raised
+    signing.verify_tree(signed, cert_path, limits={'max_depth': None})
+
+
+def test_unknown_limit(signed):
+    with pytest.raises(TypeError):
+        validation.check_signed(signed, {'max_size': 1})
+
+
+def test_check_encrypted(encrypted):
+    [(enc_key, blocks)] = validation.check_encrypted(encrypted)
+
+    assert enc_key is xp(encrypted, '//xenc:EncryptedKey')[0]
+    assert [enc_data for _, enc_data in blocks] == xp(
+        encrypted, '//xenc:EncryptedData')
+
+
+@pytest.mark.parametrize('xpath,exception', [
+    ('//xenc:EncryptedKey', MissingElement),
+    ('//xenc:EncryptedKey/xenc:CipherData', MissingElement),
+    ('//xenc:EncryptedData/xenc:EncryptionMethod', MissingElement),
+    ('//xenc:EncryptedData', UnresolvedReference),
+])
+def test_decrypt_malformed(encrypted, xpath, exception):
+    for node in xp(encrypted, xpath):
+        remove(node)
+
+    with pytest.raises(exception):
+        encryption.decrypt(etree.tostring(encrypted), MISSING_PATH)
+
+
+def test_decrypt_reference_to_wrong_element(encrypted):
+    # Point the DataReference at the (wsu:Id-bearing) BinarySecurityToken.
+    token = xp(encrypted, '//wsse:BinarySecurityToken')[0]
+    xp(encrypted, '//xenc:DataReference')[0].set(
+        'URI', '#' + token.get(ID_ATTR))
+
+    with pytest.raises(UnresolvedReference):
+        encryption.decrypt_tree(encrypted, MISSING_PATH)
+
+
+def test_decrypt_limits(encrypted):
+    with pytest.raises(LimitExceeded):
+        encryption.decrypt_tree(
+            encrypted, MISSING_PATH, limits={'max_encrypted_keys': 0})
+
+
+def test_check_duplicate_unreferenced_id(signed, encrypted):
+    # Payload elements may share an Id, as long as nothing references it.
+    for doc in (signed, encrypted):
+        body = xp(doc, '/soap:Envelope/soap:Body')[0]
+        for i in range(2):
+            etree.SubElement(body, 'Line').set('Id', '1')
+
+    validation.check_signed(signed)
+    validation.check_encrypted(encrypted)
+
+
+def test_check_duplicate_referenced_id(signed, encrypted):
+    for doc, xpath in [
+            (signed, '/soap:Envelope/soap:Body'),
+            (encrypted, '//xenc:EncryptedData')]:
+        element = xp(doc, xpath)[0]
+        copy = etree.SubElement(xp(doc, '/soap:Envelope/soap:Header')[0], 'X')
+        copy.set(ID_ATTR, element.get(ID_ATTR))
+
+    with pytest.raises(DuplicateId):
+        validation.check_signed(signed)
+    with pytest.raises(DuplicateId):
+        validation.check_encrypted(encrypted)
+
+
+def test_duplicate_id_is_invalid_envelope():
+    assert issubclass(DuplicateId, InvalidEnvelope)
@@ -0,0 +1,80 @@
+import threading
+
+from lxml import etree
+import pytest
+
+from wsse.constants import WSU_NS
+from wsse.exceptions import DuplicateId
+from wsse import xml
+from wsse.xml import build_id_index, find_by_id
+
+
+@pytest.fixture
+def parser_defaults(request):
+    """Restore default parser options after the test."""
+    request.addfinalizer(
+        lambda: xml.configure_parser(**xml.PARSER_DEFAULTS))
+
+
+def test_build_id_index():
+    doc = etree.fromstring(
+        '<a xmlns:wsu="%s"><b wsu:Id="one"/><c Id="two"><d wsu:Id="three"/>'
+        '</c></a>' % WSU_NS
+    )
+    index = build_id_index(doc)
+
+    assert sorted(index) == ['one', 'three', 'two']
+    assert index['three'].tag == 'd'
+    assert sorted(build_id_index(doc, set(['two', 'four']))) == ['two']
+
+
+def test_build_id_index_duplicate():
+    doc = etree.fromstring(
+        '<a xmlns:wsu="%s"><b wsu:Id="one"/><c Id="one"/><d Id="two"/></a>'
+        % WSU_NS)
+    index = build_id_index(doc)
+
+    # Only looking up the duplicated ID fails.
+    assert find_by_id(index, 'two').tag == 'd'
+    assert find_by_id(index, 'three') is None
+    with pytest.raises(DuplicateId):
+        find_by_id(index, 'one')
+
+
+def test_parser_does_not_resolve_entities():
+    doc = xml.fromstring(
+        '<!DOCTYPE a [<!ENTITY e "expanded">]><a>&e;</a>')
+
+    assert 'expanded' not in etree.tostring(doc).decode('ascii')
+
+
+def test_parser_cached_per_thread(parser_defaults):
+    parser = xml.get_parser()
+    others = []
+    thread = threading.Thread(target=lambda: others.append(xml.get_parser()))
+    thread.start()
+    thread.join()
+
+    assert xml.get_parser() is parser
+    assert others[0] is not parser
+
+    xml.configure_parser(remove_blank_text=True)
+
+    assert xml.get_parser() is not parser
+    assert len(xml.fromstring('<a> <b/> </a>').xpath('//text()')) == 0
+
+
+def test_configure_parser_huge_tree(parser_defaults):
+    envelope = '<a>%s</a>' % ('x' * (10 * 1024 * 1024 + 1))
+
+    with pytest.raises(etree.XMLSyntaxError):
+        xml.fromstring(envelope)
+
+    xml.configure_parser(huge_tree=True)
+
+    assert len(xml.fromstring(envelope).text) == 10 * 1024 * 1024 + 1
+
+
+def test_configure_parser_unknown_option():
+    with pytest.raises(TypeError):
+        xml.configure_parser(recover=True)
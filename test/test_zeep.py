@@ -0,0 +1,94 @@
+from lxml import etree
+import pytest
+
+from wsse.constants import SOAP_NS
+from wsse.exceptions import (
+    InvalidTimestamp, ReplayedMessage, SignatureVerificationFailed)
+from wsse.freshness import FreshnessPolicy, ReplayCache
+from wsse.zeep import ZeepWsse
+
+
+BARE = """
+    <soap:Envelope xmlns:soap="%s">
+      <soap:Body>
+        <Foo xmlns="http://example.com">Text</Foo>
+      </soap:Body>
+    </soap:Envelope>
+""" % SOAP_NS
+
+
+@pytest.fixture
+def wsse(cert_path, key_path):
+    return ZeepWsse(
+        keyfile=key_path, certfile=cert_path, their_certfile=cert_path)
+
+
+def test_apply_and_verify(wsse):
+    doc = etree.fromstring(BARE)
+    headers = {'SOAPAction': 'foo'}
+
+    envelope, new_headers = wsse.apply(doc, headers)
+
+    # Protected in place.
+    assert envelope is doc
+    assert new_headers is headers
+    assert b'EncryptedData' in etree.tostring(doc)
+    assert b'>Text<' not in etree.tostring(doc)
+
+    doc = etree.fromstring(etree.tostring(doc))
+    assert wsse.verify(doc) is doc
+    assert b'>Text<' in etree.tostring(doc)
+
+
+def test_existing_timestamp(envelope, cert_path, key_path):
+    wsse = ZeepWsse(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        timestamp_ttl=None,
+    )
+    doc, _ = wsse.apply(etree.fromstring(envelope), {})
+
+    # The envelope's own (2015) timestamp was kept.
+    assert b'2015-06-25' in etree.tostring(doc)
+    wsse.verify(doc)
+
+
+def test_verify_tampered(wsse):
+    doc, _ = wsse.apply(etree.fromstring(BARE), {})
+    doc = etree.fromstring(etree.tostring(doc).replace(b'Created>', b'Cr>'))
+
+    with pytest.raises(SignatureVerificationFailed):
+        wsse.verify(doc)
+
+
+def test_verify_replayed(cert_path, key_path):
+    wsse = ZeepWsse(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        freshness=FreshnessPolicy(replay_cache=ReplayCache()),
+    )
+    data = etree.tostring(wsse.apply(etree.fromstring(BARE), {})[0])
+
+    wsse.verify(etree.fromstring(data))
+    with pytest.raises(ReplayedMessage):
+        wsse.verify(etree.fromstring(data))
+
+
+def test_verify_injected_timestamp(cert_path, key_path):
+    wsse = ZeepWsse(
+        keyfile=key_path,
+        certfile=cert_path,
+        their_certfile=cert_path,
+        freshness=FreshnessPolicy(replay_cache=ReplayCache()),
+    )
+    doc = wsse.apply(etree.fromstring(BARE), {})[0]
+    # Add a second, unsigned, wsu:Timestamp ahead of the signed one.
+    timestamp = doc.find('.//{*}Timestamp')
+    extra = etree.fromstring(etree.tostring(timestamp))
+    del extra.attrib[extra.keys()[0]]
+    timestamp.getparent().insert(0, extra)
+
+    with pytest.raises(InvalidTimestamp):
+        wsse.verify(etree.fromstring(etree.tostring(doc)))
@@ -0,0 +1,122 @@
+"""Asyncio interface to WS-Security (WSSE) signing and encryption.
+
+Signing, verification, encryption and decryption are CPU-heavy and blocking,
+so calling the ``wsse.signing`` and ``wsse.encryption`` functions directly
+from a coroutine stalls the event loop. ``WsseExecutor`` instead runs them on
+a bounded pool of worker threads (or processes), and returns awaitables.
+
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import cpu_count
+
+import xmlsec
+
+from . import batch
+
+
+class WsseExecutor(object):
+    """Runs WSSE operations for one key pair and partner cert off the loop.
+
+    Our private key and cert are used to sign outgoing and decrypt incoming
+    messages; ``their_certfile`` is used to encrypt outgoing messages and
+    verify incoming ones (all as file paths). Keys and certs are loaded once
+    per worker process, and loaded again when their files change, so a
+    long-lived executor picks up rotated keys. Optionally accepts the
+    ``signature_method`` and ``digest_method`` to sign with (see
+    ``wsse.signing.sign()``), and the ``data_method`` and ``key_transport``
+    to encrypt with (see ``wsse.encryption.encrypt()``).
+
+    At most ``workers`` operations (default: number of CPUs) run at once;
+    further calls wait their turn in the pool's queue. Pass ``processes=True``
+    to run the operations in a process pool rather than a thread pool.
+
+    Each of the ``sign``, ``verify``, ``encrypt``, ``decrypt``, ``protect``
+    and ``unprotect`` methods takes an envelope (string) and returns an
+    awaitable for the result of the corresponding synchronous function::
+
+        executor = WsseExecutor(keyfile, certfile, their_certfile, workers=4)
+
+        async def call(envelope):
+            envelope = await executor.protect(envelope)
+            reply = await send(envelope)
+            return await executor.unprotect(reply)
+
+    Call ``shutdown()`` when finished with the executor.
+
+    """
+    def __init__(self, keyfile, certfile, their_certfile, workers=None,
+                 processes=False,
+                 signature_method=xmlsec.Transform.RSA_SHA1,
+                 digest_method=xmlsec.Transform.SHA1,
+                 data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP):
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.their_certfile = their_certfile
+        self._sign_methods = batch._methods(
+            signature_method=signature_method, digest_method=digest_method)
+        self._encrypt_methods = batch._methods(
+            data_method=data_method, key_transport=key_transport)
+        executor_class = (
+            ProcessPoolExecutor if processes else ThreadPoolExecutor)
+        self.executor = executor_class(max_workers=workers or cpu_count())
+
+    def sign(self, envelope):
+        """Sign given envelope with our key and cert."""
+        return self._run(
+            partial(
+                batch._sign, self.keyfile, self.certfile, self._sign_methods),
+            envelope,
+        )
+
+    def verify(self, envelope):
+        """Verify signature on given envelope with their cert.
+
+        The awaitable raises ``SignatureVerificationFailed`` on failure.
+
+        """
+        return self._run(
+            partial(batch._verify, self.their_certfile), envelope)
+
+    def encrypt(self, envelope):
+        """Encrypt given envelope for their cert."""
+        return self._run(
+            partial(
+                batch._encrypt, self.their_certfile, self._encrypt_methods),
+            envelope,
+        )
+
+    def decrypt(self, envelope):
+        """Decrypt given envelope with our key."""
+        return self._run(partial(batch._decrypt, self.keyfile), envelope)
+
+    def protect(self, envelope):
+        """Sign and then encrypt given (outgoing) envelope."""
+        return self._run(
+            partial(
+                batch._protect,
+                self.keyfile,
+                self.certfile,
+                self.their_certfile,
+                self._sign_methods,
+                self._encrypt_methods,
+            ),
+            envelope,
+        )
+
+    def unprotect(self, envelope):
+        """Decrypt and verify given (incoming) envelope; return decrypted."""
+        return self._run(
+            partial(batch._unprotect, self.keyfile, self.their_certfile),
+            envelope,
+        )
+
+    def shutdown(self, wait=True):
+        """Shut down the worker pool."""
+        self.executor.shutdown(wait=wait)
+
+    def _run(self, func, envelope):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, envelope)
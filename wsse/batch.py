@@ -0,0 +1,249 @@
+"""Functions for signing and encrypting many SOAP envelopes in parallel.
+
+Each function takes an iterable of envelopes (strings), fans the work out over
+a pool of threads or processes, and returns a generator yielding the results
+in the same order as the input envelopes. At most ``window`` envelopes are in
+flight at once, so arbitrarily long (or lazily generated) input iterables can
+be processed in bounded memory.
+
+Keys and certs are loaded once per worker process (and shared by all threads
+in a process), not once per envelope, for each combination of algorithms, and
+loaded again if their files change.
+
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import cpu_count
+import os
+import threading
+
+from lxml import etree
+import xmlsec
+
+from .encryption import Decryptor, Encryptor
+from .signing import Signer, Verifier
+from .xml import fromstring
+
+
+# Maximum number of Signer/Encryptor/etc objects kept by each process.
+CACHE_SIZE = 100
+
+# Per-process cache of Signer/Encryptor/etc objects, keyed by (factory, args,
+# kwargs), least recently used first. Each value is a (file versions, object)
+# tuple; see ``_cached()``.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Every xmlsec.Transform, by its algorithm URI (transforms can't be pickled,
+# so are passed to worker processes by URI).
+_TRANSFORMS = dict(
+    (transform.href, transform)
+    for transform in vars(xmlsec.Transform).values()
+    if isinstance(transform, type(xmlsec.Transform.SHA1)) and transform.href
+)
+
+
+def sign_many(envelopes, keyfile, certfile,
+              signature_method=xmlsec.Transform.RSA_SHA1,
+              digest_method=xmlsec.Transform.SHA1, **kwargs):
+    """Sign given SOAP envelopes in parallel; yield signed envelopes in order.
+
+    See ``map_envelopes()`` for accepted keyword arguments, and
+    ``wsse.signing.sign()`` for details of the signing (and for
+    ``signature_method`` and ``digest_method``).
+
+    """
+    methods = _methods(
+        signature_method=signature_method, digest_method=digest_method)
+    return map_envelopes(
+        partial(_sign, keyfile, certfile, methods), envelopes, **kwargs)
+
+
+def encrypt_many(envelopes, certfile, data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP, **kwargs):
+    """Encrypt given SOAP envelopes in parallel; yield them in order.
+
+    See ``map_envelopes()`` for accepted keyword arguments, and
+    ``wsse.encryption.encrypt()`` for details of the encryption (and for
+    ``data_method`` and ``key_transport``).
+
+    """
+    methods = _methods(data_method=data_method, key_transport=key_transport)
+    return map_envelopes(
+        partial(_encrypt, certfile, methods), envelopes, **kwargs)
+
+
+def protect_many(envelopes, keyfile, certfile, their_certfile,
+                 signature_method=xmlsec.Transform.RSA_SHA1,
+                 digest_method=xmlsec.Transform.SHA1,
+                 data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP, **kwargs):
+    """Sign and then encrypt given SOAP envelopes in parallel.
+
+    Sign with our ``keyfile`` and ``certfile`` (and ``signature_method`` and
+    ``digest_method``), encrypt for ``their_certfile`` (with ``data_method``
+    and ``key_transport``). Each envelope is parsed and serialized only once.
+    Yield protected envelopes in order.
+
+    See ``map_envelopes()`` for accepted keyword arguments.
+
+    """
+    return map_envelopes(
+        partial(
+            _protect,
+            keyfile,
+            certfile,
+            their_certfile,
+            _methods(
+                signature_method=signature_method,
+                digest_method=digest_method,
+            ),
+            _methods(data_method=data_method, key_transport=key_transport),
+        ),
+        envelopes,
+        **kwargs
+    )
+
+
+def map_envelopes(func, envelopes, workers=None, processes=False,
+                  window=None, executor=None):
+    """Apply ``func`` to each envelope in parallel; yield results in order.
+
+    By default, runs on a new pool of ``workers`` threads (default: number of
+    CPUs), which is shut down when the generator is exhausted or closed. Pass
+    ``processes=True`` to use a pool of processes instead (in which case
+    ``func`` and the envelopes must be picklable), or pass an existing
+    ``concurrent.futures.Executor`` as ``executor`` (which will not be shut
+    down).
+
+    At most ``window`` envelopes (default: twice the number of workers) are
+    submitted to the pool at any one time.
+
+    """
+    workers = workers or cpu_count()
+    window = window or 2 * workers
+    if executor is not None:
+        return _map(executor, func, envelopes, window)
+    return _map_pool(
+        ProcessPoolExecutor if processes else ThreadPoolExecutor,
+        workers,
+        func,
+        envelopes,
+        window,
+    )
+
+
+def _map_pool(executor_class, workers, func, envelopes, window):
+    with executor_class(max_workers=workers) as executor:
+        for result in _map(executor, func, envelopes, window):
+            yield result
+
+
+def _map(executor, func, envelopes, window):
+    pending = deque()
+    try:
+        for envelope in envelopes:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, envelope))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # If we stopped early (error, or the generator was closed), don't
+        # waste time on work whose results nobody will see.
+        for future in pending:
+            future.cancel()
+
+
+def _cached(factory, *paths, **kwargs):
+    """Return ``factory(*paths, **kwargs)``, cached in this process.
+
+    ``paths`` are key and cert file paths; the object is created again when
+    any of the files changes. At most ``CACHE_SIZE`` objects are kept, the
+    least recently used being discarded first. The keyword arguments must be
+    hashable.
+
+    """
+    key = (factory, paths, tuple(sorted(kwargs.items())))
+    versions = []
+    for path in paths:
+        stat = os.stat(path)
+        versions.append(
+            (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size))
+    with _cache_lock:
+        cached = _cache.pop(key, None)
+        if cached is not None and cached[0] == versions:
+            # Move to the most recently used end.
+            _cache[key] = cached
+            return cached[1]
+
+    value = factory(*paths, **kwargs)
+    with _cache_lock:
+        _cache[key] = (versions, value)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def _methods(**transforms):
+    """Return given ``xmlsec.Transform`` keyword arguments, picklably.
+
+    Return them as a tuple of (name, algorithm URI) pairs, for
+    ``_transforms()`` to turn back into keyword arguments.
+
+    """
+    return tuple(sorted(
+        (name, transform.href) for name, transform in transforms.items()))
+
+
+def _transforms(methods):
+    """Return dict of ``xmlsec.Transform`` keyword arguments from ``methods``.
+
+    ``methods`` is as returned by ``_methods()``.
+
+    """
+    return dict((name, _TRANSFORMS[href]) for name, href in methods)
+
+
+# Worker functions (also used by ``wsse.aio``). These must be module-level
+# functions, so that they can be pickled for use with a process pool. The
+# algorithms to sign and encrypt with are passed as ``_methods()``.
+
+
+def _sign(keyfile, certfile, methods, envelope):
+    signer = _cached(
+        Signer.from_files, keyfile, certfile, **_transforms(methods))
+    return signer.sign(envelope)
+
+
+def _encrypt(certfile, methods, envelope):
+    encryptor = _cached(Encryptor.from_file, certfile, **_transforms(methods))
+    return encryptor.encrypt(envelope)
+
+
+def _protect(keyfile, certfile, their_certfile, sign_methods,
+             encrypt_methods, envelope):
+    signer = _cached(
+        Signer.from_files, keyfile, certfile, **_transforms(sign_methods))
+    encryptor = _cached(
+        Encryptor.from_file, their_certfile, **_transforms(encrypt_methods))
+    doc = fromstring(envelope)
+    doc = encryptor.encrypt_tree(signer.sign_tree(doc))
+    return etree.tostring(doc)
+
+
+def _verify(certfile, envelope):
+    _cached(Verifier.from_file, certfile).verify(envelope)
+
+
+def _decrypt(keyfile, envelope):
+    return _cached(Decryptor.from_file, keyfile).decrypt(envelope)
+
+
+def _unprotect(keyfile, their_certfile, envelope):
+    decryptor = _cached(Decryptor.from_file, keyfile)
+    verifier = _cached(Verifier.from_file, their_certfile)
+    doc = decryptor.decrypt_tree(fromstring(envelope))
+    verifier.verify_tree(doc)
+    return etree.tostring(doc)
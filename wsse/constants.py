@@ -13,3 +13,12 @@ WSU_NS = WSS_BASE + 'oasis-200401-wss-wssecurity-utility-1.0.xsd'
 
 BASE64B = WSS_BASE + 'oasis-200401-wss-soap-message-security-1.0#Base64Binary'
 X509TOKEN = WSS_BASE + 'oasis-200401-wss-x509-token-profile-1.0#X509v3'
+
+# Prefixes for the above namespaces, as used in XPath expressions.
+NAMESPACES = {
+    'soap': SOAP_NS,
+    'ds': DS_NS,
+    'xenc': ENC_NS,
+    'wsse': WSSE_NS,
+    'wsu': WSU_NS,
+}
@@ -10,21 +10,84 @@ module.
 
 """
 import base64
+from collections import OrderedDict
+import copy
+import os
+import threading
+import time
+from timeit import default_timer
 
 from lxml import etree
 from OpenSSL import crypto
 import xmlsec
 
-from .constants import BASE64B, X509TOKEN, DS_NS, ENC_NS, SOAP_NS, WSSE_NS
-from .xml import ensure_id, ns
-
-
-def encrypt(envelope, certfile):
+from .constants import (
+    BASE64B, X509TOKEN, DS_NS, ENC_NS, NAMESPACES, SOAP_NS, WSSE_NS)
+from .tracing import NULL_TRACER, tracer_from
+from .validation import check_encrypted
+from .xml import ensure_id, fromstring, ns
+
+
+# Session key (xmlsec.KeyData, size in bits) for each data encryption method.
+SESSION_KEY_TYPES = {
+    xmlsec.Transform.DES3: (xmlsec.KeyData.DES, 192),
+    xmlsec.Transform.AES128: (xmlsec.KeyData.AES, 128),
+    xmlsec.Transform.AES192: (xmlsec.KeyData.AES, 192),
+    xmlsec.Transform.AES256: (xmlsec.KeyData.AES, 256),
+}
+# The AES-GCM transforms exist only if python-xmlsec was built against
+# libxmlsec1 1.2.27 or later.
+SESSION_KEY_TYPES.update(
+    (getattr(xmlsec.Transform, 'AES%d_GCM' % bits), (xmlsec.KeyData.AES, bits))
+    for bits in (128, 192, 256)
+    if hasattr(xmlsec.Transform, 'AES%d_GCM' % bits)
+)
+
+# Session xmlsec.KeyData for each data encryption method Algorithm URI.
+SESSION_KEY_DATA = dict(
+    (method.href, key_data)
+    for method, (key_data, key_size) in SESSION_KEY_TYPES.items()
+)
+
+# Maximum number of ``Encryptor`` objects kept for the module functions.
+ENCRYPTOR_CACHE_SIZE = 100
+
+# ``Encryptor`` objects used by the module functions, keyed by cert file path
+# and algorithms (not tracer), least recently used first. Each value is a
+# (file version, encryptor) tuple; see ``_file_encryptor()``.
+_encryptors = OrderedDict()
+_encryptors_lock = threading.Lock()
+
+
+def encrypt(envelope, certfile, targets=None,
+            data_method=xmlsec.Transform.DES3,
+            key_transport=xmlsec.Transform.RSA_OAEP, tracer=None,
+            cert_cache=None):
     """Encrypt body contents of given SOAP envelope using given X509 cert.
 
-    Currently only encrypts the first child node of the body, so doesn't really
-    support a body with multiple child nodes (the later ones won't be
-    encrypted), and doesn't support encryption of multiple nodes.
+    By default, encrypts each child node of the soap:Body. To encrypt other
+    nodes instead, pass ``targets``, a list of XPath expressions (which may
+    use the prefixes in ``wsse.constants.NAMESPACES``) and/or (with
+    ``encrypt_tree()``) elements. The targets must not contain one another.
+    Each target is replaced by its own EncryptedData node, but all are
+    encrypted with the same session key, with a single EncryptedKey node
+    referencing all of them. ``ValueError`` is raised if there's nothing to
+    encrypt (e.g. the targets match no elements), or if a target contains
+    another.
+
+    ``data_method`` is the ``xmlsec.Transform`` used to encrypt the data with
+    a random session key: one of ``DES3`` (the default), ``AES128``,
+    ``AES192``, ``AES256``, ``AES128_GCM``, ``AES192_GCM`` or ``AES256_GCM``
+    (the last three only if XMLSec supports them).
+    ``key_transport`` is the ``xmlsec.Transform`` used to encrypt the session
+    key with the cert: ``RSA_OAEP`` (the default) or ``RSA_PKCS1``.
+
+    ``tracer`` (a ``wsse.tracing.Tracer``) receives timings of each stage of
+    the encryption.
+
+    If ``cert_cache`` (a ``wsse.keys.CertCache``) is given, the parsed cert
+    is taken from (or added to) it, rather than loaded from ``certfile``
+    (which may also be a ``wsse.keys.KeySource``) every time.
 
     Expects to encrypt an incoming document something like this (xmlns
     attributes omitted for readability):
@@ -101,115 +164,539 @@ def encrypt(envelope, certfile):
     encrypting it and for simplicity it's omitted in this example.)
 
     """
-    doc = etree.fromstring(envelope)
-
-    header = doc.find(ns(SOAP_NS, 'Header'))
-    security = header.find(ns(WSSE_NS, 'Security'))
-
-    # Create a keys manager and load the cert into it.
-    manager = xmlsec.KeysManager()
-    key = xmlsec.Key.from_file(certfile, xmlsec.KeyFormat.CERT_PEM, None)
-    manager.add_key(key)
-
-    # Encrypt first child node of the soap:Body.
-    body = doc.find(ns(SOAP_NS, 'Body'))
-    target = body[0]
-
-    # Create the EncryptedData node we will replace the target node with,
-    # and make sure it has the contents XMLSec expects (a CipherValue node,
-    # a KeyInfo node, and an EncryptedKey node within the KeyInfo which
-    # itself has a CipherValue).
-    enc_data = xmlsec.template.encrypted_data_create(
-        doc,
-        xmlsec.Transform.DES3,
-        type=xmlsec.EncryptionType.ELEMENT,
-        ns='xenc',
-    )
-    xmlsec.template.encrypted_data_ensure_cipher_value(enc_data)
-    key_info = xmlsec.template.encrypted_data_ensure_key_info(
-        enc_data, ns='dsig')
-    enc_key = xmlsec.template.add_encrypted_key(
-        key_info, xmlsec.Transform.RSA_OAEP)
-    xmlsec.template.encrypted_data_ensure_cipher_value(enc_key)
-
-    enc_ctx = xmlsec.EncryptionContext(manager)
-    # Generate a per-session DES key (will be encrypted using the cert).
-    enc_ctx.key = xmlsec.Key.generate(
-        xmlsec.KeyData.DES, 192, xmlsec.KeyDataType.SESSION)
-    # Ask XMLSec to actually do the encryption.
-    enc_data = enc_ctx.encrypt_xml(enc_data, target)
-
-    # XMLSec inserts the EncryptedKey node directly within EncryptedData,
-    # but WSSE wants it in the Security header instead, and referencing the
-    # EncryptedData as well as the actual cert in a BinarySecurityToken.
-
-    # Move the EncryptedKey node up into the wsse:Security header.
-    security.insert(0, enc_key)
-
-    # Create a wsse:BinarySecurityToken node containing the cert and add it
-    # to the Security header.
-    cert_bst = create_binary_security_token(certfile)
-    security.insert(0, cert_bst)
-
-    # Create a ds:KeyInfo node referencing the BinarySecurityToken we just
-    # created, and insert it into the EncryptedKey node.
-    enc_key.insert(1, create_key_info_bst(cert_bst))
-
-    # Add a DataReference from the EncryptedKey node to the EncryptedData.
-    add_data_reference(enc_key, enc_data)
-
-    # Remove the now-empty KeyInfo node from EncryptedData (it used to
-    # contain EncryptedKey, but we moved that up into the Security header).
-    enc_data.remove(key_info)
-
-    return etree.tostring(doc)
-
-
-def decrypt(envelope, keyfile):
-    """Decrypt all EncryptedData, using EncryptedKey from Security header.
-
-    EncryptedKey should be a session key encrypted for given ``keyfile``.
+    return _encryptor(
+        certfile,
+        cert_cache,
+        data_method=data_method,
+        key_transport=key_transport,
+        tracer=tracer,
+    ).encrypt(envelope, targets)
+
+
+def encrypt_tree(doc, certfile, targets=None,
+                 data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP, tracer=None,
+                 cert_cache=None):
+    """Encrypt body contents of given SOAP envelope lxml element in place.
+
+    Like ``encrypt()``, but operates on (and returns) a parsed document rather
+    than a string.
+
+    """
+    return _encryptor(
+        certfile,
+        cert_cache,
+        data_method=data_method,
+        key_transport=key_transport,
+        tracer=tracer,
+    ).encrypt_tree(doc, targets)
+
+
+def decrypt(envelope, keyfile, tracer=None, limits=None):
+    """Decrypt all EncryptedData, using EncryptedKeys from Security header.
+
+    Each EncryptedKey should be a session key encrypted for given ``keyfile``.
+    Each is decrypted (unwrapped) only once, and its session key used to
+    decrypt every EncryptedData in its ReferenceList. The encryption
+    algorithms are as declared in the EncryptedKey and EncryptedData (see
+    ``encrypt()`` for those supported).
+
+    ``tracer`` (a ``wsse.tracing.Tracer``) receives timings of each stage of
+    the decryption, including (with ``Tracer.element()``) the time taken to
+    unwrap each EncryptedKey and to decrypt each EncryptedData, with its ID.
+
+    Before loading the key, the envelope's structure is checked with
+    ``wsse.validation.check_encrypted()`` (see ``check_signed()`` there for
+    ``limits``), raising a subclass of ``wsse.exceptions.InvalidEnvelope`` if
+    it's malformed.
 
     Expects XML similar to the example in the ``encrypt`` docstring.
 
     """
-    # Create a key manager and load our key into it.
-    manager = xmlsec.KeysManager()
-    key = xmlsec.Key.from_file(keyfile, xmlsec.KeyFormat.PEM)
-    manager.add_key(key)
-
-    doc = etree.fromstring(envelope)
-    header = doc.find(ns(SOAP_NS, 'Header'))
-    security = header.find(ns(WSSE_NS, 'Security'))
-    enc_key = security.find(ns(ENC_NS, 'EncryptedKey'))
-
-    # Find each referenced encrypted block (each DataReference in the
-    # ReferenceList of the EncryptedKey) and decrypt it.
-    ref_list = enc_key.find(ns(ENC_NS, 'ReferenceList'))
-    for ref in ref_list:
-        # Find the EncryptedData node referenced by this DataReference.
-        ref_uri = ref.get('URI')
-        referenced_id = ref_uri[1:]
-        enc_data = doc.xpath(
-            "//enc:EncryptedData[@Id='%s']" % referenced_id,
-            namespaces={'enc': ENC_NS},
-        )[0]
-
-        # XMLSec doesn't understand WSSE, therefore it doesn't understand
-        # SecurityTokenReference. It expects to find EncryptedKey within the
-        # KeyInfo of the EncryptedData. So we get rid of the
-        # SecurityTokenReference and replace it with the EncryptedKey before
-        # trying to decrypt.
-        key_info = enc_data.find(ns(DS_NS, 'KeyInfo'))
-        key_info.remove(key_info[0])
-        key_info.append(enc_key)
-
-        # When XMLSec decrypts, it automatically replaces the EncryptedData
-        # node with the decrypted contents.
-        ctx = xmlsec.EncryptionContext(manager)
-        ctx.decrypt(enc_data)
-
-    return etree.tostring(doc)
+    tracer = tracer or NULL_TRACER
+    tracer.count('decrypt.bytes_in', len(envelope))
+    with tracer.stage('decrypt.parse'):
+        doc = fromstring(envelope)
+    doc = decrypt_tree(doc, keyfile, tracer=tracer, limits=limits)
+    with tracer.stage('decrypt.serialize'):
+        decrypted = etree.tostring(doc)
+    tracer.count('decrypt.bytes_out', len(decrypted))
+    return decrypted
+
+
+def decrypt_tree(doc, keyfile, tracer=None, limits=None):
+    """Decrypt all EncryptedData in given SOAP envelope lxml element in place.
+
+    Like ``decrypt()``, but operates on (and returns) a parsed document rather
+    than a string.
+
+    """
+    # Reject a malformed envelope before going to the trouble of loading the
+    # key.
+    checked = _check(doc, limits, tracer or NULL_TRACER)
+    Decryptor.from_file(keyfile, tracer=tracer)._decrypt(checked)
+    return doc
+
+
+class Encryptor(object):
+    """Encrypts SOAP envelopes for a recipient cert loaded only once.
+
+    Create an ``Encryptor`` once (with ``from_file()`` or ``from_memory()``)
+    and reuse it to encrypt many envelopes for the same recipient.
+
+    By default, each message is encrypted with a new random session key,
+    which is itself encrypted (wrapped) with the recipient's cert. Wrapping
+    the key is an RSA public-key operation, which can cost more than
+    encrypting the message itself. Pass ``key_reuse_count`` and/or
+    ``key_reuse_seconds`` to instead reuse each session key (and its
+    EncryptedKey node) for up to that many messages and/or seconds, after
+    which a new session key is generated. ``key_reuse_count`` must be at
+    least 1.
+
+    """
+    def __init__(self, key, cert_der, data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP,
+                 key_reuse_count=None, key_reuse_seconds=None, tracer=None):
+        """Create an encryptor for given cert ``xmlsec.Key`` and DER cert data.
+
+        The DER-encoded cert is placed in the BinarySecurityToken of each
+        encrypted message.
+
+        See the ``encrypt()`` function docstring for ``data_method``,
+        ``key_transport`` and ``tracer``.
+
+        """
+        self.tracer = tracer or NULL_TRACER
+        self._managers = _KeysManagers(key)
+        self.cert_der = cert_der
+        # The BinarySecurityToken (apart from its wsu:Id) is the same for
+        # every message, so prepare it once and copy it for each message.
+        self.security_token = _binary_security_token(cert_der)
+        self.data_method = data_method
+        self.key_transport = key_transport
+        try:
+            self.session_key_type = SESSION_KEY_TYPES[data_method]
+        except KeyError:
+            raise ValueError(
+                "Unsupported data encryption method: %s" % data_method.href)
+        if key_reuse_count is not None and key_reuse_count < 1:
+            raise ValueError(
+                "key_reuse_count must be at least 1: %r" % key_reuse_count)
+        self.key_reuse_count = key_reuse_count
+        self.key_reuse_seconds = key_reuse_seconds
+        self._session_key = None
+        self._session_enc_key = None
+        self._session_uses = 0
+        self._session_expires = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, certfile, **kwargs):
+        """Create an encryptor from an X509 cert PEM file path."""
+        with open(certfile, 'rb') as fh:
+            return cls.from_memory(fh.read(), **kwargs)
+
+    @classmethod
+    def from_memory(cls, cert_data, **kwargs):
+        """Create an encryptor from X509 cert PEM data (bytes)."""
+        with tracer_from(kwargs).stage('encrypt.load_key'):
+            key = xmlsec.Key.from_memory(
+                cert_data, xmlsec.KeyFormat.CERT_PEM, None)
+            cert_der = _cert_der(cert_data)
+        return cls(key, cert_der, **kwargs)
+
+    def encrypt(self, envelope, targets=None):
+        """Encrypt body contents (or given targets) of given SOAP envelope.
+
+        See the ``encrypt()`` function docstring for details.
+
+        """
+        tracer = self.tracer
+        tracer.count('encrypt.bytes_in', len(envelope))
+        with tracer.stage('encrypt.parse'):
+            doc = fromstring(envelope)
+        doc = self.encrypt_tree(doc, targets)
+        with tracer.stage('encrypt.serialize'):
+            encrypted = etree.tostring(doc)
+        tracer.count('encrypt.bytes_out', len(encrypted))
+        return encrypted
+
+    def encrypt_tree(self, doc, targets=None):
+        """Encrypt body contents of given SOAP envelope lxml element in place.
+
+        Return the (same) document.
+
+        """
+        header = doc.find(ns(SOAP_NS, 'Header'))
+        security = header.find(ns(WSSE_NS, 'Security'))
+
+        # By default, encrypt each child element of the soap:Body.
+        if targets is None:
+            targets = doc.find(ns(SOAP_NS, 'Body')).findall('*')
+        else:
+            targets = _find_targets(doc, targets)
+        self.tracer.count('encrypt.references', len(targets))
+        if not targets:
+            # Don't silently send the message unencrypted.
+            raise ValueError("Nothing to encrypt.")
+
+        # Get the session key, and an EncryptedKey node containing the
+        # session key encrypted using the cert.
+        session_key, enc_key = self._get_session()
+
+        for target in targets:
+            # Create the EncryptedData node we will replace the target node
+            # with, and make sure it has the contents XMLSec expects (a
+            # CipherValue node).
+            enc_data = xmlsec.template.encrypted_data_create(
+                doc,
+                self.data_method,
+                type=xmlsec.EncryptionType.ELEMENT,
+                ns='xenc',
+            )
+            xmlsec.template.encrypted_data_ensure_cipher_value(enc_data)
+
+            enc_ctx = xmlsec.EncryptionContext()
+            enc_ctx.key = session_key
+            # Ask XMLSec to actually do the encryption.
+            with self.tracer.stage('encrypt.data'):
+                enc_data = enc_ctx.encrypt_xml(enc_data, target)
+
+            # Add a DataReference from the EncryptedKey node to the
+            # EncryptedData.
+            add_data_reference(enc_key, enc_data)
+
+        # WSSE wants the EncryptedKey node in the Security header, and
+        # referencing the EncryptedData nodes as well as the actual cert in a
+        # BinarySecurityToken.
+        security.insert(0, enc_key)
+
+        # Create a wsse:BinarySecurityToken node containing the cert and add
+        # it to the Security header.
+        cert_bst = copy.deepcopy(self.security_token)
+        security.insert(0, cert_bst)
+
+        # Create a ds:KeyInfo node referencing the BinarySecurityToken we just
+        # created, and insert it into the EncryptedKey node.
+        enc_key.insert(1, create_key_info_bst(cert_bst))
+
+        return doc
+
+    def _get_session(self):
+        """Return session key and (a new copy of) its EncryptedKey node.
+
+        Return a new session key unless reusing session keys, in which case
+        return the current session key, unless it has been used too many
+        times or is too old.
+
+        """
+        if self.key_reuse_count is None and self.key_reuse_seconds is None:
+            return self._new_session()
+        with self._lock:
+            now = time.time()
+            if (
+                    self._session_key is None or
+                    self._session_uses == self.key_reuse_count or
+                    self._session_expires <= now):
+                # Rotate: start using a new session key.
+                self._session_key, self._session_enc_key = (
+                    self._new_session())
+                self._session_uses = 0
+                self._session_expires = now + (
+                    float('inf') if self.key_reuse_seconds is None
+                    else self.key_reuse_seconds
+                )
+            self._session_uses += 1
+            session_key = self._session_key
+            enc_key = self._session_enc_key
+        return session_key, copy.deepcopy(enc_key)
+
+    def _new_session(self):
+        """Generate new session key; return it and its EncryptedKey node."""
+        with self.tracer.stage('encrypt.session_key'):
+            return self._generate_session()
+
+    def _generate_session(self):
+        # Create an EncryptedData template containing an EncryptedKey node
+        # within its KeyInfo, and have XMLSec fill it in by encrypting a
+        # placeholder with a new session key. (Some algorithms, e.g. AES-GCM,
+        # refuse to encrypt empty data.) This encrypts the session key using
+        # the cert, and puts the result in the EncryptedKey.
+        enc_data = xmlsec.template.encrypted_data_create(
+            etree.Element(ns(ENC_NS, 'Template')),
+            self.data_method,
+            ns='xenc',
+        )
+        xmlsec.template.encrypted_data_ensure_cipher_value(enc_data)
+        key_info = xmlsec.template.encrypted_data_ensure_key_info(
+            enc_data, ns='dsig')
+        enc_key = xmlsec.template.add_encrypted_key(
+            key_info, self.key_transport)
+        xmlsec.template.encrypted_data_ensure_cipher_value(enc_key)
+
+        enc_ctx = xmlsec.EncryptionContext(self._managers.get())
+        # Generate a per-session key (will be encrypted using the cert).
+        key_data, key_size = self.session_key_type
+        session_key = xmlsec.Key.generate(
+            key_data, key_size, xmlsec.KeyDataType.SESSION)
+        enc_ctx.key = session_key
+        enc_ctx.encrypt_binary(enc_data, b' ')
+
+        # Detach the EncryptedKey (we only need the EncryptedData template
+        # to get XMLSec to fill it in).
+        key_info.remove(enc_key)
+        return session_key, enc_key
+
+
+class Decryptor(object):
+    """Decrypts SOAP envelopes using a private key loaded only once.
+
+    Create a ``Decryptor`` once (with ``from_file()`` or ``from_memory()``)
+    and reuse it to decrypt many envelopes.
+
+    Decrypting (unwrapping) the session key in an EncryptedKey is an RSA
+    private-key operation. If the sender reuses session keys across messages
+    (see ``Encryptor``), pass ``key_cache_size`` to remember up to that many
+    unwrapped session keys (keyed by the EncryptedKey's CipherValue), and so
+    avoid unwrapping the same key again.
+
+    """
+    def __init__(self, key, key_cache_size=None, tracer=None, limits=None):
+        """Create a decryptor for the given ``xmlsec.Key`` (a private key).
+
+        See the ``decrypt()`` function docstring for ``tracer`` and
+        ``limits``.
+
+        """
+        self.tracer = tracer or NULL_TRACER
+        self.limits = limits
+        self._managers = _KeysManagers(key)
+        self.key_cache_size = key_cache_size
+        self.key_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, keyfile, password=None, **kwargs):
+        """Create a decryptor from a private key PEM file path."""
+        with tracer_from(kwargs).stage('decrypt.load_key'):
+            key = xmlsec.Key.from_file(keyfile, xmlsec.KeyFormat.PEM, password)
+        return cls(key, **kwargs)
+
+    @classmethod
+    def from_memory(cls, key_data, password=None, **kwargs):
+        """Create a decryptor from private key PEM data (bytes)."""
+        with tracer_from(kwargs).stage('decrypt.load_key'):
+            key = xmlsec.Key.from_memory(
+                key_data, xmlsec.KeyFormat.PEM, password)
+        return cls(key, **kwargs)
+
+    def decrypt(self, envelope):
+        """Decrypt all EncryptedData in given SOAP envelope.
+
+        See the ``decrypt()`` function docstring for details.
+
+        """
+        tracer = self.tracer
+        tracer.count('decrypt.bytes_in', len(envelope))
+        with tracer.stage('decrypt.parse'):
+            doc = fromstring(envelope)
+        doc = self.decrypt_tree(doc)
+        with tracer.stage('decrypt.serialize'):
+            decrypted = etree.tostring(doc)
+        tracer.count('decrypt.bytes_out', len(decrypted))
+        return decrypted
+
+    def decrypt_tree(self, doc):
+        """Decrypt all EncryptedData in given SOAP envelope lxml element.
+
+        Decrypts in place; return the (same) document.
+
+        """
+        self._decrypt(_check(doc, self.limits, self.tracer))
+        return doc
+
+    def _decrypt(self, checked):
+        """Decrypt the blocks found by ``_check()``."""
+        tracer = self.tracer
+        references = 0
+        for enc_key, blocks in checked:
+            # Unwrap the session key once, for all the blocks it encrypts.
+            start = default_timer()
+            key_bytes = self._unwrap(enc_key)
+            tracer.element(
+                'decrypt.unwrap', enc_key.get('Id'), default_timer() - start)
+
+            # Decrypt each referenced encrypted block (each DataReference in
+            # the ReferenceList of the EncryptedKey).
+            session_keys = {}
+            for referenced_id, enc_data in blocks:
+                start = default_timer()
+                # Get the session key, of the right type for the
+                # EncryptedData's algorithm.
+                method = enc_data.find(ns(ENC_NS, 'EncryptionMethod'))
+                algorithm = method.get('Algorithm')
+                session_key = session_keys.get(algorithm)
+                if session_key is None:
+                    session_key = session_keys[algorithm] = _session_key(
+                        key_bytes, algorithm)
+
+                # XMLSec doesn't understand WSSE, therefore it doesn't
+                # understand any SecurityTokenReference in the KeyInfo of the
+                # EncryptedData. We already have the session key, so just get
+                # rid of it.
+                key_info = enc_data.find(ns(DS_NS, 'KeyInfo'))
+                if key_info is not None:
+                    enc_data.remove(key_info)
+
+                # When XMLSec decrypts, it automatically replaces the
+                # EncryptedData node with the decrypted contents.
+                ctx = xmlsec.EncryptionContext()
+                ctx.key = session_key
+                ctx.decrypt(enc_data)
+                tracer.element(
+                    'decrypt.data', referenced_id, default_timer() - start)
+                references += 1
+
+        tracer.count('decrypt.references', references)
+
+    def _unwrap(self, enc_key):
+        """Decrypt session key in ``enc_key``; return it as raw bytes."""
+        cipher_value = enc_key.find(
+            '%s/%s' % (ns(ENC_NS, 'CipherData'), ns(ENC_NS, 'CipherValue')))
+        cache_key = ''.join(cipher_value.text.split())
+        with self._lock:
+            key_bytes = self.key_cache.get(cache_key)
+            if key_bytes is not None:
+                self.key_cache[cache_key] = self.key_cache.pop(cache_key)
+        if key_bytes is None:
+            # XMLSec returns the decrypted EncryptedKey contents (the raw
+            # session key) as bytes.
+            ctx = xmlsec.EncryptionContext(self._managers.get())
+            key_bytes = ctx.decrypt(enc_key)
+            if self.key_cache_size:
+                with self._lock:
+                    self.key_cache[cache_key] = key_bytes
+                    while len(self.key_cache) > self.key_cache_size:
+                        self.key_cache.popitem(last=False)
+
+        return key_bytes
+
+
+def _encryptor(certfile, cert_cache, **kwargs):
+    """Return an ``Encryptor`` for ``certfile``, from ``cert_cache`` if any."""
+    if cert_cache is not None:
+        return cert_cache.encryptor(certfile, **kwargs)
+    return _file_encryptor(certfile, **kwargs)
+
+
+def _file_encryptor(certfile, tracer=None, **kwargs):
+    """Return ``Encryptor.from_file(certfile, **kwargs)``, loaded only once.
+
+    The encryptor is kept (in ``_encryptors``) and reused, until the file
+    changes, so the cert isn't read and parsed again for every message. It
+    is shared by all callers with the same ``kwargs``, whatever their
+    ``tracer``; each gets a copy reporting to its own.
+
+    """
+    stat = os.stat(certfile)
+    version = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+    key = (certfile, tuple(sorted(kwargs.items())))
+    with _encryptors_lock:
+        cached = _encryptors.pop(key, None)
+        if cached is not None and cached[0] == version:
+            # Move to the most recently used end.
+            _encryptors[key] = cached
+            encryptor = cached[1]
+            if encryptor.tracer is not (tracer or NULL_TRACER):
+                # Shares the loaded cert (and its per-thread keys managers).
+                encryptor = copy.copy(encryptor)
+                encryptor.tracer = tracer or NULL_TRACER
+            return encryptor
+
+    encryptor = Encryptor.from_file(certfile, tracer=tracer, **kwargs)
+    with _encryptors_lock:
+        _encryptors[key] = (version, encryptor)
+        while len(_encryptors) > ENCRYPTOR_CACHE_SIZE:
+            _encryptors.popitem(last=False)
+    return encryptor
+
+
+class _KeysManagers(object):
+    """Per-thread ``xmlsec.KeysManager``, each holding (a copy of) one key.
+
+    XMLSec doesn't promise that a keys manager can safely be used by several
+    threads at once, so each thread that uses an ``Encryptor`` or
+    ``Decryptor`` gets its own, created on first use.
+
+    """
+    def __init__(self, key):
+        self.key = key
+        self._local = threading.local()
+
+    def get(self):
+        """Return this thread's keys manager."""
+        manager = getattr(self._local, 'manager', None)
+        if manager is None:
+            manager = self._local.manager = xmlsec.KeysManager()
+            manager.add_key(self.key)
+        return manager
+
+
+def _check(doc, limits, tracer):
+    """Check structure of encrypted ``doc`` and find the encrypted blocks.
+
+    See ``wsse.validation.check_encrypted()``.
+
+    """
+    with tracer.stage('decrypt.index'):
+        return check_encrypted(doc, limits)
+
+
+def _session_key(key_bytes, algorithm):
+    """Return ``xmlsec.Key`` for raw session key bytes, for ``algorithm``."""
+    try:
+        key_data = SESSION_KEY_DATA[algorithm]
+    except KeyError:
+        raise ValueError(
+            "Unsupported data encryption method: %s" % algorithm)
+    return xmlsec.Key.from_binary_data(key_data, key_bytes)
+
+
+def _find_targets(doc, targets):
+    """Return list of elements in ``doc`` matching given encryption targets.
+
+    Each target is either an element, or an XPath expression (using the
+    prefixes in ``NAMESPACES``) matching any number of elements. An element
+    matched more than once is only listed once.
+
+    Raise ``ValueError`` if a target matches something other than an element,
+    or if one matched element contains another.
+
+    """
+    found = []
+    for target in targets:
+        if hasattr(target, 'tag'):
+            matches = [target]
+        else:
+            matches = doc.xpath(target, namespaces=NAMESPACES)
+        for element in matches:
+            # (Comments and processing instructions have callable tags.)
+            if not etree.iselement(element) or callable(element.tag):
+                raise ValueError(
+                    "Encryption target isn't an element: %r" % (target,))
+            if element not in found:
+                found.append(element)
+
+    # Each target is replaced by its EncryptedData, so one inside another
+    # would be encrypted twice and couldn't be decrypted.
+    chosen = set(found)
+    for element in found:
+        for ancestor in element.iterancestors():
+            if ancestor in chosen:
+                raise ValueError(
+                    "Encryption targets contain one another: %s, %s"
+                    % (ancestor.tag, element.tag))
+    return found
 
 
 def add_data_reference(enc_key, enc_data):
@@ -281,18 +768,29 @@ def create_key_info_bst(security_token):
 def create_binary_security_token(certfile):
     """Create a BinarySecurityToken node containing the x509 certificate.
 
+    The node is prepared from the cert file only once (and again only if the
+    file changes); each call returns a new copy of it.
+
     Modified from https://github.com/mvantellingen/py-soap-wsse.
 
     """
+    return copy.deepcopy(_file_encryptor(certfile).security_token)
+
+
+def _binary_security_token(cert_der):
+    """Create a BinarySecurityToken node containing given DER cert data."""
     # Create the BinarySecurityToken node with appropriate attributes.
     node = etree.Element(ns(WSSE_NS, 'BinarySecurityToken'))
     node.set('EncodingType', BASE64B)
     node.set('ValueType', X509TOKEN)
 
     # Set the node contents.
-    with open(certfile) as fh:
-        cert = crypto.load_certificate(crypto.FILETYPE_PEM, fh.read())
-        node.text = base64.b64encode(
-            crypto.dump_certificate(crypto.FILETYPE_ASN1, cert))
+    node.text = base64.b64encode(cert_der).decode('ascii')
 
     return node
+
+
+def _cert_der(cert_data):
+    """Return DER encoding of given X509 cert PEM data."""
+    cert = crypto.load_certificate(crypto.FILETYPE_PEM, cert_data)
+    return crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
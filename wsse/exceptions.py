@@ -1,2 +1,58 @@
 class SignatureVerificationFailed(Exception):
     pass
+
+
+class UntrustedCertificate(SignatureVerificationFailed):
+    """The signer's cert wasn't issued by a trusted CA, or has expired.
+
+    See ``wsse.trust.TrustStore``.
+
+    """
+
+
+class InvalidEnvelope(Exception):
+    """Envelope doesn't have the structure required for WSSE processing.
+
+    See ``wsse.validation``.
+
+    """
+
+
+class MissingElement(InvalidEnvelope):
+    """A required element (e.g. the wsse:Security header) is missing."""
+
+
+class UnresolvedReference(InvalidEnvelope):
+    """A reference (URI) doesn't identify an element of the right kind."""
+
+
+class LimitExceeded(InvalidEnvelope):
+    """Envelope is nested too deeply or has too many references or keys."""
+
+
+class DuplicateId(InvalidEnvelope):
+    """More than one element in a document has the same (wsu:)Id."""
+
+
+class MessageRejected(SignatureVerificationFailed):
+    """Message rejected by a freshness policy, before checking its signature.
+
+    See ``wsse.freshness.FreshnessPolicy``.
+
+    """
+
+
+class InvalidTimestamp(MessageRejected):
+    """The wsu:Timestamp is missing or can't be parsed."""
+
+
+class ExpiredTimestamp(MessageRejected):
+    """The wsu:Timestamp has expired (or is older than the maximum age)."""
+
+
+class FutureTimestamp(MessageRejected):
+    """The wsu:Timestamp was created in the future."""
+
+
+class ReplayedMessage(MessageRejected):
+    """A message with the same signature has already been accepted."""
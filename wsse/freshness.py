@@ -0,0 +1,283 @@
+"""Cheap rejection of stale and replayed messages, before verification.
+
+Verifying a signature costs an RSA (or ECDSA) operation, as does decrypting
+a message's session key. A ``FreshnessPolicy`` checks the wsu:Timestamp of
+an incoming message, and whether a message with the same signature has been
+seen before, without doing any crypto, so that stale or replayed messages
+(e.g. in a replay flood) can be rejected cheaply.
+
+Pass a policy as ``freshness`` to ``wsse.signing.verify()`` (or
+``Verifier``) or ``WssePlugin``.
+
+"""
+from collections import OrderedDict
+import calendar
+import datetime
+import hashlib
+import re
+import threading
+import time
+
+from .constants import DS_NS, SOAP_NS, WSSE_NS, WSU_NS
+from .exceptions import (
+    ExpiredTimestamp,
+    FutureTimestamp,
+    InvalidTimestamp,
+    ReplayedMessage,
+)
+from .xml import ns
+
+
+_DATETIME_RE = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?'
+    r'(Z|[+-]\d\d:\d\d)?$'
+)
+
+
+class FreshnessPolicy(object):
+    """Rejects expired, future-dated and replayed messages.
+
+    A message is rejected (with a subclass of
+    ``wsse.exceptions.MessageRejected``, itself a subclass of
+    ``SignatureVerificationFailed``) if its wsu:Timestamp:
+
+    * is missing or unparseable (``InvalidTimestamp``);
+    * has a wsu:Expires in the past, or a wsu:Created more than ``max_age``
+      seconds ago (``ExpiredTimestamp``);
+    * has a wsu:Created in the future (``FutureTimestamp``);
+
+    allowing ``max_skew`` seconds (default 300) of clock difference between
+    sender and receiver. If ``require_expires`` is true, a wsu:Expires is
+    also required.
+
+    If a ``replay_cache`` is given (see ``ReplayCache``), a message is also
+    rejected (``ReplayedMessage``) if a message with the same
+    ds:SignatureValue has already been accepted. Messages are remembered
+    until their timestamp expires (or, without wsu:Expires and
+    ``max_age``, for ``replay_seconds``).
+
+    Only a wsu:Timestamp covered by the message's signature counts: a
+    message with more than one wsu:Timestamp, or whose wsu:Timestamp isn't
+    signed, is rejected (``InvalidTimestamp``), so that a stale message
+    can't pass with a fresh timestamp inserted into it.
+
+    The policy counts the messages it has checked and rejected, in
+    ``counts``.
+
+    """
+    def __init__(self, max_skew=300, max_age=None, require_expires=False,
+                 replay_cache=None, replay_seconds=3600, clock=time.time):
+        self.max_skew = max_skew
+        self.max_age = max_age
+        self.require_expires = require_expires
+        self.replay_cache = replay_cache
+        self.replay_seconds = replay_seconds
+        self.clock = clock
+        self.counts = dict.fromkeys(
+            ['checked', 'invalid', 'expired', 'future', 'replayed'], 0)
+        self._lock = threading.Lock()
+
+    def check(self, doc, signed=None):
+        """Check given SOAP envelope lxml element; raise if it's rejected.
+
+        Call this before verifying the signature (or decrypting). Return a
+        token to pass to ``accept()`` once the signature has been verified.
+
+        ``signed`` is the list of elements the signature covers (see
+        ``wsse.validation.check_signed()``), if already known; otherwise it
+        must be passed to ``accept()`` instead.
+
+        """
+        self._count('checked')
+        now = self.clock()
+        timestamp = self._timestamp(doc)
+        if signed is not None:
+            self._check_signed(timestamp, signed)
+        created, expires = self._times(timestamp)
+        skew = self.max_skew
+
+        if created is not None and created > now + skew:
+            self._count('future')
+            raise FutureTimestamp()
+        if expires is not None and expires + skew < now:
+            self._count('expired')
+            raise ExpiredTimestamp()
+        if (self.max_age is not None and created is not None and
+                created + self.max_age + skew < now):
+            self._count('expired')
+            raise ExpiredTimestamp()
+
+        if self.replay_cache is None:
+            return None, None, timestamp
+        key = _signature_key(doc)
+        if key is not None and key in self.replay_cache:
+            self._count('replayed')
+            raise ReplayedMessage()
+
+        # Remember the message until it would be rejected as expired anyway.
+        ends = [now + self.replay_seconds]
+        if expires is not None:
+            ends.append(expires + skew)
+        if self.max_age is not None and created is not None:
+            ends.append(created + self.max_age + skew)
+        return key, min(ends), timestamp
+
+    def accept(self, token, signed=None):
+        """Record that the message checked by ``check()`` was verified.
+
+        Pass the list of elements the signature covers as ``signed``, unless
+        it was passed to ``check()``; raise ``InvalidTimestamp`` if the
+        wsu:Timestamp isn't one of them.
+
+        Raise ``ReplayedMessage`` if a message with the same signature was
+        accepted since it was checked.
+
+        """
+        key, until, timestamp = token
+        if signed is not None:
+            self._check_signed(timestamp, signed)
+        if key is None:
+            return
+        if not self.replay_cache.add(key, until):
+            self._count('replayed')
+            raise ReplayedMessage()
+
+    def _timestamp(self, doc):
+        """Return the one wsu:Timestamp element in ``doc``."""
+        header = doc.find(ns(SOAP_NS, 'Header'))
+        security = (
+            header.find(ns(WSSE_NS, 'Security'))
+            if header is not None else None)
+        timestamps = (
+            security.findall(ns(WSU_NS, 'Timestamp'))
+            if security is not None else [])
+        if not timestamps:
+            self._count('invalid')
+            raise InvalidTimestamp("No wsu:Timestamp.")
+        if len(timestamps) > 1:
+            self._count('invalid')
+            raise InvalidTimestamp("More than one wsu:Timestamp.")
+        return timestamps[0]
+
+    def _check_signed(self, timestamp, signed):
+        """Raise ``InvalidTimestamp`` if ``timestamp`` isn't in ``signed``."""
+        if not any(element is timestamp for element in signed):
+            self._count('invalid')
+            raise InvalidTimestamp("wsu:Timestamp isn't signed.")
+
+    def _times(self, timestamp):
+        """Return (created, expires) of wsu:Timestamp element.
+
+        Either may be None if the element is absent. Times are seconds since
+        the epoch.
+
+        """
+        created = timestamp.findtext(ns(WSU_NS, 'Created'))
+        expires = timestamp.findtext(ns(WSU_NS, 'Expires'))
+        if expires is None and self.require_expires:
+            self._count('invalid')
+            raise InvalidTimestamp("No wsu:Expires.")
+        try:
+            return (
+                None if created is None else parse_datetime(created),
+                None if expires is None else parse_datetime(expires),
+            )
+        except ValueError as e:
+            self._count('invalid')
+            raise InvalidTimestamp(str(e))
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class ReplayCache(object):
+    """In-memory store of recently accepted message signatures.
+
+    Holds at most ``max_size`` entries (default 100000), discarding the
+    least recently added first, and forgets each entry when it expires.
+
+    Any object with the same ``__contains__(key)`` and ``add(key, until)``
+    methods can be used instead as a ``FreshnessPolicy`` replay cache, e.g.
+    to share one between processes (memcached's ``add`` has the right
+    semantics).
+
+    """
+    def __init__(self, max_size=100000, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        """Return whether ``key`` has been added and not yet expired."""
+        with self._lock:
+            until = self._entries.get(key)
+            return until is not None and until > self.clock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, until):
+        """Add ``key``, to expire at ``until`` (seconds since the epoch).
+
+        Return False (without changing anything) if ``key`` is already
+        present and unexpired, else True.
+
+        """
+        now = self.clock()
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing > now:
+                return False
+            self._entries.pop(key, None)
+            self._entries[key] = until
+            self._expire(now)
+        return True
+
+    def _expire(self, now):
+        entries = self._entries
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+        # Entries are (roughly) in expiry order, so stop at the first
+        # unexpired one.
+        while entries:
+            key, until = next(iter(entries.items()))
+            if until > now:
+                break
+            del entries[key]
+
+
+def parse_datetime(value):
+    """Parse an xsd:dateTime string; return seconds since the epoch.
+
+    A time without a timezone is taken to be in UTC.
+
+    """
+    match = _DATETIME_RE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid dateTime: %r" % value)
+    year, month, day, hour, minute, second = (
+        int(part) for part in match.groups()[:6])
+    fraction, zone = match.group(7), match.group(8)
+    seconds = calendar.timegm(datetime.datetime(
+        year, month, day, hour, minute, second).utctimetuple())
+    if fraction:
+        seconds += float(fraction)
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds += -offset if zone[0] == '+' else offset
+    return seconds
+
+
+def _signature_key(doc):
+    """Return digest of the ds:SignatureValue in ``doc``, or None."""
+    value = doc.findtext('/'.join([
+        ns(SOAP_NS, 'Header'),
+        ns(WSSE_NS, 'Security'),
+        ns(DS_NS, 'Signature'),
+        ns(DS_NS, 'SignatureValue'),
+    ]))
+    if value is None:
+        return None
+    return hashlib.sha256(''.join(value.split()).encode('ascii')).digest()
@@ -0,0 +1,302 @@
+"""Loading keys and certs from memory, files or callables, with reloading.
+
+The signing, verification, encryption and decryption objects are created
+from key and cert data, once. If keys are rotated (e.g. in a secrets store),
+a ``KeySource`` supplies the current key or cert data, and a ``Reloader``
+keeps one such object up to date with its sources::
+
+    key = KeySource(secrets.get_private_key, poll_seconds=60)
+    cert = KeySource.from_file('/etc/wsse/cert.pem')
+    signer = Reloader(Signer.from_memory, key, cert)
+
+    signer.get().sign(envelope)
+
+``Reloader.get()`` checks its sources for changes at most every
+``poll_seconds``, and then only cheaply (a file's modification time and size,
+or the fingerprint of a callable's result); only if one has changed is the
+object created again, and then swapped in at once. In-flight messages keep
+using the object they started with.
+
+``WssePlugin`` and ``ZeepWsse`` accept ``KeySource`` objects in place of
+file paths.
+
+To verify and encrypt messages for many parties, each with its own cert, use
+a ``CertCache``, which keeps a bounded number of ``Verifier`` and
+``Encryptor`` objects (each holding a parsed cert) ready for reuse.
+
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+
+from OpenSSL import crypto
+
+from .encryption import Encryptor
+from .signing import Verifier
+
+
+class KeySource(object):
+    """Supplies PEM or DER key or cert data, noticing when it changes.
+
+    ``load()`` returns the current data (bytes). Pass ``poll_seconds`` to
+    check for changes (by calling ``load()`` again, and comparing the data's
+    fingerprint) at most that often; by default (None), the data is loaded
+    once and never changes.
+
+    If ``stat()`` is given, it's called instead when polling, and ``load()``
+    only if its result (e.g. a file's modification time) has changed.
+
+    DER data is converted to PEM, so ``data`` is always PEM.
+
+    """
+    def __init__(self, load, poll_seconds=None, stat=None, clock=time.time):
+        self.load = load
+        self.poll_seconds = poll_seconds
+        self.stat = stat
+        self.clock = clock
+        self.data = None
+        self.fingerprint = None
+        self._stamp = None
+        self._next_poll = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, poll_seconds=1.0, **kwargs):
+        """Create a source reading given file.
+
+        The file is checked for changes (by modification time and size) at
+        most every ``poll_seconds`` (default 1; None to never check).
+
+        """
+        def load():
+            with open(path, 'rb') as fh:
+                return fh.read()
+
+        def stat():
+            st = os.stat(path)
+            return st.st_mtime, st.st_size
+
+        return cls(load, poll_seconds, stat=stat, **kwargs)
+
+    @classmethod
+    def from_memory(cls, data):
+        """Create a source of given (unchanging) data."""
+        return cls(lambda: data)
+
+    def due(self):
+        """Return whether ``poll()`` would check for changes now."""
+        return self.fingerprint is None or (
+            self.poll_seconds is not None and
+            self.clock() >= self._next_poll)
+
+    def poll(self):
+        """Check for changes, if due; update ``data`` and ``fingerprint``.
+
+        Raise if the data can't be loaded (leaving the previous data).
+
+        """
+        with self._lock:
+            if not self.due():
+                return
+            self._next_poll = self.clock() + (self.poll_seconds or 0)
+            if self.stat is not None:
+                stamp = self.stat()
+                if stamp == self._stamp:
+                    return
+            data = self.load()
+            fingerprint = hashlib.sha256(data).digest()
+            if fingerprint != self.fingerprint:
+                self.data = to_pem(data)
+                self.fingerprint = fingerprint
+            if self.stat is not None:
+                self._stamp = stamp
+
+
+class Reloader(object):
+    """Keeps an object created from ``KeySource`` data up to date.
+
+    Calls ``factory(data, ...)`` with the data of each of the ``sources``
+    (e.g. ``Signer.from_memory`` with a key and a cert source), and again
+    whenever any of their data changes. Several reloaders can share a
+    source: whichever polls it first, the others notice the change too.
+
+    """
+    def __init__(self, factory, *sources):
+        self.factory = factory
+        self.sources = sources
+        # The exception from the last failed reload, if any.
+        self.error = None
+        self._lock = threading.Lock()
+        for source in sources:
+            source.poll()
+        self._value = self._create()
+
+    def get(self):
+        """Return the current object, first reloading it if due.
+
+        If another thread is already reloading, don't wait for it; return
+        the current object. If reloading fails, keep the current object (and
+        set ``error``).
+
+        """
+        if (any(source.due() for source in self.sources) or
+                # Another reloader sharing a source may have polled it.
+                self._seen != [source.fingerprint for source in self.sources]):
+            if self._lock.acquire(False):
+                try:
+                    self.reload()
+                finally:
+                    self._lock.release()
+        return self._value
+
+    def reload(self):
+        """Poll the sources, and re-create the object if any has changed."""
+        try:
+            for source in self.sources:
+                source.poll()
+            fingerprints = [source.fingerprint for source in self.sources]
+            # If creating the object fails, don't retry until they change.
+            self._seen = fingerprints
+            if self._fingerprints != fingerprints:
+                # Replacing the attribute is atomic, so other threads see
+                # either the old or the new object.
+                self._value = self._create()
+            self.error = None
+        except Exception as e:
+            self.error = e
+
+    def _create(self):
+        fingerprints = [source.fingerprint for source in self.sources]
+        value = self.factory(*[source.data for source in self.sources])
+        self._fingerprints = self._seen = fingerprints
+        return value
+
+
+class CertCache(object):
+    """Bounded cache of ``Verifier`` and ``Encryptor`` objects, by cert.
+
+    Holds at most ``max_size`` objects (default 1000), discarding the least
+    recently used first, and (if ``ttl`` is given) each for at most ``ttl``
+    seconds after it was created.
+
+    Certs are given as file paths (cached by path, until the file changes)
+    or ``KeySource`` objects (cached by the fingerprint of their data).
+
+    The cache counts ``hits``, ``misses``, ``evictions`` (to make room) and
+    ``expirations`` (after ``ttl``, or because a file changed), in
+    ``counts``.
+
+    """
+    def __init__(self, max_size=1000, ttl=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.counts = dict.fromkeys(
+            ['hits', 'misses', 'evictions', 'expirations'], 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def verifier(self, cert, **kwargs):
+        """Return a ``Verifier`` for given cert (path or ``KeySource``).
+
+        Keyword arguments are passed to ``Verifier.from_memory()``; objects
+        created with different arguments are cached separately.
+
+        """
+        return self.get(Verifier, cert, **kwargs)
+
+    def encryptor(self, cert, **kwargs):
+        """Return an ``Encryptor`` for given cert (path or ``KeySource``).
+
+        See ``verifier()``.
+
+        """
+        return self.get(Encryptor, cert, **kwargs)
+
+    def get(self, cls, source, **kwargs):
+        """Return ``cls.from_memory(data, **kwargs)`` for the given source.
+
+        ``source`` is a file path or ``KeySource``; ``cls`` is e.g.
+        ``Verifier``, ``Encryptor`` or ``Decryptor``.
+
+        """
+        if isinstance(source, KeySource):
+            source.poll()
+            key = (cls, source.fingerprint, _freeze(kwargs))
+            version = None
+        else:
+            stat = os.stat(source)
+            key = (cls, source, _freeze(kwargs))
+            version = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                value, expires, cached_version = entry
+                if expires > now and cached_version == version:
+                    # Move to the most recently used end.
+                    self._entries[key] = entry
+                    self.counts['hits'] += 1
+                    return value
+                self.counts['expirations'] += 1
+            self.counts['misses'] += 1
+
+        if version is None:
+            data = source.data
+        else:
+            with open(source, 'rb') as fh:
+                data = to_pem(fh.read())
+        value = cls.from_memory(data, **kwargs)
+        expires = float('inf') if self.ttl is None else now + self.ttl
+
+        with self._lock:
+            self._entries[key] = (value, expires, version)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counts['evictions'] += 1
+        return value
+
+    def clear(self):
+        """Discard all cached objects."""
+        with self._lock:
+            self._entries.clear()
+
+
+def as_source(value):
+    """Return ``value`` if a ``KeySource``, else a source for file ``value``.
+
+    The file is read only once.
+
+    """
+    if isinstance(value, KeySource):
+        return value
+    return KeySource.from_file(value, poll_seconds=None)
+
+
+def _freeze(kwargs):
+    """Return hashable equivalent of given keyword arguments dict."""
+    return tuple(sorted(
+        (name, tuple(value) if isinstance(value, list) else
+         tuple(sorted(value.items())) if isinstance(value, dict) else value)
+        for name, value in kwargs.items()
+    ))
+
+
+def to_pem(data):
+    """Return given cert or private key data (PEM or DER) as PEM."""
+    if b'-----BEGIN' in data:
+        return data
+    try:
+        return crypto.dump_certificate(
+            crypto.FILETYPE_PEM,
+            crypto.load_certificate(crypto.FILETYPE_ASN1, data))
+    except crypto.Error:
+        return crypto.dump_privatekey(
+            crypto.FILETYPE_PEM,
+            crypto.load_privatekey(crypto.FILETYPE_ASN1, data))
@@ -0,0 +1,145 @@
+"""Keys, certs and processing shared by the Suds and Zeep integrations."""
+from functools import partial
+
+import xmlsec
+
+from .encryption import Decryptor, Encryptor
+from .keys import Reloader, as_source
+from .security import SecurityHeader
+from .signing import Signer, Verifier
+from .tracing import NULL_TRACER
+
+
+class PluginBase(object):
+    """Signs and encrypts outgoing, and decrypts and verifies incoming, SOAP.
+
+    Base class of ``wsse.suds.WssePlugin`` and ``wsse.zeep.ZeepWsse``; see
+    ``WssePlugin`` for the arguments. Holds the ``Signer``, ``Encryptor``,
+    ``Decryptor`` and ``Verifier`` (each reloaded, or looked up in the
+    ``cert_cache``, as needed) and processes parsed (``lxml``) envelopes
+    with them.
+
+    """
+    # Name of the tracer stage timing the freshness check, if any.
+    freshness_stage = None
+
+    def __init__(self, keyfile, certfile, their_certfile,
+                 signature_method=xmlsec.Transform.RSA_SHA1,
+                 digest_method=xmlsec.Transform.SHA1,
+                 data_method=xmlsec.Transform.DES3,
+                 key_transport=xmlsec.Transform.RSA_OAEP,
+                 encrypt_targets=None, tracer=None, freshness=None,
+                 limits=None, timestamp_ttl=None, cert_cache=None,
+                 trust_store=None):
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.their_certfile = their_certfile
+        self.signature_method = signature_method
+        self.digest_method = digest_method
+        self.data_method = data_method
+        self.key_transport = key_transport
+        self.encrypt_targets = encrypt_targets
+        self.tracer = tracer or NULL_TRACER
+        self.freshness = freshness
+        self.security_header = (
+            SecurityHeader(timestamp_ttl) if timestamp_ttl is not None
+            else None)
+
+        key, cert = as_source(keyfile), as_source(certfile)
+        self._get_signer = Reloader(
+            lambda key_data, cert_data: Signer.from_memory(
+                key_data,
+                cert_data,
+                signature_method=signature_method,
+                digest_method=digest_method,
+                tracer=tracer,
+            ),
+            key,
+            cert,
+        ).get
+        self._get_decryptor = Reloader(
+            lambda key_data: Decryptor.from_memory(
+                key_data, tracer=tracer, limits=limits),
+            key,
+        ).get
+
+        encryptor_options = dict(
+            data_method=data_method, key_transport=key_transport,
+            tracer=tracer)
+        verifier_options = dict(tracer=tracer, limits=limits)
+        their_cert = (
+            None if cert_cache is not None else as_source(their_certfile))
+        if cert_cache is not None:
+            # Look their cert up in the (shared) cache for each message.
+            self._get_encryptor = partial(
+                cert_cache.encryptor, their_certfile, **encryptor_options)
+        else:
+            self._get_encryptor = Reloader(
+                partial(Encryptor.from_memory, **encryptor_options),
+                their_cert,
+            ).get
+        if trust_store is not None:
+            # Verify with the signer's cert in each message, if trusted.
+            self._get_verifier = partial(
+                trust_store.verifier, **verifier_options)
+        elif cert_cache is not None:
+            self._get_verifier = partial(
+                cert_cache.verifier, their_certfile, **verifier_options)
+        else:
+            self._get_verifier = Reloader(
+                partial(Verifier.from_memory, **verifier_options),
+                their_cert,
+            ).get
+
+    @property
+    def signer(self):
+        """The current ``Signer`` (reloaded if its key or cert changed)."""
+        return self._get_signer()
+
+    @property
+    def encryptor(self):
+        """The current ``Encryptor``."""
+        return self._get_encryptor()
+
+    @property
+    def decryptor(self):
+        """The current ``Decryptor``."""
+        return self._get_decryptor()
+
+    @property
+    def verifier(self):
+        """The current ``Verifier``."""
+        return self._get_verifier()
+
+    def sign_and_encrypt_tree(self, doc):
+        """Sign and encrypt outgoing envelope (lxml element) in place.
+
+        Return the (same) document.
+
+        """
+        if self.security_header is not None:
+            self.security_header.apply(doc)
+        doc = self.signer.sign_tree(doc)
+        return self.encryptor.encrypt_tree(doc, self.encrypt_targets)
+
+    def decrypt_and_verify_tree(self, doc):
+        """Decrypt and verify signature of incoming envelope, in place.
+
+        Raise ``SignatureVerificationFailed`` (or, for a malformed envelope,
+        ``InvalidEnvelope``) on failure. Return the (same) document.
+
+        """
+        # The wsu:Timestamp isn't encrypted, so we can reject stale and
+        # replayed messages before decrypting as well as verifying.
+        if self.freshness is not None:
+            if self.freshness_stage is None:
+                token = self.freshness.check(doc)
+            else:
+                with self.tracer.stage(self.freshness_stage):
+                    token = self.freshness.check(doc)
+        doc = self.decryptor.decrypt_tree(doc)
+        signed = self.verifier.verify_tree(doc)
+        if self.freshness is not None:
+            # Only now do we know the wsu:Timestamp is signed.
+            self.freshness.accept(token, signed)
+        return doc
@@ -0,0 +1,121 @@
+"""Build the wsse:Security header, with a wsu:Timestamp, in SOAP envelopes.
+
+Signing requires a wsse:Security header containing a wsu:Timestamp. Rather
+than templating them into the envelope string (and parsing it again), use
+``add_security_header()`` (or a reusable ``SecurityHeader``) to insert them
+directly into a parsed envelope, before ``sign_tree()``::
+
+    doc = add_security_header(fromstring(envelope), ttl=300)
+    doc = sign_tree(doc, keyfile, certfile)
+
+"""
+import copy
+import time
+
+from lxml import etree
+
+from .constants import SOAP_NS, WSSE_NS, WSU_NS
+from .exceptions import MissingElement
+from .xml import ns
+
+
+class SecurityHeader(object):
+    """Inserts a wsse:Security header with a fresh wsu:Timestamp.
+
+    The header is built once, as a template, and copied into each envelope
+    with only the timestamp's times filled in.
+
+    """
+    def __init__(self, ttl=300, must_understand=True, clock=time.time):
+        """Create a builder of headers whose timestamps last ``ttl`` seconds.
+
+        The wsu:Expires is ``ttl`` seconds (default 300) after the
+        wsu:Created; if ``ttl`` is None, there is no wsu:Expires. If
+        ``must_understand`` is true (the default), the wsse:Security header
+        has a soap:mustUnderstand="1" attribute. ``clock`` returns the
+        current time in seconds since the epoch (default ``time.time``).
+
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.template = _security_template(ttl is not None, must_understand)
+
+    def apply(self, doc):
+        """Add header (and timestamp) to given SOAP envelope lxml element.
+
+        Create the soap:Header if there isn't one. If it already has a
+        wsse:Security header, add the wsu:Timestamp to that (replacing any
+        existing timestamp).
+
+        Modifies the document in place; return it.
+
+        """
+        if doc.tag != ns(SOAP_NS, 'Envelope'):
+            raise MissingElement('soap:Envelope')
+        security = copy.deepcopy(self.template)
+        timestamp = security[0]
+        now = self.clock()
+        timestamp[0].text = format_datetime(now)
+        if self.ttl is not None:
+            timestamp[1].text = format_datetime(now + self.ttl)
+
+        header = doc.find(ns(SOAP_NS, 'Header'))
+        if header is None:
+            header = etree.Element(ns(SOAP_NS, 'Header'))
+            doc.insert(0, header)
+        existing = header.find(ns(WSSE_NS, 'Security'))
+        if existing is None:
+            header.insert(0, security)
+            return doc
+
+        old = existing.find(ns(WSU_NS, 'Timestamp'))
+        if old is None:
+            existing.insert(0, timestamp)
+        else:
+            existing.replace(old, timestamp)
+        return doc
+
+
+def add_security_header(doc, ttl=300, must_understand=True):
+    """Add wsse:Security header and wsu:Timestamp to SOAP envelope element.
+
+    See ``SecurityHeader`` for details. Modifies the document in place;
+    return it.
+
+    """
+    key = (ttl, must_understand)
+    builder = _builders.get(key)
+    if builder is None:
+        builder = _builders[key] = SecurityHeader(ttl, must_understand)
+    return builder.apply(doc)
+
+
+def format_datetime(seconds):
+    """Format seconds since the epoch as an xsd:dateTime (UTC, to the ms)."""
+    return '%s.%03dZ' % (
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)),
+        int(seconds % 1 * 1000),
+    )
+
+
+# ``SecurityHeader`` for each (ttl, must_understand) used with
+# ``add_security_header()``.
+_builders = {}
+
+
+def _security_template(expires, must_understand):
+    """Create and return a wsse:Security template node.
+
+    It contains a wsu:Timestamp with an empty wsu:Created and (if
+    ``expires``) wsu:Expires.
+
+    """
+    security = etree.Element(
+        ns(WSSE_NS, 'Security'), nsmap={'wsse': WSSE_NS, 'wsu': WSU_NS})
+    if must_understand:
+        security.set(ns(SOAP_NS, 'mustUnderstand'), '1')
+    timestamp = etree.SubElement(security, ns(WSU_NS, 'Timestamp'))
+    etree.SubElement(timestamp, ns(WSU_NS, 'Created'))
+    if expires:
+        etree.SubElement(timestamp, ns(WSU_NS, 'Expires'))
+    return security
@@ -8,15 +8,21 @@ admittedly painful, will likely assist in understanding the code in this
 module.
 
 """
+import copy
+
 from lxml import etree
 import xmlsec
 
 from .constants import DS_NS, SOAP_NS, WSSE_NS, WSU_NS
 from .exceptions import SignatureVerificationFailed
-from .xml import ensure_id, ns
+from .tracing import NULL_TRACER, tracer_from
+from .validation import check_signed
+from .xml import ID_ATTR, ensure_id, fromstring, ns
 
 
-def sign(envelope, keyfile, certfile):
+def sign(envelope, keyfile, certfile,
+         signature_method=xmlsec.Transform.RSA_SHA1,
+         digest_method=xmlsec.Transform.SHA1, tracer=None):
     """Sign given SOAP envelope with WSSE sig using given key and cert.
 
     Sign the wsu:Timestamp node in the wsse:Security header and the soap:Body;
@@ -27,7 +33,15 @@ def sign(envelope, keyfile, certfile):
 
     Use EXCL-C14N transforms to normalize the signed XML (so that irrelevant
     whitespace or attribute ordering changes don't invalidate the
-    signature). Use SHA1 signatures.
+    signature).
+
+    ``signature_method`` and ``digest_method`` are the ``xmlsec.Transform``
+    used for the signature itself and for the digests of the signed nodes;
+    default RSA-SHA1 and SHA1. For example, use ``RSA_SHA256`` and ``SHA256``,
+    or (with an EC key) ``ECDSA_SHA256`` and ``SHA256``.
+
+    ``tracer`` (a ``wsse.tracing.Tracer``) receives timings of each stage of
+    the signing.
 
     Expects to sign an incoming document something like this (xmlns attributes
     omitted for readability):
@@ -104,111 +118,393 @@ def sign(envelope, keyfile, certfile):
     </soap:Envelope>
 
     """
-    doc = etree.fromstring(envelope)
+    return Signer.from_files(
+        keyfile,
+        certfile,
+        signature_method=signature_method,
+        digest_method=digest_method,
+        tracer=tracer,
+    ).sign(envelope)
 
-    # Create the Signature node.
-    signature = xmlsec.template.create(
+
+def sign_tree(doc, keyfile, certfile,
+              signature_method=xmlsec.Transform.RSA_SHA1,
+              digest_method=xmlsec.Transform.SHA1, tracer=None):
+    """Sign given SOAP envelope lxml element in place; return it.
+
+    Like ``sign()``, but operates on a parsed document rather than a string.
+
+    """
+    return Signer.from_files(
+        keyfile,
+        certfile,
+        signature_method=signature_method,
+        digest_method=digest_method,
+        tracer=tracer,
+    ).sign_tree(doc)
+
+
+def verify(envelope, certfile, signature_methods=None, digest_methods=None,
+           tracer=None, freshness=None, limits=None, cert_cache=None,
+           trust_store=None):
+    """Verify WS-Security signature on given SOAP envelope with given cert.
+
+    Expects a document like that found in the sample XML in the ``sign()``
+    docstring.
+
+    Any signature and digest algorithms supported by XMLSec are accepted,
+    unless ``signature_methods`` and/or ``digest_methods`` (lists of
+    ``xmlsec.Transform``) are given, in which case signatures using any other
+    algorithms are rejected.
+
+    ``tracer`` (a ``wsse.tracing.Tracer``) receives timings of each stage of
+    the verification.
+
+    If ``freshness`` (a ``wsse.freshness.FreshnessPolicy``) is given, stale
+    and replayed messages are rejected (with a subclass of
+    ``SignatureVerificationFailed``) before the signature is verified.
+
+    Before loading the cert, the envelope's structure is checked with
+    ``wsse.validation.check_signed()`` (see there for ``limits``), raising a
+    subclass of ``wsse.exceptions.InvalidEnvelope`` if it's malformed.
+
+    If ``cert_cache`` (a ``wsse.keys.CertCache``) is given, the parsed cert
+    is taken from (or added to) it, rather than loaded from ``certfile``
+    (which may also be a ``wsse.keys.KeySource``) every time.
+
+    If ``trust_store`` (a ``wsse.trust.TrustStore``) is given, ``certfile``
+    is ignored (pass None); instead the signature is verified with the
+    signer's cert carried in the envelope, which must have been issued by
+    one of the trust store's CAs (else ``UntrustedCertificate`` is raised).
+
+    Raise SignatureValidationFailed on failure, silent on success.
+
+    """
+    tracer = tracer or NULL_TRACER
+    tracer.count('verify.bytes_in', len(envelope))
+    with tracer.stage('verify.parse'):
+        doc = fromstring(envelope)
+    verify_tree(
         doc,
-        xmlsec.Transform.EXCL_C14N,
-        xmlsec.Transform.RSA_SHA1,
+        certfile,
+        signature_methods=signature_methods,
+        digest_methods=digest_methods,
+        tracer=tracer,
+        freshness=freshness,
+        limits=limits,
+        cert_cache=cert_cache,
+        trust_store=trust_store,
     )
 
-    # Add a KeyInfo node with X509Data child to the Signature. XMLSec will fill
-    # in this template with the actual certificate details when it signs.
-    key_info = xmlsec.template.ensure_key_info(signature)
-    x509_data = xmlsec.template.add_x509_data(key_info)
-    x509_issuer_serial = etree.Element(ns(DS_NS, 'X509IssuerSerial'))
-    x509_data.append(x509_issuer_serial)
-    x509_certificate = etree.Element(ns(DS_NS, 'X509Certificate'))
-    x509_data.append(x509_certificate)
 
-    # Load the signing key and certificate.
-    key = xmlsec.Key.from_file(keyfile, xmlsec.KeyFormat.PEM)
-    key.load_cert_from_file(certfile, xmlsec.KeyFormat.PEM)
+def verify_tree(doc, certfile, signature_methods=None, digest_methods=None,
+                tracer=None, freshness=None, limits=None, cert_cache=None,
+                trust_store=None):
+    """Verify WS-Security signature on given SOAP envelope lxml element.
 
-    # Insert the Signature node in the wsse:Security header.
-    header = doc.find(ns(SOAP_NS, 'Header'))
-    security = header.find(ns(WSSE_NS, 'Security'))
-    security.insert(0, signature)
+    Like ``verify()``, but operates on a parsed document rather than a string.
 
-    # Perform the actual signing.
-    ctx = xmlsec.SignatureContext()
-    ctx.key = key
-    _sign_node(ctx, signature, doc.find(ns(SOAP_NS, 'Body')))
-    _sign_node(ctx, signature, security.find(ns(WSU_NS, 'Timestamp')))
-    ctx.sign(signature)
+    """
+    # Reject a malformed envelope before going to the trouble of loading the
+    # cert.
+    checked = _check(doc, limits, tracer or NULL_TRACER)
+    _verifier(
+        certfile,
+        cert_cache,
+        trust_store,
+        signature_methods=signature_methods,
+        digest_methods=digest_methods,
+        tracer=tracer,
+        freshness=freshness,
+    )._verify(doc, checked)
+
+
+class Signer(object):
+    """Signs SOAP envelopes using a private key and cert loaded only once.
+
+    Parsing the PEM private key is a significant part of the cost of signing a
+    message, so if you sign many messages with the same key, create a
+    ``Signer`` once (with ``from_files()`` or ``from_memory()``) and reuse it.
 
-    # Place the X509 data inside a WSSE SecurityTokenReference within
-    # KeyInfo. The recipient expects this structure, but we can't rearrange
-    # like this until after signing, because otherwise xmlsec won't populate
-    # the X509 data (because it doesn't understand WSSE).
-    sec_token_ref = etree.SubElement(
-        key_info, ns(WSSE_NS, 'SecurityTokenReference'))
-    sec_token_ref.append(x509_data)
+    """
+    def __init__(self, key, signature_method=xmlsec.Transform.RSA_SHA1,
+                 digest_method=xmlsec.Transform.SHA1, tracer=None):
+        """Create a signer for the given ``xmlsec.Key``.
+
+        The key must be a private key with its X509 certificate already loaded.
+
+        See the ``sign()`` function docstring for ``signature_method``,
+        ``digest_method`` and ``tracer``.
+
+        """
+        self.key = key
+        self.tracer = tracer or NULL_TRACER
+        # The ds:Signature skeleton is the same for every message (only the
+        # Reference URIs and digest values differ), so build it once and copy
+        # it for each message.
+        self.template = _signature_template(
+            2, signature_method, digest_method)
+
+    @classmethod
+    def from_files(cls, keyfile, certfile, password=None, **kwargs):
+        """Create a signer from private key and cert PEM file paths."""
+        with tracer_from(kwargs).stage('sign.load_key'):
+            key = xmlsec.Key.from_file(
+                keyfile, xmlsec.KeyFormat.PEM, password)
+            key.load_cert_from_file(certfile, xmlsec.KeyFormat.PEM)
+        return cls(key, **kwargs)
+
+    @classmethod
+    def from_memory(cls, key_data, cert_data, password=None, **kwargs):
+        """Create a signer from private key and cert PEM data (bytes)."""
+        with tracer_from(kwargs).stage('sign.load_key'):
+            key = xmlsec.Key.from_memory(
+                key_data, xmlsec.KeyFormat.PEM, password)
+            key.load_cert_from_memory(cert_data, xmlsec.KeyFormat.PEM)
+        return cls(key, **kwargs)
+
+    def sign(self, envelope):
+        """Sign given SOAP envelope; return signed envelope.
+
+        See the ``sign()`` function docstring for details.
+
+        """
+        tracer = self.tracer
+        tracer.count('sign.bytes_in', len(envelope))
+        with tracer.stage('sign.parse'):
+            doc = fromstring(envelope)
+        doc = self.sign_tree(doc)
+        with tracer.stage('sign.serialize'):
+            signed = etree.tostring(doc)
+        tracer.count('sign.bytes_out', len(signed))
+        return signed
+
+    def sign_tree(self, doc):
+        """Sign given SOAP envelope lxml element in place; return it."""
+        tracer = self.tracer
+        with tracer.stage('sign.template'):
+            # Stamp out a copy of the Signature node skeleton. The KeyInfo
+            # node has an X509Data child, which XMLSec will fill in with the
+            # actual certificate details when it signs.
+            signature = copy.deepcopy(self.template)
+            refs = signature.iterfind(
+                '%s/%s' % (ns(DS_NS, 'SignedInfo'), ns(DS_NS, 'Reference')))
+            key_info = signature.find(ns(DS_NS, 'KeyInfo'))
+            x509_data = key_info.find(ns(DS_NS, 'X509Data'))
+
+            # Insert the Signature node in the wsse:Security header.
+            header = doc.find(ns(SOAP_NS, 'Header'))
+            security = header.find(ns(WSSE_NS, 'Security'))
+            security.insert(0, signature)
+
+            ctx = xmlsec.SignatureContext()
+            ctx.key = self.key
+            _sign_node(ctx, next(refs), doc.find(ns(SOAP_NS, 'Body')))
+            _sign_node(
+                ctx, next(refs), security.find(ns(WSU_NS, 'Timestamp')))
+        tracer.count('sign.references', 2)
+
+        # Perform the actual signing.
+        with tracer.stage('sign.xmlsec'):
+            ctx.sign(signature)
+
+        # Place the X509 data inside a WSSE SecurityTokenReference within
+        # KeyInfo. The recipient expects this structure, but we can't
+        # rearrange like this until after signing, because otherwise xmlsec
+        # won't populate the X509 data (because it doesn't understand WSSE).
+        with tracer.stage('sign.key_info'):
+            sec_token_ref = etree.SubElement(
+                key_info, ns(WSSE_NS, 'SecurityTokenReference'))
+            sec_token_ref.append(x509_data)
+
+        return doc
+
+
+class Verifier(object):
+    """Verifies WSSE signatures using a cert loaded only once.
+
+    Create a ``Verifier`` once (with ``from_file()`` or ``from_memory()``) and
+    reuse it to verify many envelopes signed by the same party.
 
-    return etree.tostring(doc)
+    """
+    def __init__(self, key, signature_methods=None, digest_methods=None,
+                 tracer=None, freshness=None, limits=None):
+        """Create a verifier for the given ``xmlsec.Key`` (a public key).
+
+        See the ``verify()`` function docstring for ``signature_methods``,
+        ``digest_methods``, ``tracer``, ``freshness`` and ``limits``.
+
+        """
+        self.key = key
+        self.tracer = tracer or NULL_TRACER
+        self.freshness = freshness
+        self.limits = limits
+        self.signature_methods = signature_methods
+        self.digest_methods = digest_methods
+
+    @classmethod
+    def from_file(cls, certfile, **kwargs):
+        """Create a verifier from an X509 cert PEM file path."""
+        with tracer_from(kwargs).stage('verify.load_key'):
+            key = xmlsec.Key.from_file(
+                certfile, xmlsec.KeyFormat.CERT_PEM, None)
+        return cls(key, **kwargs)
+
+    @classmethod
+    def from_memory(cls, cert_data, **kwargs):
+        """Create a verifier from X509 cert PEM data (bytes)."""
+        with tracer_from(kwargs).stage('verify.load_key'):
+            key = xmlsec.Key.from_memory(
+                cert_data, xmlsec.KeyFormat.CERT_PEM, None)
+        return cls(key, **kwargs)
+
+    def verify(self, envelope):
+        """Verify WS-Security signature on given SOAP envelope.
+
+        See the ``verify()`` function docstring for details.
+
+        """
+        self.tracer.count('verify.bytes_in', len(envelope))
+        with self.tracer.stage('verify.parse'):
+            doc = fromstring(envelope)
+        self.verify_tree(doc)
+
+    def verify_tree(self, doc):
+        """Verify WS-Security signature on given SOAP envelope lxml element.
+
+        Return the list of elements the signature covers.
+
+        """
+        return self._verify(doc, _check(doc, self.limits, self.tracer))
+
+    def _verify(self, doc, checked):
+        """Verify signature on ``doc``, given ``_check(doc)`` result.
+
+        Return the signed elements.
+
+        """
+        signature, targets = checked
+
+        # Reject stale and replayed messages before doing anything costly.
+        if self.freshness is not None:
+            with self.tracer.stage('verify.freshness'):
+                token = self.freshness.check(doc, signed=targets)
+
+        # Register the ID of each signed element with the signing context.
+        # A reference may be to a wsu:Id or a plain Id (see
+        # ``check_signed()``), so register whichever the element has.
+        ctx = xmlsec.SignatureContext()
+        for target in targets:
+            if target.get(ID_ATTR) is not None:
+                ctx.register_id(target, 'Id', WSU_NS)
+            if target.get('Id') is not None:
+                ctx.register_id(target, 'Id')
+        self.tracer.count('verify.references', len(targets))
+
+        ctx.key = self._key(signature)
+
+        # Restrict the accepted algorithms, if requested. (Enabling any
+        # transform disables all those not enabled, so we must also enable
+        # the EXCL-C14N transform used in both places.)
+        if self.signature_methods is not None:
+            for transform in self.signature_methods:
+                ctx.enable_signature_transform(transform)
+            ctx.enable_signature_transform(xmlsec.Transform.EXCL_C14N)
+        if self.digest_methods is not None:
+            for transform in self.digest_methods:
+                ctx.enable_reference_transform(transform)
+            ctx.enable_reference_transform(xmlsec.Transform.EXCL_C14N)
+
+        try:
+            with self.tracer.stage('verify.xmlsec'):
+                ctx.verify(signature)
+        except xmlsec.Error:
+            # Sadly xmlsec gives us no details about the reason for the
+            # failure, so we have nothing to pass on except that verification
+            # failed.
+            raise SignatureVerificationFailed()
+
+        if self.freshness is not None:
+            self.freshness.accept(token)
+        return targets
+
+    def _key(self, signature):
+        """Return the ``xmlsec.Key`` to verify ds:Signature node with."""
+        return self.key
+
+
+def _verifier(certfile, cert_cache, trust_store, **kwargs):
+    """Return a ``Verifier`` for ``certfile``, from ``cert_cache`` if any.
+
+    Or, given a ``trust_store``, a ``TrustedVerifier`` from it.
 
+    """
+    if trust_store is not None:
+        return trust_store.verifier(**kwargs)
+    if cert_cache is not None:
+        return cert_cache.verifier(certfile, **kwargs)
+    return Verifier.from_file(certfile, **kwargs)
 
-def verify(envelope, certfile):
-    """Verify WS-Security signature on given SOAP envelope with given cert.
 
-    Expects a document like that found in the sample XML in the ``sign()``
-    docstring.
+def _check(doc, limits, tracer):
+    """Check structure of signed ``doc`` and find the signed elements.
 
-    Raise SignatureValidationFailed on failure, silent on success.
+    See ``wsse.validation.check_signed()``.
 
     """
-    doc = etree.fromstring(envelope)
-    header = doc.find(ns(SOAP_NS, 'Header'))
-    security = header.find(ns(WSSE_NS, 'Security'))
-    signature = security.find(ns(DS_NS, 'Signature'))
-
-    ctx = xmlsec.SignatureContext()
-
-    # Find each signed element and register its ID with the signing context.
-    refs = signature.xpath(
-        'ds:SignedInfo/ds:Reference', namespaces={'ds': DS_NS})
-    for ref in refs:
-        # Get the reference URI and cut off the initial '#'
-        referenced_id = ref.get('URI')[1:]
-        referenced = doc.xpath(
-            "//*[@wsu:Id='%s']" % referenced_id,
-            namespaces={'wsu': WSU_NS},
-        )[0]
-        ctx.register_id(referenced, 'Id', WSU_NS)
-
-    key = xmlsec.Key.from_file(certfile, xmlsec.KeyFormat.CERT_PEM, None)
-    ctx.key = key
-
-    try:
-        ctx.verify(signature)
-    except xmlsec.Error:
-        # Sadly xmlsec gives us no details about the reason for the failure, so
-        # we have nothing to pass on except that verification failed.
-        raise SignatureVerificationFailed()
-
-
-def _sign_node(ctx, signature, target):
-    """Add sig for ``target`` in ``signature`` node, using ``ctx`` context.
+    with tracer.stage('verify.index'):
+        return check_signed(doc, limits)
+
+
+def _signature_template(reference_count, signature_method, digest_method):
+    """Create and return a ds:Signature template node.
+
+    The template has ``reference_count`` Reference nodes (without URI
+    attributes), and a KeyInfo node with X509Data child (containing empty
+    X509IssuerSerial and X509Certificate nodes), ready for XMLSec to fill in.
+
+    """
+    # Create the Signature node.
+    signature = xmlsec.template.create(
+        etree.Element(ns(DS_NS, 'Template')),
+        xmlsec.Transform.EXCL_C14N,
+        signature_method,
+    )
+
+    for i in range(reference_count):
+        ref = xmlsec.template.add_reference(signature, digest_method)
+        # This is an XML normalization transform which will be performed on
+        # the target node contents before signing. This ensures that changes
+        # to irrelevant whitespace, attribute ordering, etc won't invalidate
+        # the signature.
+        xmlsec.template.add_transform(ref, xmlsec.Transform.EXCL_C14N)
+
+    # Add a KeyInfo node with X509Data child to the Signature.
+    key_info = xmlsec.template.ensure_key_info(signature)
+    x509_data = xmlsec.template.add_x509_data(key_info)
+    x509_issuer_serial = etree.Element(ns(DS_NS, 'X509IssuerSerial'))
+    x509_data.append(x509_issuer_serial)
+    x509_certificate = etree.Element(ns(DS_NS, 'X509Certificate'))
+    x509_data.append(x509_certificate)
+
+    return signature
+
+
+def _sign_node(ctx, ref, target):
+    """Point Reference node ``ref`` at ``target``, using ``ctx`` context.
 
     Doesn't actually perform the signing; ``ctx.sign(signature)`` should be
     called later to do that.
 
-    Adds a Reference node to the signature with URI attribute pointing to the
+    Sets the URI attribute of the (template) Reference node to point to the
     target node, and registers the target node's ID so XMLSec will be able to
     find the target node by ID when it signs.
 
     """
     # Ensure the target node has a wsu:Id attribute and get its value.
     node_id = ensure_id(target)
-    # Add reference to signature with URI attribute pointing to that ID.
-    ref = xmlsec.template.add_reference(
-        signature, xmlsec.Transform.SHA1, uri='#' + node_id)
-    # This is an XML normalization transform which will be performed on the
-    # target node contents before signing. This ensures that changes to
-    # irrelevant whitespace, attribute ordering, etc won't invalidate the
-    # signature.
-    xmlsec.template.add_transform(ref, xmlsec.Transform.EXCL_C14N)
+    # Point the reference URI attribute at that ID.
+    ref.set('URI', '#' + node_id)
     # Unlike HTML, XML doesn't have a single standardized Id. WSSE suggests the
     # use of the wsu:Id attribute for this purpose, but XMLSec doesn't
     # understand that natively. So for XMLSec to be able to find the referenced
@@ -1,13 +1,14 @@
 """Suds plugin for WS-Security (WSSE) encryption/signing."""
 from __future__ import absolute_import
 
+from lxml import etree
 from suds.plugin import MessagePlugin
 
-from .encryption import encrypt, decrypt
-from .signing import sign, verify
+from .plugin import PluginBase
+from .xml import fromstring
 
 
-class WssePlugin(MessagePlugin):
+class WssePlugin(PluginBase, MessagePlugin):
     """Suds message plugin that performs WS-Security signing and encryption.
 
     Encrypts and signs outgoing messages (the soap:Body and the wsu:Timestamp
@@ -15,7 +16,42 @@ class WssePlugin(MessagePlugin):
     incoming messages.
 
     Uses X509 certificates for both encryption and signing. Requires our cert
-    and its private key, and their cert (all as file paths).
+    and its private key, and their cert (all as file paths). Optionally
+    accepts the ``signature_method`` and ``digest_method`` to sign with (see
+    ``wsse.signing.sign()``), and the ``data_method`` and ``key_transport`` to
+    encrypt with (see ``wsse.encryption.encrypt()``), and the
+    ``encrypt_targets`` to encrypt (XPath expressions; by default each child
+    element of the soap:Body).
+
+    The keys and certs are loaded once, when the plugin is created (so
+    changes to the files later have no effect). To load them from memory or
+    elsewhere, or to reload them when they change, pass ``wsse.keys.KeySource``
+    objects instead of file paths. If you talk to many parties, each with its
+    own cert (and so each with its own plugin), pass a shared
+    ``wsse.keys.CertCache`` as ``cert_cache`` to keep only a bounded number of
+    their certs loaded. To accept replies signed with any cert issued by a
+    trusted CA, pass a ``wsse.trust.TrustStore`` as ``trust_store`` (their
+    cert is then still needed, but only to encrypt).
+
+    One plugin (and so one Suds client) can be used by several threads at
+    once: each message is processed with its own XMLSec contexts, and any
+    XMLSec state that persists between messages is kept per thread.
+
+    Pass a ``wsse.tracing.Tracer`` as ``tracer`` to receive timings of each
+    stage of the signing, encryption, decryption and verification (and of
+    the ``sending.parse``, ``sending.serialize``, ``received.parse`` and
+    ``received.serialize`` stages of the plugin itself), e.g. to forward
+    them to a metrics system.
+
+    Pass ``timestamp_ttl`` (seconds) to insert the wsse:Security header and
+    a fresh wsu:Timestamp, expiring after that long, into each outgoing
+    message (see ``wsse.security``), rather than building them into the
+    message yourself.
+
+    Pass a ``wsse.freshness.FreshnessPolicy`` as ``freshness`` to reject
+    stale and replayed incoming messages before decrypting them, and
+    ``limits`` (see ``wsse.validation.check_signed()``) to change the limits
+    on the structure of incoming messages.
 
     Expects to sign and encrypt an outgoing SOAP message looking something like
     this (xmlns attributes omitted for readability):
@@ -35,23 +71,32 @@ class WssePlugin(MessagePlugin):
     </soap:Envelope>
 
     The contents of the soap:Body element are specific to the receiving API;
-    nothing in ``py-wsse`` knows or cares about them (except that currently
-    only the first child element of the soap:Body will be encrypted).
+    nothing in ``py-wsse`` knows or cares about them.
 
     """
-    def __init__(self, keyfile, certfile, their_certfile):
-        self.keyfile = keyfile
-        self.certfile = certfile
-        self.their_certfile = their_certfile
+    # Time the freshness check, as part of the plugin's own processing.
+    freshness_stage = 'received.freshness'
 
     def sending(self, context):
         """Sign and encrypt outgoing message envelope."""
-        context.envelope = sign(
-            context.envelope, self.keyfile, self.certfile)
-        context.envelope = encrypt(context.envelope, self.their_certfile)
+        tracer = self.tracer
+        tracer.count('sending.bytes_in', len(context.envelope))
+        # Parse and serialize only once for both signing and encryption.
+        with tracer.stage('sending.parse'):
+            doc = fromstring(context.envelope)
+        doc = self.sign_and_encrypt_tree(doc)
+        with tracer.stage('sending.serialize'):
+            context.envelope = etree.tostring(doc)
+        tracer.count('sending.bytes_out', len(context.envelope))
 
     def received(self, context):
         """Decrypt and verify signature of incoming reply envelope."""
         if context.reply:
-            context.reply = decrypt(context.reply, self.keyfile)
-            verify(context.reply, self.their_certfile)
+            tracer = self.tracer
+            tracer.count('received.bytes_in', len(context.reply))
+            with tracer.stage('received.parse'):
+                doc = fromstring(context.reply)
+            doc = self.decrypt_and_verify_tree(doc)
+            with tracer.stage('received.serialize'):
+                context.reply = etree.tostring(doc)
+            tracer.count('received.bytes_out', len(context.reply))
@@ -0,0 +1,142 @@
+"""Timing and counting instrumentation for WS-Security (WSSE) operations.
+
+The signing, verification, encryption and decryption objects (and functions,
+and ``WssePlugin``) accept a ``tracer``, to which they report how long each
+internal stage of an operation took, and counts such as the number of bytes
+in and out and the number of references. By default they use ``NULL_TRACER``,
+which ignores everything at negligible cost.
+
+To forward the measurements to a metrics system, create a ``Tracer`` with
+callbacks::
+
+    tracer = Tracer(
+        on_duration=lambda name, seconds: statsd.timing(name, seconds * 1000),
+        on_count=lambda name, value: statsd.histogram(name, value),
+    )
+    signer = Signer.from_files(keyfile, certfile, tracer=tracer)
+
+or subclass ``Tracer`` and override ``duration()`` and ``count()``.
+
+Stages that work on one element at a time (``decrypt.unwrap`` and
+``decrypt.data``) are reported with ``element()``, which also receives the
+element's ID (e.g. to find the slowest block of a message); by default it
+passes the duration on to ``duration()``, and to the ``on_element(name, id,
+seconds)`` callback, if given.
+
+Names are ``<operation>.<stage>``, where operation is one of ``sign``,
+``verify``, ``encrypt`` or ``decrypt`` (or ``sending`` or ``received``, for
+``WssePlugin``'s own parsing and serialization). The stages are:
+
+* ``load_key``: loading the key and/or cert (once per object).
+* ``parse``: parsing the envelope string (not for ``_tree`` variants).
+* ``template`` (sign): copying the ds:Signature skeleton into the envelope.
+* ``freshness`` (verify): checking the wsu:Timestamp and replay cache, if
+  given a ``wsse.freshness.FreshnessPolicy``.
+* ``index`` (verify, decrypt): checking the envelope's structure and finding
+  elements by ID (see ``wsse.validation``). The ``verify`` and ``decrypt``
+  functions do this before ``load_key``.
+* ``trust`` (verify): finding the signer's cert in the envelope and checking
+  it against a ``wsse.trust.TrustStore`` (or finding it in its cache), if
+  given one.
+* ``xmlsec`` (sign, verify): XMLSec's canonicalization, digesting and
+  signature (RSA or ECDSA) operation, which can't be timed separately.
+* ``key_info`` (sign): rearranging the KeyInfo for WSSE.
+* ``session_key`` (encrypt): generating and wrapping a new session key (an
+  RSA operation; skipped when reusing session keys).
+* ``unwrap`` (decrypt): unwrapping a session key (an RSA operation; once per
+  EncryptedKey, unless cached).
+* ``data`` (encrypt, decrypt): encrypting or decrypting one block.
+* ``serialize``: serializing the envelope to a string (not for ``_tree``
+  variants).
+
+The counts are ``bytes_in`` and ``bytes_out`` (envelope sizes, when given or
+returning strings) and ``references`` (signed or encrypted elements).
+
+"""
+from timeit import default_timer
+
+
+class Tracer(object):
+    """Receives stage durations and counts from WSSE operations.
+
+    Pass ``on_duration(name, seconds)``, ``on_count(name, value)`` and/or
+    ``on_element(name, id, seconds)`` callbacks, or subclass and override
+    ``duration()``, ``count()`` and ``element()``.
+
+    """
+    # Defaults for subclasses that don't call ``__init__()``.
+    on_duration = on_count = on_element = None
+
+    def __init__(self, on_duration=None, on_count=None, on_element=None):
+        self.on_duration = on_duration
+        self.on_count = on_count
+        self.on_element = on_element
+
+    def stage(self, name):
+        """Return a context manager timing the stage it wraps as ``name``."""
+        return _Stage(self, name)
+
+    def duration(self, name, seconds):
+        """Record that stage ``name`` took ``seconds``."""
+        if self.on_duration is not None:
+            self.on_duration(name, seconds)
+
+    def element(self, name, id, seconds):
+        """Record that stage ``name`` took ``seconds`` on element ``id``.
+
+        ``id`` is the element's ID (e.g. the Id of an EncryptedKey, or the
+        ID an EncryptedData is referenced by), or None if it has none.
+
+        """
+        self.duration(name, seconds)
+        if self.on_element is not None:
+            self.on_element(name, id, seconds)
+
+    def count(self, name, value):
+        """Record count ``name`` (e.g. a number of bytes) as ``value``."""
+        if self.on_count is not None:
+            self.on_count(name, value)
+
+
+class NullTracer(Tracer):
+    """Tracer that ignores everything, as cheaply as possible."""
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def duration(self, name, seconds):
+        pass
+
+    def element(self, name, id, seconds):
+        pass
+
+    def count(self, name, value):
+        pass
+
+
+def tracer_from(kwargs):
+    """Return the ``tracer`` in given keyword arguments, or ``NULL_TRACER``."""
+    return kwargs.get('tracer') or NULL_TRACER
+
+
+class _Stage(object):
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+
+    def __exit__(self, *exc_info):
+        self.tracer.duration(self.name, default_timer() - self.start)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+NULL_TRACER = NullTracer()
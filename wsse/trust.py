@@ -0,0 +1,231 @@
+"""Verifying signatures with any cert issued by a trusted CA.
+
+``verify()`` normally checks a signature against one known cert. To accept
+messages from any party whose cert was issued by a trusted certificate
+authority (CA), without distributing each party's cert in advance, create a
+``TrustStore`` of the CA certs, once::
+
+    trust_store = TrustStore.from_files(['/etc/wsse/ca.pem'])
+
+    verify(envelope, None, trust_store=trust_store)
+
+The signer's cert is then taken from the message itself: from the
+ds:X509Data in the signature's ds:KeyInfo (directly, or inside a
+wsse:SecurityTokenReference, as ``sign()`` puts it), or from a
+wsse:BinarySecurityToken referenced by the wsse:SecurityTokenReference. Its
+chain is checked against the CA certs, and the signature is verified with
+it.
+
+Building and checking the chain costs about as much again as verifying the
+signature, so the parsed key of each cert that passes is cached (by the
+cert's SHA-256 fingerprint); later messages signed with the same cert skip
+the chain check entirely.
+
+"""
+import base64
+import calendar
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+import time
+
+from OpenSSL import crypto
+import xmlsec
+
+from .constants import DS_NS, NAMESPACES
+from .exceptions import (
+    MissingElement, UnresolvedReference, UntrustedCertificate)
+from .signing import Verifier
+from .xml import ns
+
+
+class TrustStore(object):
+    """Trusted CA certs, and a bounded cache of certs checked against them.
+
+    ``ca_certs`` is a list of ``OpenSSL.crypto.X509``: the root CA certs, and
+    every intermediate CA cert. Only the signer's own cert is taken from a
+    message; any other certs it carries aren't used to build the chain.
+
+    Holds the keys of at most ``max_size`` checked certs (default 1000),
+    discarding the least recently used first. Each is kept until the cert
+    expires, or (if ``ttl`` is given) for at most ``ttl`` seconds after it
+    was checked, whichever is sooner.
+
+    The cache counts ``hits``, ``misses``, ``evictions`` (to make room),
+    ``expirations`` and ``rejections`` (certs not issued by a trusted CA),
+    in ``counts``.
+
+    """
+    def __init__(self, ca_certs, max_size=1000, ttl=None, clock=time.time):
+        self.store = crypto.X509Store()
+        for cert in ca_certs:
+            self.store.add_cert(cert)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.counts = dict.fromkeys(
+            ['hits', 'misses', 'evictions', 'expirations', 'rejections'], 0)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_files(cls, cafiles, **kwargs):
+        """Create a trust store from a list of CA cert file paths.
+
+        Each file may contain one DER cert, or any number of PEM certs.
+
+        """
+        ca_data = []
+        for cafile in cafiles:
+            with open(cafile, 'rb') as fh:
+                ca_data.append(fh.read())
+        return cls.from_memory(ca_data, **kwargs)
+
+    @classmethod
+    def from_memory(cls, ca_data, **kwargs):
+        """Create a trust store from a list of CA cert data (bytes).
+
+        Each item may be one DER cert, or any number of PEM certs.
+
+        """
+        return cls(
+            [cert for data in ca_data for cert in _load_certs(data)],
+            **kwargs)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def verifier(self, **kwargs):
+        """Return a ``TrustedVerifier`` using this trust store.
+
+        Keyword arguments are as for ``Verifier``.
+
+        """
+        return TrustedVerifier(self, **kwargs)
+
+    def key(self, cert_der):
+        """Return ``xmlsec.Key`` of given DER cert, if issued by a trusted CA.
+
+        Raise ``UntrustedCertificate`` if it isn't (or can't be parsed, or
+        has expired).
+
+        """
+        fingerprint = hashlib.sha256(cert_der).digest()
+        now = self.clock()
+        with self._lock:
+            entry = self._keys.pop(fingerprint, None)
+            if entry is not None:
+                key, expires = entry
+                if expires > now:
+                    # Move to the most recently used end.
+                    self._keys[fingerprint] = entry
+                    self.counts['hits'] += 1
+                    return key
+                self.counts['expirations'] += 1
+            self.counts['misses'] += 1
+
+        try:
+            cert = crypto.load_certificate(crypto.FILETYPE_ASN1, cert_der)
+            crypto.X509StoreContext(self.store, cert).verify_certificate()
+            key = xmlsec.Key.from_memory(
+                cert_der, xmlsec.KeyFormat.CERT_DER, None)
+        except (crypto.Error, crypto.X509StoreContextError, xmlsec.Error) as e:
+            with self._lock:
+                self.counts['rejections'] += 1
+            raise UntrustedCertificate(str(e))
+        expires = _not_after(cert)
+        if self.ttl is not None:
+            expires = min(expires, now + self.ttl)
+
+        with self._lock:
+            self._keys[fingerprint] = (key, expires)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+                self.counts['evictions'] += 1
+        return key
+
+    def clear(self):
+        """Discard all cached keys (so each cert is checked again)."""
+        with self._lock:
+            self._keys.clear()
+
+
+class TrustedVerifier(Verifier):
+    """Verifies WSSE signatures with the cert in each message, if trusted.
+
+    Like ``Verifier``, but rather than with one fixed cert, verifies each
+    signature with the signer's cert found in the message (see
+    ``sender_cert()``), once ``trust_store`` (a ``TrustStore``) has checked
+    that it was issued by a trusted CA.
+
+    Create with ``TrustStore.verifier()``.
+
+    """
+    def __init__(self, trust_store, **kwargs):
+        super(TrustedVerifier, self).__init__(None, **kwargs)
+        self.trust_store = trust_store
+
+    def _key(self, signature):
+        with self.tracer.stage('verify.trust'):
+            return self.trust_store.key(sender_cert(signature))
+
+
+def sender_cert(signature):
+    """Return DER data of the signer's cert referenced by ds:Signature node.
+
+    Looks for a ds:X509Certificate in the ds:KeyInfo, either in a ds:X509Data
+    or in a wsse:SecurityTokenReference's ds:X509Data, or else for the
+    wsse:BinarySecurityToken (in the same wsse:Security header) referenced
+    by the wsse:SecurityTokenReference.
+
+    Raise ``MissingElement`` if there's no cert, or ``UnresolvedReference``
+    if the referenced token doesn't exist.
+
+    """
+    key_info = signature.find(ns(DS_NS, 'KeyInfo'))
+    if key_info is None:
+        raise MissingElement('ds:KeyInfo')
+    certs = key_info.xpath(
+        '(ds:X509Data|wsse:SecurityTokenReference/ds:X509Data)'
+        '/ds:X509Certificate/text()',
+        namespaces=NAMESPACES,
+    )
+    if certs:
+        return base64.b64decode(certs[0])
+
+    uris = key_info.xpath(
+        'wsse:SecurityTokenReference/wsse:Reference/@URI',
+        namespaces=NAMESPACES,
+    )
+    if not uris:
+        raise MissingElement('ds:X509Certificate')
+    uri = uris[0]
+    tokens = signature.getparent().xpath(
+        'wsse:BinarySecurityToken[@wsu:Id=$id]/text()',
+        namespaces=NAMESPACES,
+        id=uri[1:],
+    ) if uri.startswith('#') else []
+    if not tokens:
+        raise UnresolvedReference(uri)
+    return base64.b64decode(tokens[0])
+
+
+_PEM_CERT = re.compile(
+    b'-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', re.DOTALL)
+
+
+def _load_certs(data):
+    """Return list of ``crypto.X509`` in given PEM (any number) or DER data."""
+    if b'-----BEGIN' not in data:
+        return [crypto.load_certificate(crypto.FILETYPE_ASN1, data)]
+    return [
+        crypto.load_certificate(crypto.FILETYPE_PEM, pem)
+        for pem in _PEM_CERT.findall(data)
+    ]
+
+
+def _not_after(cert):
+    """Return time (seconds since epoch) given cert expires."""
+    return calendar.timegm(time.strptime(
+        cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ'))
@@ -0,0 +1,207 @@
+"""Structural checks of SOAP envelopes, before any key loading or crypto.
+
+A malformed envelope (e.g. with no wsse:Security header, or a reference to an
+element that doesn't exist) should be rejected before spending any effort on
+loading keys, unwrapping session keys or verifying signatures, and with a
+clear exception rather than an ``AttributeError`` from deep inside XMLSec
+handling.
+
+``check_signed()`` and ``check_encrypted()`` check the layout that
+verification and decryption rely on, resolve every reference (in the single
+pass over the document that builds the ID index of the referenced IDs) and
+enforce limits on the nesting depth and number of references. They raise a
+subclass of ``wsse.exceptions.InvalidEnvelope`` on failure. ``verify()`` and
+``decrypt()`` (and ``Verifier`` and ``Decryptor``) call them first, passing
+on their ``limits``.
+
+"""
+from lxml import etree
+
+from .constants import DS_NS, ENC_NS, SOAP_NS, WSSE_NS
+from .exceptions import LimitExceeded, MissingElement, UnresolvedReference
+from .xml import build_id_index, find_by_id, ns
+
+
+# Limits on the envelope structure; see ``check_signed()``.
+LIMIT_DEFAULTS = {
+    'max_depth': 100,
+    'max_references': 100,
+    'max_encrypted_keys': 10,
+}
+
+# Compiled XPath finding any element nested deeper than a given depth, by
+# depth.
+_depth_xpaths = {}
+
+
+def check_signed(doc, limits=None):
+    """Check signed SOAP envelope lxml element ``doc`` before verifying it.
+
+    Require a soap:Envelope with a wsse:Security header containing a
+    ds:Signature, with a ds:SignedInfo, a ds:SignatureValue and at least one
+    ds:Reference, each of whose URI is ``#`` and the (wsu:)Id of exactly one
+    element in the document. Other IDs needn't be unique.
+
+    ``limits`` is a dict overriding any of ``LIMIT_DEFAULTS``:
+
+    * ``max_depth`` (100): maximum nesting depth of elements (the
+      soap:Envelope being at depth 1).
+    * ``max_references`` (100): maximum number of ds:Reference (or, for
+      ``check_encrypted()``, xenc:DataReference) elements.
+    * ``max_encrypted_keys`` (10): maximum number of xenc:EncryptedKey
+      elements (``check_encrypted()`` only).
+
+    A limit of None disables it.
+
+    Return ``(signature, targets)``: the ds:Signature element and the list of
+    referenced elements (one per ds:Reference, in order).
+
+    """
+    limits = _limits(limits)
+    security = _security(doc)
+    signature = _find(security, DS_NS, 'Signature')
+    signed_info = _find(signature, DS_NS, 'SignedInfo')
+    _find(signature, DS_NS, 'SignatureValue', text=True)
+    refs = signed_info.findall(ns(DS_NS, 'Reference'))
+    if not refs:
+        raise MissingElement('ds:Reference')
+    _check_limit(limits, 'max_references', len(refs))
+    _check_depth(doc, limits)
+
+    index = build_id_index(doc, _referenced_ids(refs))
+    return signature, [_resolve(index, ref)[1] for ref in refs]
+
+
+def check_encrypted(doc, limits=None):
+    """Check encrypted SOAP envelope lxml element ``doc`` before decrypting.
+
+    Require a soap:Envelope with a wsse:Security header containing at least
+    one xenc:EncryptedKey. Each EncryptedKey with an xenc:ReferenceList must
+    have a CipherValue, and the URI of each xenc:DataReference must be ``#``
+    and the (wsu:)Id of exactly one xenc:EncryptedData element (other IDs
+    needn't be unique), which must have an xenc:EncryptionMethod.
+
+    See ``check_signed()`` for ``limits``.
+
+    Return a list of ``(encrypted_key, blocks)`` for each EncryptedKey with a
+    ReferenceList, where ``blocks`` is a list of ``(id, encrypted_data)``
+    for each DataReference.
+
+    """
+    limits = _limits(limits)
+    security = _security(doc)
+    enc_keys = security.findall(ns(ENC_NS, 'EncryptedKey'))
+    if not enc_keys:
+        raise MissingElement('xenc:EncryptedKey')
+    _check_limit(limits, 'max_encrypted_keys', len(enc_keys))
+
+    references = []
+    for enc_key in enc_keys:
+        ref_list = enc_key.find(ns(ENC_NS, 'ReferenceList'))
+        if ref_list is None:
+            continue
+        cipher_data = _find(enc_key, ENC_NS, 'CipherData')
+        _find(cipher_data, ENC_NS, 'CipherValue', text=True)
+        references.append(
+            (enc_key, list(ref_list.iter(ns(ENC_NS, 'DataReference')))))
+    _check_limit(
+        limits, 'max_references', sum(len(refs) for _, refs in references))
+    _check_depth(doc, limits)
+
+    index = build_id_index(
+        doc, _referenced_ids(ref for _, refs in references for ref in refs))
+    checked = []
+    for enc_key, refs in references:
+        blocks = []
+        for ref in refs:
+            referenced_id, enc_data = _resolve(
+                index, ref, ns(ENC_NS, 'EncryptedData'))
+            method = _find(enc_data, ENC_NS, 'EncryptionMethod')
+            if not method.get('Algorithm'):
+                raise MissingElement('xenc:EncryptionMethod/@Algorithm')
+            blocks.append((referenced_id, enc_data))
+        checked.append((enc_key, blocks))
+    return checked
+
+
+def _limits(limits):
+    """Return ``LIMIT_DEFAULTS`` updated with given ``limits`` dict."""
+    if not limits:
+        return LIMIT_DEFAULTS
+    unknown = set(limits) - set(LIMIT_DEFAULTS)
+    if unknown:
+        raise TypeError("Unknown limits: %s" % ', '.join(sorted(unknown)))
+    merged = dict(LIMIT_DEFAULTS)
+    merged.update(limits)
+    return merged
+
+
+def _security(doc):
+    """Return the wsse:Security header element of soap:Envelope ``doc``."""
+    if doc.tag != ns(SOAP_NS, 'Envelope'):
+        raise MissingElement('soap:Envelope')
+    header = _find(doc, SOAP_NS, 'Header')
+    return _find(header, WSSE_NS, 'Security')
+
+
+_PREFIXES = {
+    SOAP_NS: 'soap',
+    WSSE_NS: 'wsse',
+    DS_NS: 'ds',
+    ENC_NS: 'xenc',
+}
+
+
+def _find(parent, namespace, name, text=False):
+    """Return the first ``name`` child of ``parent``; raise if there's none.
+
+    If ``text`` is true, the child must also have non-blank text.
+
+    """
+    child = parent.find(ns(namespace, name))
+    if child is None or (text and not (child.text or '').strip()):
+        raise MissingElement('%s:%s' % (_PREFIXES[namespace], name))
+    return child
+
+
+def _referenced_ids(refs):
+    """Return set of IDs referenced by the URIs of given elements."""
+    return set(
+        uri[1:] for uri in (ref.get('URI') or '' for ref in refs)
+        if uri.startswith('#'))
+
+
+def _resolve(index, ref, tag=None):
+    """Return ``(id, element)`` referenced by the URI of element ``ref``.
+
+    Raise ``UnresolvedReference`` if the URI isn't a same-document reference
+    to an element in ``index`` (of the given ``tag``, if any), or
+    ``DuplicateId`` if more than one element has the referenced ID.
+
+    """
+    uri = ref.get('URI') or ''
+    element = find_by_id(index, uri[1:]) if uri.startswith('#') else None
+    if element is None or (tag is not None and element.tag != tag):
+        raise UnresolvedReference(uri)
+    return uri[1:], element
+
+
+def _check_limit(limits, name, value):
+    limit = limits[name]
+    if limit is not None and value > limit:
+        raise LimitExceeded("%s: %d > %d" % (name, value, limit))
+
+
+def _check_depth(doc, limits):
+    """Raise ``LimitExceeded`` if ``doc`` is nested more than allowed."""
+    depth = limits['max_depth']
+    if depth is None:
+        return
+    xpath = _depth_xpaths.get(depth)
+    if xpath is None:
+        # Evaluated in C, one level at a time, so much cheaper than walking
+        # the tree in Python.
+        xpath = _depth_xpaths[depth] = etree.XPath(
+            'boolean(%s)' % '/'.join(['*'] * depth))
+    if xpath(doc):
+        raise LimitExceeded("max_depth: > %d" % depth)
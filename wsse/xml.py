@@ -1,6 +1,10 @@
+import threading
 from uuid import uuid4
 
+from lxml import etree
+
 from .constants import WSU_NS
+from .exceptions import DuplicateId
 
 
 def ns(namespace, tagname):
@@ -9,6 +13,76 @@ def ns(namespace, tagname):
 
 ID_ATTR = ns(WSU_NS, 'Id')
 
+# Finds all elements with a wsu:Id or plain Id attribute in a single pass.
+_ID_XPATH = etree.XPath(
+    'descendant-or-self::*[@wsu:Id or @Id]', namespaces={'wsu': WSU_NS})
+
+
+# Options for the parser used to parse all envelopes; see
+# ``configure_parser()``.
+PARSER_DEFAULTS = {
+    'resolve_entities': False,
+    'no_network': True,
+    'huge_tree': False,
+    'remove_blank_text': False,
+}
+
+_parser_options = dict(PARSER_DEFAULTS)
+# Incremented whenever the options change, so cached parsers are replaced.
+_parser_generation = [0]
+_local = threading.local()
+
+
+def configure_parser(**options):
+    """Change the options of the parser used to parse envelopes.
+
+    The options are passed to ``lxml.etree.XMLParser``; those that may be
+    changed (and their defaults) are:
+
+    * ``resolve_entities`` (``False``): substitute entities. Leaving this off
+      prevents entity expansion attacks.
+    * ``no_network`` (``True``): refuse network access when loading DTDs.
+    * ``huge_tree`` (``False``): lift libxml2's limits on document depth and
+      text node size (10MB), for very large envelopes. This also disables
+      some protection against malicious documents.
+    * ``remove_blank_text`` (``False``): discard whitespace-only text between
+      elements. Note that this changes the content of signed elements, so
+      breaks verification of signatures made over indented XML.
+
+    The options apply to all threads, from their next parse.
+
+    """
+    unknown = set(options) - set(PARSER_DEFAULTS)
+    if unknown:
+        raise TypeError(
+            "Unknown parser options: %s" % ', '.join(sorted(unknown)))
+    _parser_options.update(options)
+    _parser_generation[0] += 1
+
+
+def parser_options():
+    """Return (a copy of) the current parser options."""
+    return dict(_parser_options)
+
+
+def get_parser():
+    """Return this thread's parser, configured as by ``configure_parser()``.
+
+    Parsers are created once per thread (an lxml parser can't be used by two
+    threads at once) and reused for every envelope.
+
+    """
+    generation = _parser_generation[0]
+    if getattr(_local, 'generation', None) != generation:
+        _local.parser = etree.XMLParser(**_parser_options)
+        _local.generation = generation
+    return _local.parser
+
+
+def fromstring(envelope):
+    """Parse given envelope (string) with this thread's parser."""
+    return etree.fromstring(envelope, get_parser())
+
 
 def get_unique_id():
     return 'id-{0}'.format(uuid4())
@@ -25,3 +99,43 @@ def ensure_id(node):
         id_val = get_unique_id()
         node.set(ID_ATTR, id_val)
     return id_val
+
+
+def build_id_index(doc, ids=None):
+    """Return dict mapping wsu:Id and Id values in ``doc`` to their elements.
+
+    Traverses the document only once, so looking up many references by ID is
+    much cheaper than an XPath search of the whole document per reference.
+    If ``ids`` (a set) is given, only those IDs are indexed.
+
+    An ID that more than one element has maps to None; look IDs up with
+    ``find_by_id()``, which raises ``DuplicateId`` for it. Only the IDs that
+    are actually referenced need be unique: application payloads may repeat
+    plain ``Id`` attributes that nothing refers to.
+
+    """
+    index = {}
+    for node in _ID_XPATH(doc):
+        for attr in (ID_ATTR, 'Id'):
+            id_val = node.get(attr)
+            if id_val is None or (ids is not None and id_val not in ids):
+                continue
+            if index.setdefault(id_val, node) is not node:
+                index[id_val] = None
+    return index
+
+
+def find_by_id(index, id_val):
+    """Return element with given ID in ``build_id_index()`` result ``index``.
+
+    Return None if there is no such element. Raise ``DuplicateId`` if more
+    than one element has the ID; an ambiguous reference could otherwise be
+    used to make a signature or decryption apply to a different element
+    than the one the application later reads (an "XML signature wrapping"
+    attack).
+
+    """
+    element = index.get(id_val)
+    if element is None and id_val in index:
+        raise DuplicateId(id_val)
+    return element
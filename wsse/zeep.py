@@ -0,0 +1,49 @@
+"""Zeep WS-Security (WSSE) object for encryption/signing."""
+from __future__ import absolute_import
+
+from .plugin import PluginBase
+
+
+class ZeepWsse(PluginBase):
+    """Zeep ``wsse`` object that performs WS-Security signing and encryption.
+
+    Pass an instance as the ``wsse`` argument to ``zeep.Client``. Zeep passes
+    it the parsed (``lxml``) envelope of each message, which is signed and
+    encrypted (outgoing) or decrypted and verified (incoming) in place, so
+    there's no extra parsing or serialization.
+
+    Takes the same arguments as ``wsse.suds.WssePlugin``. The keys and certs
+    are loaded once, when it is created (or, given ``wsse.keys.KeySource``
+    objects instead of file paths, reloaded when they change). Unlike with
+    Suds, there is no separate way to add the wsu:Timestamp, so by default
+    (``timestamp_ttl`` 300) a wsse:Security header with a fresh timestamp,
+    expiring after that many seconds, is inserted into each outgoing message
+    (see ``wsse.security``). If ``timestamp_ttl`` is None, each message must
+    already have one.
+
+    Only SOAP 1.1 envelopes are supported.
+
+    """
+    def __init__(self, keyfile, certfile, their_certfile, timestamp_ttl=300,
+                 **kwargs):
+        super(ZeepWsse, self).__init__(
+            keyfile, certfile, their_certfile, timestamp_ttl=timestamp_ttl,
+            **kwargs)
+
+    def apply(self, envelope, headers):
+        """Sign and encrypt outgoing envelope (lxml element) in place.
+
+        Return the envelope and the (unchanged) HTTP ``headers``, as Zeep
+        expects.
+
+        """
+        return self.sign_and_encrypt_tree(envelope), headers
+
+    def verify(self, envelope):
+        """Decrypt and verify signature of incoming envelope, in place.
+
+        Raise ``SignatureVerificationFailed`` (or, for a malformed envelope,
+        ``InvalidEnvelope``) on failure. Return the envelope.
+
+        """
+        return self.decrypt_and_verify_tree(envelope)